@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Card alignment: reused and printed-box alignments against SIFT feature matching.
+
+Runs ImageProcessor.align_image over scanned caution cards, in order, as one
+scan session and reports how often each method aligned a card (identity or
+the previous card's homography passing the thumbnail check, printed-box
+registration, SIFT), the alignment time distribution per method, and, with
+--compare-sift, how far the fast-path homography puts the region corners
+from where SIFT puts them (template pixels).
+
+With --same-placement every card after the first is resampled into the first
+card's placement, as if the whole stack had been fed through one scanner
+without moving: the content differs card to card, the geometry does not.
+
+    python scripts/benchmark_alignment.py test_data/*.png test_data/*.tif --compare-sift
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+OCR_DIR = Path(__file__).parent.parent / "src" / "ocr"
+sys.path.append(str(OCR_DIR))
+
+import card_registration  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+
+RESOURCES = OCR_DIR / "resources"
+
+
+def quantiles(values):
+    if not values:
+        return None
+    values = np.array(values)
+    return {'count': len(values), 'p50': round(float(np.percentile(values, 50)), 4),
+            'p90': round(float(np.percentile(values, 90)), 4), 'max': round(float(values.max()), 4)}
+
+
+def region_corners(coordinates):
+    points = []
+    for region in coordinates['regions'].values():
+        x, y, w, h = region['x'], region['y'], region['width'], region['height']
+        points += [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+    return np.float32(points).reshape(-1, 1, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='+', help='Scanned card images')
+    parser.add_argument('--compare-sift', action='store_true', help='Also align every card with SIFT and compare')
+    parser.add_argument('--same-placement', action='store_true', help='Resample every card into the first card\'s placement')
+    args = parser.parse_args()
+
+    processor = ImageProcessor(
+        str(RESOURCES / "templates/caution_card_template.png"),
+        str(RESOURCES / "masks/alignment_mask.png"),
+        str(RESOURCES / "masks/manualmask.png"),
+        str(RESOURCES / "coordinates/caution_card_coords.json"))
+    corners = region_corners(processor.coordinates)
+
+    seconds = {method: [] for method in processor.alignment_counts}
+    sift_seconds, disagreement, cards = [], [], []
+    first = None
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        if args.same_placement:
+            registration = card_registration.register(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), processor.reference_layout)
+            if first is None:
+                first = (image.shape, registration.homography)
+            elif registration is not None:
+                # This card's pixels, through the template, into the first card's scan frame
+                (height, width, _), homography = first
+                image = cv2.warpPerspective(image, np.linalg.inv(homography) @ registration.homography, (width, height),
+                                            borderValue=(255, 255, 255))
+        counts = dict(processor.alignment_counts)
+        start = time.perf_counter()
+        try:
+            _, homography, _ = processor.align_image(image)
+        except card_registration.CardOrientationError:
+            homography = None
+        elapsed = time.perf_counter() - start
+        method = next(name for name, count in processor.alignment_counts.items() if count != counts[name])
+        seconds[method].append(elapsed)
+        card = {'image': Path(path).name, 'method': method, 'seconds': round(elapsed, 4)}
+
+        if args.compare_sift and method not in ('sift', 'failed', 'rejected'):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            start = time.perf_counter()
+            sift, _ = processor._sift_homography(gray)
+            sift_seconds.append(time.perf_counter() - start)
+            if sift is not None:
+                # Region corners taken into the scan by SIFT and back into the template by the fast path
+                in_scan = cv2.perspectiveTransform(corners, np.linalg.inv(sift))
+                error = np.linalg.norm(cv2.perspectiveTransform(in_scan, homography) - corners, axis=2)
+                card['sift_disagreement_px'] = {'mean': round(float(error.mean()), 2), 'max': round(float(error.max()), 2)}
+                disagreement.append(float(error.max()))
+        cards.append(card)
+
+    total = sum(len(values) for values in seconds.values())
+    report = {
+        'cards': cards,
+        'method_rates': {method: round(len(values) / total, 3) if total else None for method, values in seconds.items()},
+        'fast_path_rate': round(1 - sum(len(seconds[method]) for method in ('sift', 'failed', 'rejected')) / total, 3)
+        if total else None,
+        'seconds': {method: quantiles(values) for method, values in seconds.items()},
+    }
+    if args.compare_sift:
+        report['sift_only_seconds'] = quantiles(sift_seconds)
+        report['max_sift_disagreement_px'] = round(max(disagreement), 2) if disagreement else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Card stacks: throughput of process_cards at different process pool sizes.
+
+Prints --cards synthetic cards at scan scale: the template from
+generate_template.py drawn over the alignment mask (the generated template
+alone has no card outline to align on), each with a patient's name and a
+little jitter in its position on the page. Writes them with a manifest to a
+temporary directory and reads the manifest through process_cards with each
+--workers pool size (0 prepares the cards in the reading process). Reports
+cards per minute, time to the first card and cards read for each.
+
+Without --ocr the TrOCR model is not loaded and every crop reads as an empty
+string, so the times are of the CPU stages the pool runs and of batching.
+Pool sizes beyond the machine's cores cannot run any faster.
+
+    python scripts/benchmark_cards.py --cards 24 --workers 0 1 2 4
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+SCRIPTS_DIR = Path(__file__).parent
+OCR_DIR = SCRIPTS_DIR.parent / "src" / "ocr"
+sys.path.append(str(SCRIPTS_DIR))
+sys.path.append(str(OCR_DIR))
+
+import process_card  # noqa: E402
+from generate_template import generate_template  # noqa: E402
+
+NAMES = ["Ann Lee", "Bo Diaz", "Cy Wu", "Di Ray", "Ed Fox", "Flo Kim", "Gus Oh", "Hal Yu"]
+
+
+class EmptyHandler:
+    """Stands in for TrOCR: reads every crop as an empty string"""
+
+    def generate_batch(self, images, max_length):
+        return [("", 1)] * len(images)
+
+
+def synthetic_card():
+    """The generated template drawn over the alignment mask"""
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_template()
+            template = cv2.imread("form_ocr/resources/templates/caution_card_template.png", cv2.IMREAD_GRAYSCALE)
+        finally:
+            os.chdir(cwd)
+    mask = cv2.imread(str(OCR_DIR / "resources/masks/alignment_mask.png"), cv2.IMREAD_GRAYSCALE)
+    return np.minimum(template, cv2.resize(mask, (template.shape[1], template.shape[0])))
+
+
+def write_cards(card, count, directory):
+    """``count`` scans of the card with names and jitter, and a manifest listing them"""
+    rng = np.random.default_rng(0)
+    names = []
+    for index in range(count):
+        scan = np.full((3300, 5100), 255, np.uint8)
+        filled = card.copy()
+        cv2.putText(filled, NAMES[index % len(NAMES)], (120, 110), cv2.FONT_HERSHEY_SIMPLEX, 2.5, 30, 6)
+        printed = cv2.resize(filled, None, fx=1.9, fy=1.9, interpolation=cv2.INTER_LINEAR)
+        y, x = 200 + rng.integers(0, 80), 100 + rng.integers(0, 80)
+        scan[y:y + printed.shape[0], x:x + printed.shape[1]] = printed
+        names.append(f"card{index:03d}.png")
+        cv2.imwrite(str(Path(directory) / names[-1]), scan)
+    manifest = Path(directory) / "manifest.txt"
+    manifest.write_text("\n".join(names) + "\n")
+    return str(manifest)
+
+
+def run(manifest, workers):
+    start = time.perf_counter()
+    first = None
+    read = 0
+    for result in process_card.process_cards(process_card.read_card_manifest(manifest), workers):
+        first = first or time.perf_counter() - start
+        read += result['status'] == 'success'
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 2), 'first_card_seconds': round(first, 2), 'read': read,
+            'cards_per_minute': round(read * 60 / seconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=24, help='Cards in the stack')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4], help='Pool sizes to time')
+    parser.add_argument('--ocr', action='store_true', help='Read the fields with TrOCR')
+    args = parser.parse_args()
+
+    if args.ocr:
+        from trocr_handler import TrOCRHandler
+        handler = TrOCRHandler()
+        process_card.TrOCRHandler = lambda: handler
+    else:
+        process_card.TrOCRHandler = EmptyHandler
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = write_cards(synthetic_card(), args.cards, directory)
+        report = {'cards': args.cards, 'cpus': os.cpu_count(),
+                  'cards_per_batch': int(os.environ.get('OCR_CARDS_PER_BATCH', process_card.CARDS_PER_BATCH))}
+        for workers in args.workers:
+            report[f'workers_{workers}'] = run(manifest, workers)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Noise-adaptive denoising against NL-means on every card.
+
+Aligns each scanned card once, optionally with Gaussian noise added to the
+scan first (--noise, grey levels), and masks it twice: with NL-means on
+every card, as before, and with the method the estimated noise picks.
+Reports the mask stage time of each, the estimated noise and the method
+picked, and how well the two agree on what the pipeline reads: which
+fields are empty, the phenotype cell results, the ink of the crops both
+send to OCR (intersection over union of their dark pixels) and, with
+--ocr, the TrOCR text of every field either one sends to OCR (beam search
+without sampling, so that both read the same crops the same way).
+
+    python scripts/benchmark_denoising.py test_data/*.png test_data/*.tif --noise 0 4 8 --ocr
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+OCR_DIR = Path(__file__).parent.parent / "src" / "ocr"
+sys.path.append(str(OCR_DIR))
+
+import denoising  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+
+RESOURCES = OCR_DIR / "resources"
+
+
+def quantiles(values):
+    if not values:
+        return None
+    values = np.array(values)
+    return {'count': len(values), 'p50': round(float(np.percentile(values, 50)), 4),
+            'p90': round(float(np.percentile(values, 90)), 4), 'max': round(float(values.max()), 4)}
+
+
+def read_fields(processor, aligned, method):
+    """Mask an aligned card with one denoising method; returns (seconds, regions)"""
+    processor.denoising = method
+    start = time.perf_counter()
+    masked = processor.apply_mask(aligned)
+    seconds = time.perf_counter() - start
+    return seconds, processor._extract_regions(masked)
+
+
+def ocr_crops(regions):
+    return {name: data for name, data in regions.items() if data is not None and not isinstance(data, dict)}
+
+
+def ink_overlap(first, second):
+    """Intersection over union of the dark pixels of two crops of the same field"""
+    first, second = np.asarray(first)[..., 0] < 128, np.asarray(second)[..., 0] < 128
+    union = (first | second).sum()
+    return float((first & second).sum() / union) if union else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='+', help='Scanned card images')
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0],
+                        help='Standard deviations (grey levels) of Gaussian noise added to each scan')
+    parser.add_argument('--ocr', action='store_true', help='Also compare the TrOCR text of the fields')
+    args = parser.parse_args()
+
+    processor = ImageProcessor(
+        str(RESOURCES / "templates/caution_card_template.png"),
+        str(RESOURCES / "masks/alignment_mask.png"),
+        str(RESOURCES / "masks/manualmask.png"),
+        str(RESOURCES / "coordinates/caution_card_coords.json"))
+    handler = None
+    if args.ocr:
+        from trocr_handler import TrOCRHandler
+        handler = TrOCRHandler()
+        handler.set_generation_params(do_sample=False)
+
+    rng = np.random.default_rng(0)
+    cards = []
+    seconds = {'nlmeans': [], 'auto': []}
+    totals = {'fields': 0, 'empty_agree': 0, 'phenotype': 0, 'phenotype_agree': 0, 'ocr': 0, 'ocr_agree': 0}
+    overlaps = []
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        for noise in args.noise:
+            scan = image
+            if noise:
+                scan = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+            aligned, _, _ = processor.align_image(scan)
+            gray = cv2.cvtColor(aligned, cv2.COLOR_BGR2GRAY)
+            estimate = denoising.estimate_noise(gray, processor.manual_mask)
+
+            counts = dict(processor.denoise_counts)
+            auto_seconds, auto = read_fields(processor, aligned, "auto")
+            method = next(name for name, count in processor.denoise_counts.items() if count != counts[name])
+            full_seconds, full = read_fields(processor, aligned, "nlmeans")
+            seconds['auto'].append(auto_seconds)
+            seconds['nlmeans'].append(full_seconds)
+
+            names = list(full)
+            empty_agree = sum((full[name] is None) == (auto[name] is None) for name in names)
+            phenotype = [name for name in names if isinstance(full[name], dict) or isinstance(auto[name], dict)]
+            phenotype_agree = sum(
+                isinstance(full[name], dict) and isinstance(auto[name], dict)
+                and full[name]['analysis'] == auto[name]['analysis'] for name in phenotype)
+            full_crops, auto_crops = ocr_crops(full), ocr_crops(auto)
+            card_overlaps = [ink_overlap(full_crops[name], auto_crops[name]) for name in full_crops if name in auto_crops]
+            overlaps += card_overlaps
+            card = {'image': Path(path).name, 'added_noise': noise, 'estimated_noise': round(estimate, 2),
+                    'method': method, 'mask_seconds': {'nlmeans': round(full_seconds, 3), 'auto': round(auto_seconds, 3)},
+                    'empty_agreement': f"{empty_agree}/{len(names)}",
+                    'phenotype_agreement': f"{phenotype_agree}/{len(phenotype)}",
+                    'ink_overlap': round(float(np.mean(card_overlaps)), 4) if card_overlaps else None}
+            totals['fields'] += len(names)
+            totals['empty_agree'] += empty_agree
+            totals['phenotype'] += len(phenotype)
+            totals['phenotype_agree'] += phenotype_agree
+
+            if handler is not None:
+                fields = sorted(set(full_crops) | set(auto_crops))
+                texts = {}
+                for label, crops in (('nlmeans', full_crops), ('auto', auto_crops)):
+                    read = [name for name in fields if name in crops]
+                    results = handler.generate_batch([crops[name] for name in read]) if read else []
+                    texts[label] = {name: text for name, (text, _) in zip(read, results)}
+                agree = [name for name in fields if texts['nlmeans'].get(name) == texts['auto'].get(name)]
+                card['ocr_agreement'] = f"{len(agree)}/{len(fields)}"
+                card['ocr_differences'] = {name: [texts['nlmeans'].get(name), texts['auto'].get(name)]
+                                           for name in fields if name not in agree}
+                totals['ocr'] += len(fields)
+                totals['ocr_agree'] += len(agree)
+            cards.append(card)
+            print(json.dumps(card), file=sys.stderr)
+
+    report = {
+        'cards': cards,
+        'mask_seconds': {method: quantiles(values) for method, values in seconds.items()},
+        'mask_seconds_saved': round(sum(seconds['nlmeans']) - sum(seconds['auto']), 2),
+        'methods': {method: sum(card['method'] == method for card in cards) for method in denoising.METHODS},
+        'empty_agreement': round(totals['empty_agree'] / totals['fields'], 4) if totals['fields'] else None,
+        'phenotype_agreement': round(totals['phenotype_agree'] / totals['phenotype'], 4) if totals['phenotype'] else None,
+        'ink_overlap_mean': round(float(np.mean(overlaps)), 4) if overlaps else None,
+    }
+    if handler is not None:
+        report['ocr_agreement'] = round(totals['ocr_agree'] / totals['ocr'], 4) if totals['ocr'] else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Throughput of patient field extraction: per-call regexes vs the precompiled extractor.
+
+Compares the old per-call extraction (copied below), FieldExtractor one text
+at a time and in bulk, and, through an in-process OCR server, N
+``extract_data`` requests against one ``extract_data_batch`` request.
+Outputs of every path are checked against each other.
+
+    python scripts/benchmark_field_extraction.py --count 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "src" / "ocr"))
+
+import field_extractor  # noqa: E402
+
+LEGACY_PATTERNS = field_extractor.FIELD_PATTERNS
+
+
+def legacy_clean_field_value(value, field_type=None):
+    if not value:
+        return value
+    value = value.split('\n')[0].strip()
+    value = re.sub(r'\s*(?:Name|DOB|Gender|Contact|Blood Type|Born|Sex|Tel|Phone|Blood Group|Some|Random|More|text|here|notes).*$', '', value, flags=re.IGNORECASE)
+    value = re.sub(r'[:\s]+$', '', value)
+    if field_type == 'gender':
+        value = value.lower().strip()
+        if value in ['m', 'male', 'm.', 'man']:
+            value = 'Male'
+        elif value in ['f', 'female', 'f.', 'woman']:
+            value = 'Female'
+        elif value:
+            value = value.capitalize()
+            if value not in ['Male', 'Female']:
+                return None
+    elif field_type == 'name':
+        value = re.sub(r'\s{2,}.*$', '', value)
+        value = re.sub(r'[,;].*$', '', value)
+        value = re.sub(r'\s+(?:Some|Random|other|text|here|notes).*$', '', value, flags=re.IGNORECASE)
+    return value.strip()
+
+
+def legacy_extract_patient_data(text):
+    text = re.sub(r'[\r\n]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    extracted_data = {}
+    for field, pattern in LEGACY_PATTERNS.items():
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            value = legacy_clean_field_value(match.group(1).strip(), field)
+            if value:
+                extracted_data[field] = value
+    return extracted_data
+
+
+def synthetic_texts(count, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        texts.append(
+            f"Patient Name: {rng.choice(['John', 'Maria', 'Linda', 'David'])} {rng.choice(['Smith', 'Lopez', 'Nguyen'])}\n"
+            f"Date of Birth: {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1940, 2015)}\n"
+            f"Gender: {rng.choice(['M', 'Female', 'male', 'X'])}\nContact: 555-{rng.randint(1000, 9999)}\n"
+            f"Blood Type: {rng.choice(['O POS', 'A NEG', 'AB+'])}\n"
+            + "Some notes here about transfusion history. " * rng.randint(0, 3)
+        )
+    return texts
+
+
+def timed(run):
+    start = time.perf_counter()
+    results = run()
+    return results, time.perf_counter() - start
+
+
+def server_round_trips(texts):
+    """N extract_data requests vs one extract_data_batch request through OCRServer.process_request"""
+    from ocr_processor import OCRProcessor
+    from ocr_server import OCRServer
+
+    server = OCRServer()
+    # Extraction does not touch the model, so the processor is created without loading one
+    server.processor = OCRProcessor.__new__(OCRProcessor)
+
+    async def scenario():
+        server.queue = server.create_queue()
+        worker = asyncio.create_task(server._worker())
+        try:
+            singles, single_seconds = [], time.perf_counter()
+            for text in texts:
+                response = await server.process_request({'command': 'extract_data', 'text': text})
+                singles.append(response['data'])
+            single_seconds = time.perf_counter() - single_seconds
+            start = time.perf_counter()
+            batch = await server.process_request({'command': 'extract_data_batch', 'texts': texts})
+            return singles, single_seconds, batch['results'], time.perf_counter() - start
+        finally:
+            worker.cancel()
+
+    return asyncio.run(scenario())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=20000, help='Synthetic texts to extract from')
+    parser.add_argument('--input', help='JSON file with a list of OCR texts instead of synthetic ones')
+    parser.add_argument('--no-server', action='store_true', help='Skip the server round-trip comparison')
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, 'r') as f:
+            texts = json.load(f)
+    else:
+        texts = synthetic_texts(args.count)
+
+    legacy, legacy_seconds = timed(lambda: [legacy_extract_patient_data(text) for text in texts])
+    single, single_seconds = timed(lambda: [field_extractor.extract_patient_data(text) for text in texts])
+    bulk, bulk_seconds = timed(lambda: field_extractor.extract_batch(texts))
+
+    def rate(seconds, count=len(texts)):
+        return {'seconds': round(seconds, 4), 'texts_per_second': round(count / seconds)}
+
+    report = {
+        'texts': len(texts),
+        'legacy': rate(legacy_seconds),
+        'extractor': rate(single_seconds),
+        'extractor_batch': rate(bulk_seconds),
+        'identical': legacy == single == bulk
+    }
+    if not args.no_server:
+        server_texts = texts[:2000]
+        singles, singles_seconds, batch, batch_seconds = server_round_trips(server_texts)
+        report['server'] = {
+            'texts': len(server_texts),
+            'extract_data_requests': rate(singles_seconds, len(server_texts)),
+            'extract_data_batch_request': rate(batch_seconds, len(server_texts)),
+            'identical': singles == batch == legacy[:len(server_texts)]
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
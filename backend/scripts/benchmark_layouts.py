@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Card-version detection: cost and accuracy as more layouts are registered.
+
+Registers the bundled caution card and a second revision, the same card
+mirrored left to right (the scans are mirrored too, so half the cards are
+each revision), plus further copies of the mirrored revision up to each
+--layouts count: copies fit as well as the real one does, so they cost as
+much to rule out as a real revision would. For every scan and its mirror
+image, reports how long identifying the layout and aligning the card with
+it take, against aligning it with the right layout alone, and how often the
+right revision was picked. Each card is identified from scratch unless
+--session is given, in which case the previous card's layout is checked on
+a thumbnail first.
+
+    python scripts/benchmark_layouts.py test_data/*.png test_data/*.tif --layouts 1 2 4 8
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+OCR_DIR = Path(__file__).parent.parent / "src" / "ocr"
+sys.path.append(str(OCR_DIR))
+
+from image_processor import ImageProcessor  # noqa: E402
+from layout_registry import LayoutRegistry  # noqa: E402
+
+RESOURCES = OCR_DIR / "resources"
+LAYOUT_FILES = {
+    "template": "templates/caution_card_template.png",
+    "alignment_mask": "masks/alignment_mask.png",
+    "manual_mask": "masks/manualmask.png",
+    "coordinates": "coordinates/caution_card_coords.json",
+}
+
+
+def quantiles(values):
+    if not values:
+        return None
+    values = np.array(values)
+    return {'count': len(values), 'p50': round(float(np.percentile(values, 50)), 4),
+            'p90': round(float(np.percentile(values, 90)), 4), 'max': round(float(values.max()), 4)}
+
+
+def mirrored_processor(directory):
+    """An ImageProcessor for the caution card mirrored left to right, fields and all"""
+    paths = {}
+    for key, name in LAYOUT_FILES.items():
+        paths[key] = str(directory / Path(name).name)
+        if key == "coordinates":
+            coordinates = json.loads((RESOURCES / name).read_text())
+            width = coordinates["template_dimensions"]["width"]
+            for region in coordinates["regions"].values():
+                region["x"] = width - region["x"] - region["width"]
+            Path(paths[key]).write_text(json.dumps(coordinates))
+        else:
+            cv2.imwrite(paths[key], cv2.imread(str(RESOURCES / name))[:, ::-1])
+    return ImageProcessor(*(paths[key] for key in LAYOUT_FILES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='+', help='Scanned card images')
+    parser.add_argument('--layouts', type=int, nargs='+', default=[1, 2, 4, 8], help='Numbers of layouts to register')
+    parser.add_argument('--session', action='store_true', help='Check the previous card\'s layout first')
+    args = parser.parse_args()
+
+    original = ImageProcessor(*(str(RESOURCES / name) for name in LAYOUT_FILES.values()))
+    with tempfile.TemporaryDirectory() as directory:
+        mirrored = mirrored_processor(Path(directory))
+    scans = []
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is not None:
+            scans += [(Path(path).name, "caution_card", image),
+                      (Path(path).name + " (mirrored)", "mirrored", np.ascontiguousarray(image[:, ::-1]))]
+
+    # Alignment with the right layout alone, for reference
+    baseline = []
+    for _, expected, image in scans:
+        processor = original if expected == "caution_card" else mirrored
+        processor.reset_session()
+        start = time.perf_counter()
+        processor.align_image(image)
+        baseline.append(time.perf_counter() - start)
+
+    reports = []
+    for count in args.layouts:
+        processors = {"caution_card": original}
+        if count > 1:
+            processors["mirrored"] = mirrored
+        for index in range(2, count):
+            processors[f"mirrored_copy_{index - 1}"] = mirrored
+        registry = LayoutRegistry(processors)
+        identify, total, correct = [], [], 0
+        for name, expected, image in scans:
+            if not args.session:
+                registry.reset_session()
+            start = time.perf_counter()
+            match = registry.identify(image)
+            identified = time.perf_counter()
+            match.processor.align_image(image, match.scan, match.known)
+            identify.append(identified - start)
+            total.append(time.perf_counter() - start)
+            correct += match.processor is (original if expected == "caution_card" else mirrored)
+        report = {'layouts': count, 'identify_seconds': quantiles(identify),
+                  'identify_and_align_seconds': quantiles(total), 'align_alone_seconds': quantiles(baseline),
+                  'overhead': round(sum(total) / sum(baseline) - 1, 4),
+                  'accuracy': round(correct / len(scans), 4) if count > 1 else None}
+        print(json.dumps(report), file=sys.stderr)
+        reports.append(report)
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
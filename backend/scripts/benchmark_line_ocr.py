@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Compare whole-page and line-segmented OCR on synthetic multi-line forms.
+
+Renders patient forms with known text, runs OCRProcessor.process_image with
+and without line segmentation, and reports seconds per page, character
+error rate (CER) against the rendered text and how many fields
+extract_patient_data recovers.
+
+    python scripts/benchmark_line_ocr.py --model microsoft/trocr-large-handwritten --pages 5
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent / "src" / "ocr"))
+
+from line_segmentation import segment_lines  # noqa: E402
+
+FIRST_NAMES = ["John", "Maria", "David", "Linda", "James", "Karen", "Robert", "Susan"]
+LAST_NAMES = ["Smith", "Garcia", "Nguyen", "Miller", "Brown", "Lopez", "Wilson", "Clark"]
+BLOOD_TYPES = ["O POS", "O NEG", "A POS", "A NEG", "B POS", "AB POS"]
+FONTS = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX]
+
+
+def synthetic_form(rng: random.Random):
+    """A white page with one labelled field per line. Returns (image, lines, fields)."""
+    fields = {
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "dob": f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1940, 2015)}",
+        "gender": rng.choice(["Male", "Female"]),
+        "contact_number": f"555-{rng.randint(1000, 9999)}",
+        "blood_type": rng.choice(BLOOD_TYPES),
+    }
+    lines = [
+        f"Patient Name: {fields['name']}",
+        f"Date of Birth: {fields['dob']}",
+        f"Gender: {fields['gender']}",
+        f"Contact: {fields['contact_number']}",
+        f"Blood Type: {fields['blood_type']}",
+    ]
+    page = np.full((120 + 70 * len(lines), 1000, 3), 255, dtype=np.uint8)
+    font = rng.choice(FONTS)
+    for i, line in enumerate(lines):
+        y = 80 + 70 * i + rng.randint(-5, 5)
+        cv2.putText(page, line, (40 + rng.randint(0, 20), y), font, 1.1, (20, 20, 20), 2, cv2.LINE_AA)
+        # Form rule under the line, as on printed forms
+        cv2.line(page, (30, y + 14), (970, y + 14), (90, 90, 90), 1)
+    noise = np.random.default_rng(rng.randint(0, 2**31)).normal(0, 6, page.shape)
+    page = np.clip(page.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    return page, lines, fields
+
+
+def edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def cer(reference: str, hypothesis: str) -> float:
+    """Character error rate, comparing case-insensitively with whitespace collapsed"""
+    reference = " ".join(reference.lower().split())
+    hypothesis = " ".join(hypothesis.lower().split())
+    return edit_distance(reference, hypothesis) / max(len(reference), 1)
+
+
+def run(processor, pages, line_segmentation: bool):
+    processor.line_segmentation = line_segmentation
+    seconds, errors, fields_found, fields_total = [], [], 0, 0
+    for path, lines, fields in pages:
+        start = time.perf_counter()
+        try:
+            text = processor.process_image(path)
+        except Exception:
+            text = ""
+        seconds.append(time.perf_counter() - start)
+        errors.append(cer("\n".join(lines), text))
+        extracted = processor.extract_patient_data(text)
+        fields_total += len(fields)
+        fields_found += sum(1 for name, value in fields.items()
+                            if extracted.get(name, "").lower() == value.lower())
+    return {
+        "seconds_per_page": round(sum(seconds) / len(seconds), 3),
+        "cer": round(sum(errors) / len(errors), 4),
+        "fields_extracted": f"{fields_found}/{fields_total}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="microsoft/trocr-large-handwritten", help="TrOCR model to benchmark")
+    parser.add_argument("--pages", type=int, default=5, help="Synthetic forms to read")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--segmentation-only", action="store_true",
+                        help="Only check that the segmenter finds every rendered line (no model needed)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        pages = []
+        found = 0
+        for i in range(args.pages):
+            image, lines, fields = synthetic_form(rng)
+            path = str(Path(tmp) / f"form_{i}.png")
+            cv2.imwrite(path, image)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+            found += len({box.line for box in segment_lines(binary)}) == len(lines)
+            pages.append((path, lines, fields))
+        report = {"pages": args.pages, "pages_with_all_lines_found": found}
+
+        if not args.segmentation_only:
+            from ocr_processor import OCRProcessor
+            processor = OCRProcessor(args.model)
+            report["whole_page"] = run(processor, pages, line_segmentation=False)
+            report["line_segmented"] = run(processor, pages, line_segmentation=True)
+            processor.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Multi-card sheets: cards found and whole-sheet throughput against card-by-card processing.
+
+Lays the scanned cards out --per-sheet at a time, two to a row with every
+other card upside down, on sheets like a flatbed backfill scan, and runs
+each sheet through process_card_sheet. Reports how many of the cards placed
+were found and read, cards per minute for whole sheets (decode, split, card
+pipeline and OCR, without model loading) and the number of OCR batches,
+against running the same scans one at a time through process_card_layouts.
+
+Without --ocr the TrOCR model is not loaded and every crop reads as an empty
+string, so the times cover everything but generation and the batch counts
+show what batching across the cards of a sheet saves.
+
+    python scripts/benchmark_sheets.py test_data/*.png test_data/*.tif --per-sheet 4
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+OCR_DIR = Path(__file__).parent.parent / "src" / "ocr"
+sys.path.append(str(OCR_DIR))
+
+import process_card  # noqa: E402
+from layout_registry import LayoutRegistry  # noqa: E402
+
+# Space (pixels) between cards and around the edge of a sheet
+GAP = 150
+
+
+class CountingHandler:
+    """Stands in for TrOCR: reads every crop as an empty string and counts the batches"""
+    batches = 0
+
+    def generate_batch(self, images, max_length):
+        CountingHandler.batches += 1
+        return [("", 1)] * len(images)
+
+
+def compose(scans):
+    """The scans two to a row on one sheet, every other one upside down"""
+    scans = [scan if index % 2 == 0 else cv2.rotate(scan, cv2.ROTATE_180) for index, scan in enumerate(scans)]
+    height = max(scan.shape[0] for scan in scans)
+    width = max(scan.shape[1] for scan in scans)
+    rows = (len(scans) + 1) // 2
+    sheet = np.full((rows * (height + GAP) + GAP, 2 * (width + GAP) + GAP, 3), 240, np.uint8)
+    for index, scan in enumerate(scans):
+        y, x = GAP + (index // 2) * (height + GAP), GAP + (index % 2) * (width + GAP)
+        sheet[y:y + scan.shape[0], x:x + scan.shape[1]] = scan
+    return sheet
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='+', help='Scanned card images')
+    parser.add_argument('--per-sheet', type=int, default=4, help='Cards laid out on each sheet')
+    parser.add_argument('--ocr', action='store_true', help='Read the fields with TrOCR')
+    args = parser.parse_args()
+
+    if args.ocr:
+        from trocr_handler import TrOCRHandler
+        handler = TrOCRHandler()
+        process_card.TrOCRHandler = lambda: handler
+    else:
+        process_card.TrOCRHandler = CountingHandler
+    registry = LayoutRegistry.from_manifest()
+
+    paths = [path for path in args.images if cv2.imread(path) is not None]
+    with tempfile.TemporaryDirectory() as directory:
+        sheets = []
+        for start in range(0, len(paths), args.per_sheet):
+            group = paths[start:start + args.per_sheet]
+            sheet_path = str(Path(directory) / f"sheet_{len(sheets)}.png")
+            cv2.imwrite(sheet_path, compose([cv2.imread(path) for path in group]))
+            sheets.append((sheet_path, len(group)))
+
+        CountingHandler.batches = 0
+        placed = found = read = 0
+        sheet_seconds = 0.0
+        for sheet_path, count in sheets:
+            registry.reset_session()
+            result = process_card.process_card_sheet(sheet_path, registry)
+            info = result['data']['debug_info']
+            placed += count
+            found += info['sheet']['cards_found']
+            read += info['sheet']['cards_read']
+            sheet_seconds += info['processing_time']
+            print(json.dumps({'sheet': Path(sheet_path).name, **info['sheet'],
+                              'seconds': info['processing_time']}), file=sys.stderr)
+        sheet_batches = CountingHandler.batches
+
+    CountingHandler.batches = 0
+    card_seconds = 0.0
+    registry.reset_session()
+    for path in paths:
+        start = time.perf_counter()
+        process_card.process_card_layouts(path, registry)
+        card_seconds += time.perf_counter() - start
+    card_batches = CountingHandler.batches
+
+    report = {
+        'sheets': len(sheets),
+        'cards_placed': placed,
+        'cards_found': found,
+        'cards_read': read,
+        'sheets_cards_per_minute': round(placed * 60 / sheet_seconds, 2),
+        'single_cards_per_minute': round(len(paths) * 60 / card_seconds, 2),
+    }
+    if not args.ocr:
+        report['ocr_batches'] = {'sheets': sheet_batches, 'single_cards': card_batches}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Stage cache: time saved re-reading an archive of cards.
+
+Reads every scan through process_card_layouts three times against one stage
+cache directory: a cold run that fills the cache, a re-OCR run (as after a
+model upgrade or a change to the generation settings, which the cache does
+not cover) that resumes from the cached crops, and a run after changing the
+denoising, which resumes from the cached homographies. Reports each run's
+total time, where the cards resumed from, the time the cache saved and the
+size of the cache on disk.
+
+Without --ocr the TrOCR model is not loaded and every field reads as an
+empty string, so the times are of everything but generation, which costs
+the same on every run.
+
+    python scripts/benchmark_stage_cache.py test_data/*.png test_data/*.tif
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+OCR_DIR = Path(__file__).parent.parent / "src" / "ocr"
+sys.path.append(str(OCR_DIR))
+
+import process_card  # noqa: E402
+from layout_registry import LayoutRegistry  # noqa: E402
+from stage_cache import StageCache  # noqa: E402
+
+
+class EmptyHandler:
+    """Stands in for TrOCR: reads every crop as an empty string"""
+
+    def generate_batch(self, images, max_length):
+        return [("", 1)] * len(images)
+
+
+def run(paths, registry, directory):
+    registry.reset_session()
+    registry.stage_cache = StageCache(directory)
+    start = time.perf_counter()
+    failed = 0
+    for path in paths:
+        failed += process_card.process_card_layouts(path, registry)['status'] != 'success'
+    return {'seconds': round(time.perf_counter() - start, 2), 'failed': failed, **registry.stage_cache.snapshot()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='+', help='Scanned card images')
+    parser.add_argument('--ocr', action='store_true', help='Read the fields with TrOCR')
+    args = parser.parse_args()
+
+    if args.ocr:
+        from trocr_handler import TrOCRHandler
+        handler = TrOCRHandler()
+        process_card.TrOCRHandler = lambda: handler
+    else:
+        process_card.TrOCRHandler = EmptyHandler
+    registry = LayoutRegistry.from_manifest()
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = {'cards': len(args.images)}
+        report['cold'] = run(args.images, registry, directory)
+        report['re_ocr'] = run(args.images, registry, directory)
+        for processor in registry.processors.values():
+            processor.denoising = "bilateral" if processor.denoising != "bilateral" else "none"
+        report['changed_denoising'] = run(args.images, registry, directory)
+        report['cache_mb'] = round(sum(path.stat().st_size for path in Path(directory).rglob('*.npz')) / 1e6, 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@ def download_model():
     
     # Save model and processor locally
     processor.save_pretrained(model_dir)
-    model.save_pretrained(model_dir)
+    model.save_pretrained(model_dir, safe_serialization=True)
     
     print(f"Model downloaded and saved to {model_dir}")
 
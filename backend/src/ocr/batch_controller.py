@@ -0,0 +1,122 @@
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from metrics import available_memory_bytes
+
+logger = logging.getLogger(__name__)
+
+# Per-item latency must improve by at least this fraction to keep growing
+MIN_GAIN = 0.05
+# Weight of the newest observation in the per-size latency averages
+EWMA_ALPHA = 0.3
+DECISION_HISTORY = 20
+
+
+class BatchSizeController:
+    """Tunes the inference batch size online (additive increase, multiplicative decrease).
+
+    After every full batch the controller compares the per-item latency at the
+    current size with the size below it. It grows by one while bigger batches
+    keep getting cheaper per item and the batch latency stays within the SLO,
+    steps back by one when the SLO is missed, and halves on an out-of-memory
+    error or when free memory drops below ``min_free_bytes``.
+    """
+
+    def __init__(self, min_size: int = 1, max_size: int = 16, initial_size: int = 4,
+                 latency_slo_s: Optional[float] = None, min_free_bytes: Optional[int] = None):
+        if not 1 <= min_size <= max_size:
+            raise ValueError(f"Invalid batch size bounds: {min_size}..{max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = min(max(initial_size, min_size), max_size)
+        self.latency_slo_s = latency_slo_s
+        self.min_free_bytes = min_free_bytes
+        self.per_item_s: Dict[int, float] = {}
+        self.decisions = deque(maxlen=DECISION_HISTORY)
+        self.counts = {'grow': 0, 'hold': 0, 'shrink': 0}
+
+    @classmethod
+    def from_env(cls) -> "BatchSizeController":
+        """Build a controller from OCR_BATCH_* environment variables"""
+        slo_ms = os.environ.get('OCR_BATCH_LATENCY_SLO_MS')
+        min_free_mb = os.environ.get('OCR_BATCH_MIN_FREE_MB')
+        return cls(
+            min_size=int(os.environ.get('OCR_BATCH_MIN', '1')),
+            max_size=int(os.environ.get('OCR_BATCH_MAX', '16')),
+            initial_size=int(os.environ.get('OCR_BATCH_INITIAL', '4')),
+            latency_slo_s=float(slo_ms) / 1000 if slo_ms else None,
+            min_free_bytes=int(float(min_free_mb) * 2**20) if min_free_mb else None
+        )
+
+    def _decide(self, new_size: int, reason: str, batch_size: int, elapsed: Optional[float]) -> int:
+        new_size = min(max(new_size, self.min_size), self.max_size)
+        if new_size > self.size:
+            action = 'grow'
+        elif new_size < self.size:
+            action = 'shrink'
+        else:
+            action = 'hold'
+        self.counts[action] += 1
+        self.decisions.append({
+            'time': round(time.time(), 3),
+            'batch_size': batch_size,
+            'latency_s': None if elapsed is None else round(elapsed, 4),
+            'action': action,
+            'reason': reason,
+            'new_size': new_size
+        })
+        if new_size != self.size:
+            logger.info(f"Batch size {self.size} -> {new_size} ({reason})")
+        self.size = new_size
+        return new_size
+
+    def observe(self, batch_size: int, elapsed: float, free_bytes: Optional[int] = None) -> int:
+        """Record a completed batch and return the size to use next"""
+        if batch_size <= 0:
+            return self.size
+        per_item = elapsed / batch_size
+        previous = self.per_item_s.get(batch_size)
+        self.per_item_s[batch_size] = per_item if previous is None else (
+            EWMA_ALPHA * per_item + (1 - EWMA_ALPHA) * previous)
+
+        if free_bytes is None and self.min_free_bytes is not None:
+            free_bytes = available_memory_bytes()
+        if self.min_free_bytes is not None and free_bytes is not None and free_bytes < self.min_free_bytes:
+            return self._decide(self.size // 2, 'memory_pressure', batch_size, elapsed)
+        if self.latency_slo_s is not None and elapsed > self.latency_slo_s:
+            return self._decide(self.size - 1, 'latency_slo', batch_size, elapsed)
+        if batch_size < self.size:
+            # A short tail batch says nothing about the current size
+            return self._decide(self.size, 'partial_batch', batch_size, elapsed)
+
+        current = self.per_item_s[batch_size]
+        smaller = self.per_item_s.get(batch_size - 1)
+        larger = self.per_item_s.get(batch_size + 1)
+        if larger is not None and larger * (1 - MIN_GAIN) >= current:
+            # Already tried one bigger and it was no cheaper per item
+            return self._decide(self.size, 'at_best_size', batch_size, elapsed)
+        if smaller is None or current < smaller * (1 - MIN_GAIN):
+            return self._decide(self.size + 1, 'per_item_latency_improving', batch_size, elapsed)
+        if current > smaller:
+            # The last step made things worse; go back to the cheaper size
+            return self._decide(self.size - 1, 'per_item_latency_worse', batch_size, elapsed)
+        return self._decide(self.size, 'per_item_latency_flat', batch_size, elapsed)
+
+    def observe_oom(self, batch_size: int) -> int:
+        """Record an out-of-memory failure and return the (halved) size to retry with"""
+        return self._decide(min(self.size, batch_size) // 2, 'out_of_memory', batch_size, None)
+
+    def snapshot(self) -> Dict:
+        return {
+            'size': self.size,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'latency_slo_s': self.latency_slo_s,
+            'min_free_bytes': self.min_free_bytes,
+            'per_item_ms': {size: round(seconds * 1000, 2) for size, seconds in sorted(self.per_item_s.items())},
+            'decision_counts': dict(self.counts),
+            'recent_decisions': list(self.decisions)
+        }
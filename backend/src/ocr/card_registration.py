@@ -0,0 +1,305 @@
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Longer side (pixels) images are reduced to before looking for ruling lines
+WORK_SIZE = 1200
+# Ruling lines are straight ink runs at least this fraction of the image width (height)
+MIN_RULE_FRACTION = 0.1
+# Lines are thickened across their direction by this many pixels first, so a skewed
+# line still holds a straight run of that length (about 2 degrees at the defaults)
+RULE_THICKENING = 5
+# Boxes smaller than this fraction of the image area are ignored
+MIN_BOX_FRACTION = 0.002
+# The card's largest box may differ in aspect ratio from the reference's by this fraction
+MAX_ASPECT_ERROR = 0.05
+# A reference box is matched to the scan box whose corners land within this many reference pixels
+MATCH_TOLERANCE = 8.0
+# Mean corner residual (reference pixels) above which a registration is rejected
+MAX_RESIDUAL = 3.0
+# Fraction of the reference's ruling lines the registered scan has to cover
+MIN_LINE_OVERLAP = 0.6
+# Fewest matched boxes (the largest one included) a registration is built from
+MIN_MATCHED_BOXES = 3
+# Fraction of the reference's ruling lines a card has to cover, in its best orientation,
+# to be taken for this form at all
+MIN_ORIENTATION_OVERLAP = 0.6
+# Width (pixels) of the thumbnails a known alignment is checked at
+CHECK_WIDTH = 600
+# Correlation (ECC) a known alignment needs for the scan to be accepted without registering it
+MIN_CORRELATION = 0.6
+# Largest correction (reference pixels) ECC may find for a known alignment to be accepted as is
+MAX_CORRECTION = 2.0
+
+
+class CardOrientationError(Exception):
+    """No orientation of a scan lines its printed boxes up with the card's"""
+    pass
+
+
+class Layout(NamedTuple):
+    """Printed structure of a card: its boxes and a ruling-line map at working scale"""
+    boxes: List[np.ndarray]
+    lines: np.ndarray
+    scale: float
+
+
+class Thumbnail(NamedTuple):
+    """A reduced, smoothed copy of the reference for checking known alignments"""
+    image: np.ndarray
+    scale: float
+
+
+class Registration(NamedTuple):
+    """A homography mapping scan pixels to reference pixels and the checks it passed"""
+    homography: np.ndarray
+    boxes: int
+    residual: float
+    overlap: float
+
+
+def ruling_lines(gray: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Long horizontal and vertical ink runs of a page at working scale; returns (lines, scale)"""
+    scale = min(1.0, WORK_SIZE / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    height, width = ink.shape
+    horizontal = cv2.dilate(ink, np.ones((RULE_THICKENING, 1), np.uint8))
+    horizontal = cv2.morphologyEx(horizontal, cv2.MORPH_OPEN, np.ones((1, max(15, int(width * MIN_RULE_FRACTION))), np.uint8))
+    vertical = cv2.dilate(ink, np.ones((1, RULE_THICKENING), np.uint8))
+    vertical = cv2.morphologyEx(vertical, cv2.MORPH_OPEN, np.ones((max(15, int(height * MIN_RULE_FRACTION)), 1), np.uint8))
+    return horizontal | vertical, scale
+
+
+def order_corners(points: np.ndarray) -> np.ndarray:
+    """Four points as top-left, top-right, bottom-right, bottom-left"""
+    points = points.reshape(4, 2).astype(np.float32)
+    total, difference = points.sum(axis=1), points[:, 1] - points[:, 0]
+    return points[[np.argmin(total), np.argmin(difference), np.argmax(total), np.argmax(difference)]]
+
+
+def _intersect(first, second) -> Optional[np.ndarray]:
+    (p, d), (q, e) = first, second
+    matrix = np.array([[d[0], -e[0]], [d[1], -e[1]]])
+    if abs(np.linalg.det(matrix)) < 1e-6:
+        return None
+    t, _ = np.linalg.solve(matrix, q - p)
+    return p + t * d
+
+
+def _refine_corners(contour: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    """Sub-pixel corners: a line fitted to each side's contour points, intersected with its neighbours.
+
+    Contour vertices are whole working-scale pixels, several scan pixels
+    apart; the middle of each side is straight even where the corners are
+    rounded or smudged.
+    """
+    sides = []
+    for start, end in zip(corners, np.roll(corners, -1, axis=0)):
+        length = np.linalg.norm(end - start)
+        direction = (end - start) / length
+        offsets = contour - start
+        along = offsets @ direction / length
+        across = np.abs(offsets @ np.array([-direction[1], direction[0]]))
+        side = contour[(along > 0.1) & (along < 0.9) & (across < 3)]
+        if len(side) < 2:
+            return corners
+        vx, vy, x0, y0 = cv2.fitLine(side, cv2.DIST_L2, 0, 0.01, 0.01).ravel()
+        sides.append((np.array([x0, y0]), np.array([vx, vy])))
+    refined = [_intersect(sides[i - 1], sides[i]) for i in range(4)]
+    if any(point is None for point in refined):
+        return corners
+    return np.array(refined, dtype=np.float32)
+
+
+def find_boxes(lines: np.ndarray, scale: float) -> List[np.ndarray]:
+    """Quadrilaterals closed by ruling lines, largest first, as ordered corners in page pixels"""
+    contours, _ = cv2.findContours(lines, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    min_area = MIN_BOX_FRACTION * lines.size
+    boxes = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+        polygon = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(polygon) != 4 or not cv2.isContourConvex(polygon):
+            continue
+        corners = _refine_corners(contour.reshape(-1, 2).astype(np.float32), order_corners(polygon))
+        boxes.append((area, corners / scale))
+    boxes.sort(key=lambda box: -box[0])
+    return [corners for _, corners in boxes]
+
+
+def layout(gray: np.ndarray) -> Layout:
+    """Boxes and ruling lines of a grayscale page"""
+    lines, scale = ruling_lines(gray)
+    return Layout(find_boxes(lines, scale), lines, scale)
+
+
+def _aspect(corners: np.ndarray) -> float:
+    width = np.linalg.norm(corners[1] - corners[0]) + np.linalg.norm(corners[2] - corners[3])
+    height = np.linalg.norm(corners[3] - corners[0]) + np.linalg.norm(corners[2] - corners[1])
+    return width / max(height, 1e-6)
+
+
+def _project(points: np.ndarray, homography: np.ndarray) -> np.ndarray:
+    return cv2.perspectiveTransform(points.reshape(-1, 1, 2).astype(np.float32), homography).reshape(-1, 2)
+
+
+def line_overlap(scan: Layout, reference: Layout, homography: np.ndarray) -> float:
+    """Fraction of the reference's ruling-line pixels covered by the scan's lines once registered"""
+    to_reference = np.diag([reference.scale, reference.scale, 1.0]) @ homography @ np.diag([1 / scan.scale, 1 / scan.scale, 1.0])
+    height, width = reference.lines.shape
+    warped = cv2.warpPerspective(scan.lines, to_reference, (width, height), flags=cv2.INTER_NEAREST)
+    warped = cv2.dilate(warped, np.ones((3, 3), np.uint8))
+    expected = np.count_nonzero(reference.lines)
+    return np.count_nonzero(cv2.bitwise_and(reference.lines, warped)) / expected if expected else 0.0
+
+
+def quarter_turn(turns: int, shape: Tuple[int, ...]) -> np.ndarray:
+    """Homography from page pixels to the pixels of the page turned as ``np.rot90(page, turns)``"""
+    height, width = shape[:2]
+    turns %= 4
+    if turns == 1:
+        return np.array([[0, 1, 0], [-1, 0, width - 1], [0, 0, 1]], dtype=np.float64)
+    if turns == 2:
+        return np.array([[-1, 0, width - 1], [0, -1, height - 1], [0, 0, 1]], dtype=np.float64)
+    if turns == 3:
+        return np.array([[0, -1, height - 1], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+    return np.eye(3)
+
+
+def _first_homography(boxes: List[np.ndarray], reference: Layout) -> Optional[np.ndarray]:
+    """Homography taking the largest box's corners onto the reference's largest box, if their shapes agree"""
+    card, primary = boxes[0], reference.boxes[0]
+    if abs(_aspect(card) / _aspect(primary) - 1) > MAX_ASPECT_ERROR:
+        return None
+    return cv2.getPerspectiveTransform(card, primary)
+
+
+def orientation(scan: Layout, reference: Layout, shape: Tuple[int, ...]) -> Tuple[Optional[int], float]:
+    """Quarter turns (as np.rot90) that bring a scanned card upright, and how well it then fits.
+
+    Each orientation is scored by how much of the reference's ruling lines
+    the scan's cover under the homography from the largest box alone, which
+    costs one warp of the working-scale line map. Upside-down cards have the
+    right box shapes in the wrong places and sideways ones the wrong shapes,
+    so only the upright orientation scores high. Returns (None, best score)
+    when no orientation reaches MIN_ORIENTATION_OVERLAP: the scan is not
+    this card, or not legible enough to be read.
+    """
+    best, best_overlap = None, 0.0
+    if not scan.boxes or not reference.boxes:
+        return None, best_overlap
+    for turns in range(4):
+        turn = quarter_turn(turns, shape)
+        homography = _first_homography([order_corners(_project(box, turn)) for box in scan.boxes[:1]], reference)
+        if homography is None:
+            continue
+        overlap = line_overlap(scan, reference, homography @ turn)
+        logger.debug(f"Orientation {90 * turns}: ruling lines overlap {overlap:.2f}")
+        if overlap > best_overlap:
+            best, best_overlap = turns, overlap
+    return (best if best_overlap >= MIN_ORIENTATION_OVERLAP else None), best_overlap
+
+
+def register(gray: np.ndarray, reference: Layout, turns: int = 0, scan: Optional[Layout] = None) -> Optional[Registration]:
+    """Register a scanned card to the reference by its printed boxes.
+
+    The corners of the largest box in each give a first homography; every
+    reference box that then lands on a scan box adds its four corners to a
+    least-squares refit. The result is only returned if enough boxes agree,
+    the corner residual is small and the scan's ruling lines cover the
+    reference's; otherwise None, and the caller should fall back to feature
+    matching.
+
+    ``turns`` is the card's orientation from :func:`orientation`; the
+    homography returned maps the page as scanned, turn included. ``scan``
+    is the page's layout, if it has already been found.
+    """
+    if not reference.boxes:
+        return None
+    if scan is None:
+        scan = layout(gray)
+    if not scan.boxes:
+        logger.debug("Fast registration: no boxes found")
+        return None
+
+    turn = quarter_turn(turns, gray.shape)
+    boxes = [order_corners(_project(box, turn)) for box in scan.boxes]
+    homography = _first_homography(boxes, reference)
+    if homography is None:
+        logger.debug("Fast registration: largest box has the wrong shape")
+        return None
+
+    projected = [_project(box, homography) for box in boxes]
+    source, target = [], []
+    for box in reference.boxes:
+        errors = [np.abs(candidate - box).max() for candidate in projected]
+        best = int(np.argmin(errors))
+        if errors[best] <= MATCH_TOLERANCE:
+            source.append(boxes[best])
+            target.append(box)
+    if len(source) < MIN_MATCHED_BOXES:
+        logger.debug(f"Fast registration: only {len(source)} boxes matched")
+        return None
+
+    source, target = np.concatenate(source), np.concatenate(target)
+    homography, _ = cv2.findHomography(source, target, 0)
+    if homography is None:
+        return None
+    residual = float(np.linalg.norm(_project(source, homography) - target, axis=1).mean())
+    if residual > MAX_RESIDUAL:
+        logger.debug(f"Fast registration: corner residual {residual:.2f}px")
+        return None
+    homography = homography @ turn
+    overlap = line_overlap(scan, reference, homography)
+    if overlap < MIN_LINE_OVERLAP:
+        logger.debug(f"Fast registration: ruling lines overlap {overlap:.2f}")
+        return None
+    return Registration(homography, len(target) // 4, residual, overlap)
+
+
+def thumbnail(gray: np.ndarray) -> Thumbnail:
+    """The reference reduced to CHECK_WIDTH for check_alignment"""
+    scale = min(1.0, CHECK_WIDTH / gray.shape[1])
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return Thumbnail(cv2.GaussianBlur(small, (5, 5), 0).astype(np.float32), scale)
+
+
+def check_alignment(gray: np.ndarray, reference: Thumbnail, homography: np.ndarray) -> Optional[float]:
+    """Whether a known scan-to-reference homography (identity, or the previous card's) fits this scan.
+
+    The scan is reduced to the thumbnail's resolution before warping, so the
+    check costs one resize and a few ECC iterations on a thumbnail. ECC
+    estimates the affine correction the warped scan still needs; the
+    homography is accepted if that correction moves no reference corner by
+    more than MAX_CORRECTION pixels and the correlation is high enough.
+    Returns the correlation, or None if the homography does not fit.
+    """
+    # Reduce the scan to about thumbnail density by a whole factor, which INTER_AREA does several times faster
+    step = max(1, int(1 / (reference.scale * np.sqrt(abs(np.linalg.det(homography[:2, :2]))))))
+    factor = 1 / step
+    small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if step > 1 else gray
+    to_thumbnail = np.diag([reference.scale, reference.scale, 1.0]) @ homography @ np.diag([1 / factor, 1 / factor, 1.0])
+    height, width = reference.image.shape
+    warped = cv2.warpPerspective(small, to_thumbnail, (width, height), borderMode=cv2.BORDER_REPLICATE)
+
+    correction = np.eye(2, 3, dtype=np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 1e-4)
+    try:
+        correlation, correction = cv2.findTransformECC(reference.image, warped.astype(np.float32), correction,
+                                                       cv2.MOTION_AFFINE, criteria, None, 5)
+    except cv2.error:
+        # ECC did not converge: the scan is nowhere near this alignment
+        return None
+    corners = np.float32([[0, 0, 1], [width, 0, 1], [width, height, 1], [0, height, 1]])
+    shift = np.abs(corners @ correction.T - corners[:, :2]).max() / reference.scale
+    if correlation < MIN_CORRELATION or shift > MAX_CORRECTION:
+        logger.debug(f"Alignment check: correlation {correlation:.2f}, correction {shift:.1f}px")
+        return None
+    return float(correlation)
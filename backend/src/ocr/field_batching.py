@@ -0,0 +1,146 @@
+import logging
+import math
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in tokens) of the length buckets; each bucket decodes with its bound as max_new_tokens
+BUCKET_LIMITS = (8, 16, 32, 64)
+
+# Expected output length per field family, matched against region names in caution_card_coords.json.
+# A region may override this with its own "max_length".
+FIELD_LENGTH_HINTS = (
+    (r"^(rh|kell|duffy|kidd|mns)_", 4),    # phenotype cells: "+", "0", "neg"
+    (r"^tech_\d+$", 6),                     # technician initials
+    (r"^abo_rh$", 6),                       # "O POS", "AB-"
+    (r"^date_row_\d+$", 12),                # "12/01/2023"
+    (r"^fmp_ssn$", 16),                     # "20/123-45-6789"
+    (r"^crossmatch_\d+$", 16),
+    (r"^patient_name$", 24),
+    (r"^restriction_\d+$", 32),
+)
+
+
+class FieldCrop(NamedTuple):
+    """One field crop waiting for OCR, possibly from any of several cards"""
+    key: Hashable
+    field_name: str
+    image: Any
+    expected_tokens: int
+
+
+def expected_tokens(field_name: str, width: int, height: int, region: Optional[Dict] = None) -> int:
+    """Estimate how many tokens a field's text needs.
+
+    Uses the region's ``max_length`` if the coordinates file sets one, then
+    the field-type hints, then the crop's aspect ratio (a wide box holds a
+    longer line than a square one).
+    """
+    if region and region.get("max_length"):
+        return int(region["max_length"])
+    for pattern, tokens in FIELD_LENGTH_HINTS:
+        if re.search(pattern, field_name or ""):
+            return tokens
+    aspect = width / max(height, 1)
+    return max(BUCKET_LIMITS[0], min(BUCKET_LIMITS[-1], math.ceil(aspect * 2) + 2))
+
+
+def bucket_for(tokens: int) -> int:
+    """The smallest bucket bound that fits ``tokens``"""
+    for limit in BUCKET_LIMITS:
+        if tokens <= limit:
+            return limit
+    return BUCKET_LIMITS[-1]
+
+
+def generated_lengths(rows: Sequence[Sequence[int]], eos_token_id: Optional[int]) -> List[int]:
+    """Tokens each generated sequence produced, up to and including its end-of-sequence token.
+
+    ``rows`` are token id lists without the decoder start token.
+    """
+    return [list(row).index(eos_token_id) + 1 if eos_token_id in row else len(row) for row in rows]
+
+
+def padding_waste(batches: Sequence[Sequence[int]]) -> Dict[str, float]:
+    """Decode slots spent on sequences that had already finished.
+
+    A batch runs until its longest sequence ends, so every shorter sequence
+    pads for the difference. ``batches`` holds the generated lengths of the
+    sequences in each batch.
+    """
+    used = sum(sum(lengths) for lengths in batches)
+    slots = sum(max(lengths) * len(lengths) for lengths in batches if lengths)
+    return {
+        "batches": len(batches),
+        "decode_slots": slots,
+        "padding_slots": slots - used,
+        "padding_waste": round((slots - used) / slots, 4) if slots else 0.0
+    }
+
+
+class FieldBatcher:
+    """Collects field crops (from one card or many) and runs them in length buckets.
+
+    ``run`` receives a list of images and a ``max_new_tokens`` and returns
+    ``(text, generated_length)`` per image. Within a bucket, crops are sorted
+    by expected length so similar ones share a batch.
+    """
+
+    def __init__(self, batch_size: int = 8, regions: Optional[Dict[str, Dict]] = None):
+        self.batch_size = batch_size
+        self.regions = regions or {}
+        self.pending: List[FieldCrop] = []
+        self.last_report: Optional[Dict] = None
+
+    def add(self, key: Hashable, field_name: str, image: Any, tokens: Optional[int] = None) -> None:
+        """Queue a crop; ``tokens`` is its expected length if already estimated (e.g. in another process)"""
+        if tokens is None:
+            height, width = image.shape[:2] if hasattr(image, "shape") else (image.height, image.width)
+            tokens = expected_tokens(field_name, width, height, self.regions.get(field_name))
+        self.pending.append(FieldCrop(key, field_name, image, tokens))
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def plan(self) -> "OrderedDict[int, List[List[FieldCrop]]]":
+        """Group the pending crops into per-bucket batches, shortest bucket first"""
+        buckets: Dict[int, List[FieldCrop]] = {}
+        for crop in self.pending:
+            buckets.setdefault(bucket_for(crop.expected_tokens), []).append(crop)
+        plan = OrderedDict()
+        for limit in sorted(buckets):
+            crops = sorted(buckets[limit], key=lambda crop: crop.expected_tokens)
+            plan[limit] = [crops[i:i + self.batch_size] for i in range(0, len(crops), self.batch_size)]
+        return plan
+
+    def flush(self, run: Callable[[List[Any], int], List[Tuple[str, int]]]) -> Dict[Hashable, str]:
+        """OCR every pending crop and return ``{key: text}``; also fills ``last_report``"""
+        if not self.pending:
+            return {}
+        results = {}
+        lengths = {}
+        bucket_counts = {}
+        for limit, batches in self.plan().items():
+            bucket_counts[limit] = sum(len(batch) for batch in batches)
+            for batch in batches:
+                outputs = run([crop.image for crop in batch], limit)
+                for crop, (text, length) in zip(batch, outputs):
+                    results[crop.key] = text
+                    lengths[crop.key] = length
+
+        # What the same crops would have cost batched in arrival order with one shared limit
+        arrival = [self.pending[i:i + self.batch_size] for i in range(0, len(self.pending), self.batch_size)]
+        bucketed = [batch for batches in self.plan().values() for batch in batches]
+        self.last_report = {
+            "crops": len(self.pending),
+            "buckets": bucket_counts,
+            "unbucketed": padding_waste([[lengths[crop.key] for crop in batch] for batch in arrival]),
+            "bucketed": padding_waste([[lengths[crop.key] for crop in batch] for batch in bucketed])
+        }
+        logger.info(f"Field batching: {len(self.pending)} crops in buckets {bucket_counts}, padding waste "
+                    f"{self.last_report['unbucketed']['padding_waste']:.1%} unbucketed -> "
+                    f"{self.last_report['bucketed']['padding_waste']:.1%} bucketed")
+        self.pending = []
+        return results
@@ -0,0 +1,129 @@
+import logging
+import re
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Field patterns, applied to whitespace-normalized text. Every pattern starts
+# with one of its field's FIELD_LABELS, so a match can only begin where one of
+# those labels occurs.
+FIELD_PATTERNS = {
+    'name': r'(?:Patient\s*(?:Name)?|Name(?:\s*of\s*Patient)?)\s*:?\s*([^\n:]+?)(?=\s+(?:Date|DOB|Born|Gender|Sex|Contact|Phone|Blood|Some|Random|$))',
+    'dob': r'(?:Date\s*of\s*Birth|DOB|Born)\s*:?\s*([^\n:]+?)(?=\s+(?:Gender|Sex|Contact|Phone|Blood|Some|Random|$))',
+    'gender': r'(?:Gender|Sex)\s*:?\s*([^\n:]+?)(?=\s+(?:Contact|Phone|Tel|Blood|Some|Random|More|$)|$)',
+    'contact_number': r'(?:Contact|Phone|Tel(?:ephone)?)\s*:?\s*([^\n:]+?)(?=\s+(?:Blood|Some|Random|$)|$)',
+    'blood_type': r'(?:Blood\s*(?:Type|Group))\s*:?\s*([^\n:]+?)(?:\s*$|(?=\s+(?:Some|Random|End|\w+:)))'
+}
+
+# Lowercase literals each field pattern can start with
+FIELD_LABELS = {
+    'name': ('patient', 'name'),
+    'dob': ('date', 'dob', 'born'),
+    'gender': ('gender', 'sex'),
+    'contact_number': ('contact', 'phone', 'tel'),
+    'blood_type': ('blood',)
+}
+
+_TRAILING_LABELS = re.compile(r'\s*(?:Name|DOB|Gender|Contact|Blood Type|Born|Sex|Tel|Phone|Blood Group|Some|Random|More|text|here|notes).*$', re.IGNORECASE)
+_TRAILING_PUNCTUATION = re.compile(r'[:\s]+$')
+_NAME_GAP = re.compile(r'\s{2,}.*$')
+_NAME_SEPARATOR = re.compile(r'[,;].*$')
+_NAME_FILLER = re.compile(r'\s+(?:Some|Random|other|text|here|notes).*$', re.IGNORECASE)
+
+MALE = ('m', 'male', 'm.', 'man')
+FEMALE = ('f', 'female', 'f.', 'woman')
+
+
+def normalize(text: str) -> str:
+    """Collapse every run of whitespace (newlines included) to one space and trim the ends"""
+    return ' '.join(text.split())
+
+
+def clean_field_value(value: str, field_type: Optional[str] = None) -> Optional[str]:
+    """Clean and normalize a field value"""
+    if not value:
+        return value
+
+    # Only the first line, without any trailing field labels or filler
+    value = _TRAILING_LABELS.sub('', value.split('\n')[0].strip())
+    value = _TRAILING_PUNCTUATION.sub('', value)
+
+    if field_type == 'gender':
+        value = value.lower().strip()
+        if value in MALE:
+            value = 'Male'
+        elif value in FEMALE:
+            value = 'Female'
+        elif value:
+            value = value.capitalize()
+            if value not in ('Male', 'Female'):
+                return None
+    elif field_type == 'name':
+        value = _NAME_GAP.sub('', value)
+        value = _NAME_SEPARATOR.sub('', value)
+        value = _NAME_FILLER.sub('', value)
+
+    return value.strip()
+
+
+class FieldExtractor:
+    """Extracts patient fields from OCR text with patterns compiled once.
+
+    Labels are located first: for ASCII text one ``str.find`` pass per label
+    over the lowercased text gives every position a field can start at, and
+    the field's pattern is only tried, anchored, at those positions in order.
+    Because every pattern begins with one of its labels this returns exactly
+    what ``re.search`` over the whole text would. Non-ASCII text, where
+    ``lower()`` and regex case folding can differ, uses ``search`` directly.
+    """
+
+    def __init__(self):
+        self.patterns = {field: re.compile(pattern, re.IGNORECASE) for field, pattern in FIELD_PATTERNS.items()}
+
+    def _label_positions(self, lowered: str, field: str) -> List[int]:
+        positions = []
+        for label in FIELD_LABELS[field]:
+            index = lowered.find(label)
+            while index >= 0:
+                positions.append(index)
+                index = lowered.find(label, index + 1)
+        positions.sort()
+        return positions
+
+    def _match(self, text: str, lowered: Optional[str], field: str):
+        pattern = self.patterns[field]
+        if lowered is None:
+            return pattern.search(text)
+        for position in self._label_positions(lowered, field):
+            match = pattern.match(text, position)
+            if match:
+                return match
+        return None
+
+    def extract(self, text: str) -> Dict[str, str]:
+        """Extract patient data from OCR text"""
+        text = normalize(text)
+        lowered = text.lower() if text.isascii() else None
+        extracted_data = {}
+        for field in self.patterns:
+            match = self._match(text, lowered, field)
+            if match:
+                value = clean_field_value(match.group(1).strip(), field)
+                if value:  # Only add non-empty values
+                    extracted_data[field] = value
+        return extracted_data
+
+    def extract_batch(self, texts: Iterable[str]) -> List[Dict[str, str]]:
+        """Extract patient data from many texts; results are in input order"""
+        return [self.extract(text) for text in texts]
+
+
+_default_extractor = FieldExtractor()
+
+
+def extract_patient_data(text: str) -> Dict[str, str]:
+    return _default_extractor.extract(text)
+
+
+def extract_batch(texts: Iterable[str]) -> List[Dict[str, str]]:
+    return _default_extractor.extract_batch(texts)
@@ -1,13 +1,32 @@
 import cv2
 import numpy as np
 from PIL import Image
+import hashlib
 import json
 import logging
 import os
-from typing import Dict, Tuple
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 
 # Import the dedicated phenotype cell analysis module
 from analyze_phenotype_cell import analyze_phenotype_cell, is_empty_field
+import card_registration
+import denoising
+import page_source
+import quality_gate
+from metrics import metrics
+
+# Resolutions (height, width) whose processed manual mask is kept, most recently used last
+MASK_CACHE_SIZE = 4
+
+
+class MaskSet(NamedTuple):
+    """The manual mask prepared for cards of one resolution (read-only)"""
+    keep: np.ndarray  # 255 where text is kept
+    hide: np.ndarray  # 255 where the form is painted white
+
 
 class ImageProcessor:
     """Handles image processing operations including alignment, masking, and region extraction."""
@@ -43,30 +62,196 @@ class ImageProcessor:
         with open(coordinates_path, 'r') as f:
             self.coordinates = json.load(f)
 
-    def align_image(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Printed boxes of the alignment mask, for registering scans without feature matching
+        # and for turning cards upright (rejecting scans no orientation fits) before either
+        self.fast_registration = True
+        self.detect_orientation = True
+        self.reference_layout = card_registration.layout(self.alignment_mask)
+        
+        # Cards off the same scanner usually need the same homography: the previous card's
+        # is checked against a thumbnail first and reused when it still fits
+        self.reuse_alignment = True
+        self.reference_thumbnail = card_registration.thumbnail(self.alignment_mask)
+        self.session_homography = None
+        self.alignment_counts = {"identity": 0, "session": 0, "cached": 0, "contour": 0, "sift": 0,
+                                 "failed": 0, "rejected": 0}
+        
+        # SIFT keypoints and descriptors of the alignment mask, found on first use
+        self._reference_features = None
+        
+        # Scans too blurred, faint or empty to read, or aligned on too little evidence, are
+        # rejected by process_image before the next stage
+        self.quality_thresholds = quality_gate.QualityThresholds.from_env()
+        
+        # Masked cards are cleaned as hard as their estimated noise calls for ("auto"),
+        # or always with one of denoising.METHODS
+        self.denoising = "auto"
+        self.denoise_counts = {method: 0 for method in denoising.METHODS}
+        
+        # The manual mask is cleaned up and inverted once per card resolution, never in
+        # place, and each thread masks into a grayscale buffer of its own
+        self._mask_cache: "OrderedDict[Tuple[int, int], MaskSet]" = OrderedDict()
+        self._mask_lock = threading.Lock()
+        self._buffers = threading.local()
+        
+        # Digests of the layout files, for keying cached stage outputs (see stage_settings)
+        self._layout_digests: Optional[Dict[str, str]] = None
+
+    def reset_session(self) -> None:
+        """Forget the previous card's alignment, e.g. before cards from another scanner"""
+        self.session_homography = None
+
+    def stage_settings(self) -> Dict[str, Dict[str, Any]]:
+        """Everything the output of each cacheable stage depends on (see stage_cache).
+        
+        "align" covers the homography and "crop" the masked crops and phenotype
+        results made with it; the layout files are represented by digests,
+        computed on first use.
+        """
+        if self._layout_digests is None:
+            self._layout_digests = {
+                "alignment_mask": hashlib.sha256(self.alignment_mask.tobytes()).hexdigest(),
+                "manual_mask": hashlib.sha256(self.manual_mask.tobytes()).hexdigest(),
+                "coordinates": hashlib.sha256(json.dumps(self.coordinates, sort_keys=True).encode()).hexdigest(),
+            }
+        return {
+            "align": {
+                "alignment_mask": [self._layout_digests["alignment_mask"], list(self.alignment_mask.shape)],
+                "template_shape": list(self.template.shape),
+                "fast_registration": self.fast_registration,
+                "detect_orientation": self.detect_orientation,
+                "quality": self.quality_thresholds._asdict(),
+            },
+            "crop": {
+                "manual_mask": [self._layout_digests["manual_mask"], list(self.manual_mask.shape)],
+                "coordinates": self._layout_digests["coordinates"],
+                "denoising": self.denoising,
+            },
+        }
+
+    def _known_alignment(self, gray: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[str], Optional[float]]:
+        """Identity (for scans already at template size) or the session homography, if either still fits.
+        
+        Returns (homography, method, thumbnail correlation), or Nones.
+        """
+        candidates = []
+        height, width = self.alignment_mask.shape
+        if abs(gray.shape[0] / height - 1) < 0.02 and abs(gray.shape[1] / width - 1) < 0.02:
+            candidates.append(("identity", np.eye(3)))
+        if self.session_homography is not None:
+            candidates.append(("session", self.session_homography))
+        for method, H in candidates:
+            correlation = card_registration.check_alignment(gray, self.reference_thumbnail, H)
+            if correlation is not None:
+                self.logger.info(f"Reused {method} alignment (correlation {correlation:.2f})")
+                return H, method, correlation
+        return None, None, None
+
+    def _record_alignment(self, method: str, start: float) -> None:
+        self.alignment_counts[method] += 1
+        metrics.inc("ocr_alignment_total", method=method)
+        metrics.observe("ocr_alignment_seconds", time.perf_counter() - start, method=method)
+
+    def align_image(self, image: np.ndarray, scan: Optional[card_registration.Layout] = None,
+                    known: Optional[Tuple[np.ndarray, str, float]] = None
+                    ) -> Tuple[np.ndarray, np.ndarray, Optional[float]]:
         """Align the scanned image with the template using the alignment mask.
         
+        A known alignment (identity or the previous card's homography) is
+        checked first. Otherwise the card is turned upright by its printed
+        boxes and those are registered; SIFT feature matching only runs when
+        that fails its geometric checks.
+        
+        The share of the evidence that agrees with the homography is returned
+        with it: the thumbnail correlation for a known alignment, the ruling
+        line overlap for printed boxes, the RANSAC inlier ratio for SIFT, and
+        None when alignment failed. Callers take both from the return value,
+        not from the processor, which several threads may share.
+        
         Args:
             image (np.ndarray): Input form image
+            scan (Layout, optional): The page's printed layout, if already found
+            known (tuple, optional): A known alignment (homography, method, correlation)
+                already checked against this scan, e.g. by LayoutRegistry.identify, or
+                found for it on an earlier run ("cached", see stage_cache)
             
         Returns:
-            Tuple[np.ndarray, np.ndarray]: (Aligned image, Homography matrix)
+            Tuple[np.ndarray, np.ndarray, Optional[float]]: (Aligned image, Homography matrix,
+            inlier ratio); the scan itself, the identity and None when alignment failed
+            
+        Raises:
+            CardOrientationError: No orientation of the scan matches the card
         """
         self.logger.info("Starting image alignment")
+        start = time.perf_counter()
         
         # Convert input image to grayscale
-        gray2 = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray2 = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        
+        if known is not None:
+            H, method, inliers = known
+        elif self.reuse_alignment and scan is None:
+            H, method, inliers = self._known_alignment(gray2)
+        else:
+            H, method, inliers = None, None, None
+        
+        turns = 0
+        if H is None and (self.detect_orientation or self.fast_registration):
+            if scan is None:
+                scan = card_registration.layout(gray2)
+            if self.detect_orientation:
+                turns, fit = card_registration.orientation(scan, self.reference_layout, gray2.shape)
+                if turns is None:
+                    self._record_alignment("rejected", start)
+                    raise card_registration.CardOrientationError(
+                        f"Scan does not match the card layout in any orientation (ruling line overlap {fit:.2f})")
+                if turns:
+                    self.logger.info(f"Card is turned {90 * turns} degrees")
+                metrics.inc("ocr_orientation_total", degrees=90 * turns)
+            if self.fast_registration:
+                registration = card_registration.register(gray2, self.reference_layout, turns, scan)
+                if registration is not None:
+                    self.logger.info(f"Aligned on {registration.boxes} printed boxes "
+                                     f"(residual {registration.residual:.2f}px, line overlap {registration.overlap:.2f})")
+                    H, method, inliers = registration.homography, "contour", registration.overlap
+        
+        if H is None:
+            # SIFT sees the card upright; its homography is for the page as scanned
+            upright = np.ascontiguousarray(np.rot90(gray2, turns)) if turns else gray2
+            H, inliers = self._sift_homography(upright)
+            method = "sift"
+            if H is not None and turns:
+                H = H @ card_registration.quarter_turn(turns, gray2.shape)
+        
+        if H is None:
+            self._record_alignment("failed", start)
+            return image, np.eye(3), None
         
+        # Warp image
+        aligned = cv2.warpPerspective(image, H, (self.template.shape[1], self.template.shape[0]))
+        self.session_homography = H
+        self._record_alignment(method, start)
+        
+        # Save debug images
+        os.makedirs("debug_output", exist_ok=True)
+        cv2.imwrite("debug_output/aligned.jpg", aligned)
+        
+        return aligned, H, inliers
+
+    def _sift_homography(self, gray2: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[float]]:
+        """Homography from SIFT matches between the alignment mask and a grayscale scan, and its RANSAC inlier ratio"""
         # Initialize SIFT detector
         sift = cv2.SIFT_create()
         
-        # Detect keypoints and compute descriptors using alignment mask
-        kp1, des1 = sift.detectAndCompute(self.alignment_mask, None)
+        # Detect keypoints and compute descriptors; the alignment mask's are computed once
+        if self._reference_features is None:
+            self._reference_features = sift.detectAndCompute(self.alignment_mask, None)
+        kp1, des1 = self._reference_features
         kp2, des2 = sift.detectAndCompute(gray2, None)
         
         if des1 is None or des2 is None:
             self.logger.warning("Could not compute descriptors")
-            return image, np.eye(3)
+            return None, None
         
         # Match features
         matcher = cv2.BFMatcher()
@@ -80,7 +265,7 @@ class ImageProcessor:
         
         if len(good_matches) < 4:
             self.logger.warning("Not enough good matches found for alignment")
-            return image, np.eye(3)
+            return None, None
         
         # Get matched keypoints
         src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
@@ -91,16 +276,10 @@ class ImageProcessor:
         
         if H is None:
             self.logger.warning("Could not find homography matrix")
-            return image, np.eye(3)
-        
-        # Warp image
-        aligned = cv2.warpPerspective(image, H, (self.template.shape[1], self.template.shape[0]))
-        
-        # Save debug images
-        os.makedirs("debug_output", exist_ok=True)
-        cv2.imwrite("debug_output/aligned.jpg", aligned)
+            return None, None
         
         # Save alignment mask for debugging
+        os.makedirs("debug_output", exist_ok=True)
         cv2.imwrite("debug_output/alignment_mask.jpg", self.alignment_mask)
         
         # Draw matches for debugging
@@ -108,7 +287,53 @@ class ImageProcessor:
                                     flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
         cv2.imwrite("debug_output/alignment_matches.jpg", img_matches)
         
-        return aligned, H
+        return H, float(mask.mean())
+
+    def _masks_for(self, shape: Tuple[int, int]) -> MaskSet:
+        """The processed and inverted manual mask for cards of this (height, width), computed once.
+        
+        A mask is resized from the manual mask as loaded, with nearest-neighbour interpolation
+        so that it stays binary, and self.manual_mask itself is never replaced.
+        """
+        with self._mask_lock:
+            masks = self._mask_cache.get(shape)
+            if masks is not None:
+                self._mask_cache.move_to_end(shape)
+        metrics.record_cache("processed_mask", masks is not None)
+        if masks is not None:
+            return masks
+        
+        manual_mask = self.manual_mask
+        if manual_mask.shape != shape:
+            manual_mask = cv2.resize(manual_mask, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+        
+        # Apply morphological operations to improve mask quality
+        kernel = np.ones((3,3), np.uint8)
+        keep = cv2.morphologyEx(manual_mask, cv2.MORPH_CLOSE, kernel, iterations=1)
+        keep = cv2.morphologyEx(keep, cv2.MORPH_OPEN, kernel, iterations=1)
+        masks = MaskSet(keep, cv2.bitwise_not(keep))
+        for mask in masks:
+            mask.flags.writeable = False
+        
+        with self._mask_lock:
+            self._mask_cache[shape] = masks
+            while len(self._mask_cache) > MASK_CACHE_SIZE:
+                self._mask_cache.popitem(last=False)
+        self.logger.info(f"Prepared the manual mask for {shape[1]}x{shape[0]} cards")
+        return masks
+
+    def _gray_buffer(self, shape: Tuple[int, int]) -> np.ndarray:
+        """This thread's grayscale working buffer for cards of this (height, width)"""
+        buffers = getattr(self._buffers, "gray", None)
+        if buffers is None:
+            buffers = self._buffers.gray = OrderedDict()
+        buffer = buffers.get(shape)
+        if buffer is None:
+            buffer = buffers[shape] = np.empty(shape, np.uint8)
+            while len(buffers) > MASK_CACHE_SIZE:
+                buffers.popitem(last=False)
+        buffers.move_to_end(shape)
+        return buffer
 
     def apply_mask(self, image: np.ndarray) -> np.ndarray:
         """Apply the manual mask to hide form elements from the input image.
@@ -120,49 +345,43 @@ class ImageProcessor:
             image (np.ndarray): Aligned input image
             
         Returns:
-            np.ndarray: Masked image with form elements hidden
+            np.ndarray: Masked image with form elements hidden (a new array: region crops are
+            views of it, while the grayscale working buffer is reused by the next card)
         """
-        # Convert image to grayscale if it's not already
+        masks = self._masks_for(image.shape[:2])
+        processed_mask = masks.keep
+        
+        # Convert image to grayscale if it's not already, into this thread's buffer
+        gray = self._gray_buffer(image.shape[:2])
         if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
         else:
-            gray = image.copy()
-            
-        # Ensure mask and image have the same dimensions
-        if gray.shape != self.manual_mask.shape:
-            self.manual_mask = cv2.resize(self.manual_mask, (gray.shape[1], gray.shape[0]))
-        
-        # Apply morphological operations to improve mask quality
-        kernel = np.ones((3,3), np.uint8)
-        processed_mask = cv2.morphologyEx(self.manual_mask, cv2.MORPH_CLOSE, kernel, iterations=1)
-        processed_mask = cv2.morphologyEx(processed_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        
-        # Create white background
-        white_background = np.full_like(gray, 255)
+            np.copyto(gray, image)
+        os.makedirs("debug_output", exist_ok=True)
+        cv2.imwrite("debug_output/original_gray.jpg", gray)
         
         # The mask has:
         # - White (255) for text areas to keep
         # - Black (0) for form elements to hide
-        # So we need to invert it for bitwise operations
-        inverted_mask = cv2.bitwise_not(processed_mask)
-        
-        # Keep text areas from original image (where mask is white)
-        result = cv2.bitwise_and(gray, gray, mask=processed_mask)
-        
-        # Fill form areas with white (where mask is black)
-        result = cv2.add(result, cv2.bitwise_and(white_background, white_background, mask=inverted_mask))
-        
-        # Apply additional cleanup
-        result = cv2.fastNlMeansDenoising(result, None, 10, 7, 21)
+        # so OR-ing the image with its inverse paints the form white and leaves the text as it is
+        result = cv2.bitwise_or(gray, masks.hide, dst=gray)
+        
+        # Apply additional cleanup, only where the mask keeps pixels
+        method = self.denoising
+        if method == "auto":
+            noise = denoising.estimate_noise(result, processed_mask)
+            method = denoising.choose_method(noise)
+            self.logger.info(f"Estimated noise {noise:.2f} grey levels, denoising with {method}")
+        result = denoising.denoise(result, processed_mask, method)
+        self.denoise_counts[method] += 1
+        metrics.inc("ocr_denoise_total", method=method)
         
         # Convert back to RGB
         masked_rgb = cv2.cvtColor(result, cv2.COLOR_GRAY2RGB)
         
         # Save debug images
-        os.makedirs("debug_output", exist_ok=True)
-        cv2.imwrite("debug_output/original_gray.jpg", gray)
         cv2.imwrite("debug_output/template_mask.jpg", processed_mask)
-        cv2.imwrite("debug_output/inverted_mask.jpg", inverted_mask)
+        cv2.imwrite("debug_output/inverted_mask.jpg", masks.hide)
         cv2.imwrite("debug_output/masked_result.jpg", result)
         cv2.imwrite("debug_output/masked_final.jpg", masked_rgb)
         
@@ -217,21 +436,61 @@ class ImageProcessor:
             
         Returns:
             Dict[str, Image.Image]: Dictionary mapping region names to extracted region images
+            
+        Raises:
+            ScanRejectedError: The scan failed the quality gate, before or after alignment
+        """
+        return self.process_scan(self.read_image(image_path))
+
+    def read_image(self, image_path: str) -> np.ndarray:
+        """Decode a scan (a path or a page address, see page_source) and pass it through the quality gate.
+        
+        Raises:
+            FileNotFoundError: The image could not be read
+            PageSourceError: The page is in a PDF and PyMuPDF is not installed
+            ScanRejectedError: The scan failed the quality gate
         """
         self.logger.info(f"Processing image: {image_path}")
         
         # Read image
-        image = cv2.imread(image_path)
+        image = page_source.read_page(image_path)
         if image is None:
             raise FileNotFoundError(f"Could not read image: {image_path}")
+        quality_gate.check_image(image, self.quality_thresholds)
+        return image
+
+    def process_scan(self, image: np.ndarray, scan: Optional[card_registration.Layout] = None,
+                     known: Optional[Tuple[np.ndarray, str, float]] = None) -> Dict[str, Image.Image]:
+        """Align, mask and crop a decoded scan; ``scan`` and ``known`` are passed on to align_image.
+        
+        Raises:
+            ScanRejectedError: The card was aligned on too little evidence
+        """
+        return self.align_and_crop(image, scan, known)[0]
+
+    def align_and_crop(self, image: np.ndarray, scan: Optional[card_registration.Layout] = None,
+                       known: Optional[Tuple[np.ndarray, str, float]] = None
+                       ) -> Tuple[Dict[str, Image.Image], np.ndarray, Optional[float]]:
+        """process_scan, also returning the homography and inlier ratio the card was aligned with.
         
+        Raises:
+            ScanRejectedError: The card was aligned on too little evidence
+        """
         # 1. Align mask2 (template) with input form
-        aligned, H = self.align_image(image)
+        with metrics.stage("align"):
+            aligned, H, inliers = self.align_image(image, scan, known)
+        quality_gate.check_alignment(inliers, self.quality_thresholds)
         
         # 2. Apply mask2 to hide form elements
-        masked = self.apply_mask(aligned)
+        with metrics.stage("mask"):
+            masked = self.apply_mask(aligned)
         
         # 3. Extract regions according to finalcoords
+        with metrics.stage("crop"):
+            return self._extract_regions(masked), H, inliers
+
+    def _extract_regions(self, masked: np.ndarray) -> Dict[str, Image.Image]:
+        """Crop every region from a masked card and run the empty/phenotype checks"""
         regions = {}
         for region_name, region_data in self.coordinates["regions"].items():
             try:
@@ -0,0 +1,201 @@
+"""Every card layout (revision) the pipeline can read, loaded once, and which one a scan is.
+
+A layout is a template, alignment mask, manual mask and coordinates file,
+held as an ImageProcessor so that its printed boxes, thumbnail, SIFT
+features and processed masks are computed once for every card read with it.
+A scan's layout is found the way a single layout is checked: the previous
+card's layout is tried first on a thumbnail, and otherwise the scan's ruling
+lines are found once and scored against each layout's in every orientation,
+which costs a few small warps per layout. The scan's lines are then reused
+to register it, so reading a card costs about one alignment however many
+layouts are registered.
+
+With a stage cache (OCR_STAGE_CACHE), a scan read before resumes from its
+cached crops or homography (see stage_cache).
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import card_registration
+import page_source
+import stage_cache
+from card_registration import CardOrientationError
+from image_processor import ImageProcessor
+from metrics import metrics
+from stage_cache import CachedAlignment, CachedRegions, StageCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_PATH = Path(__file__).parent / "resources" / "layouts.json"
+
+# Files every layout in a manifest names, relative to the manifest
+LAYOUT_FILES = ("template", "alignment_mask", "manual_mask", "coordinates")
+
+
+class LayoutMatch(NamedTuple):
+    """The layout a scan was identified as, and what identifying it found out about the scan"""
+    name: str
+    processor: ImageProcessor
+    fit: Optional[float]
+    scan: Optional[card_registration.Layout] = None
+    known: Optional[Tuple[np.ndarray, str, float]] = None
+
+
+class LayoutRegistry:
+    """Card layouts by name, each loaded once, with card-version detection for scans"""
+
+    def __init__(self, processors: Dict[str, ImageProcessor]):
+        if not processors:
+            raise ValueError("A layout registry needs at least one layout")
+        self.processors = dict(processors)
+        self.last_layout: Optional[str] = None
+        self.layout_counts = {name: 0 for name in self.processors}
+        # Stage outputs of scans read before, if OCR_STAGE_CACHE names a directory
+        self.stage_cache: Optional[StageCache] = StageCache.from_env()
+
+    @classmethod
+    def from_manifest(cls, path: Optional[Path] = None) -> "LayoutRegistry":
+        """Load every layout a manifest lists; OCR_LAYOUTS names the manifest.
+
+        The manifest maps layout names to their files:
+        ``{"layouts": {"caution_card": {"template": ..., "alignment_mask": ...,
+        "manual_mask": ..., "coordinates": ...}}}``
+        """
+        path = Path(path or os.environ.get("OCR_LAYOUTS", DEFAULT_MANIFEST_PATH))
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        processors = {}
+        for name, files in manifest["layouts"].items():
+            missing = [key for key in LAYOUT_FILES if key not in files]
+            if missing:
+                raise ValueError(f"Layout {name} in {path} is missing {', '.join(missing)}")
+            start = time.perf_counter()
+            processors[name] = ImageProcessor(*(str(path.parent / files[key]) for key in LAYOUT_FILES))
+            logger.info(f"Loaded layout {name} in {time.perf_counter() - start:.2f}s")
+        return cls(processors)
+
+    def reset_session(self) -> None:
+        """Forget the previous card's layout and alignment, e.g. before cards from another scanner"""
+        self.last_layout = None
+        for processor in self.processors.values():
+            processor.reset_session()
+
+    def identify(self, image: np.ndarray) -> LayoutMatch:
+        """Which registered layout a scan is.
+
+        The previous card's layout is kept if its known alignment still fits
+        the scan. Otherwise the layout whose ruling lines the scan's cover
+        best, in the scan's best orientation, is chosen. With a single layout
+        nothing is measured: aligning the scan checks it anyway.
+
+        Raises:
+            CardOrientationError: The scan fits none of the layouts in any orientation
+        """
+        if len(self.processors) == 1:
+            name, processor = next(iter(self.processors.items()))
+            return self._matched(LayoutMatch(name, processor, None))
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if self.last_layout is not None:
+            processor = self.processors[self.last_layout]
+            if processor.reuse_alignment:
+                known = processor._known_alignment(gray)
+                if known[0] is not None:
+                    return self._matched(LayoutMatch(self.last_layout, processor, known[2], known=known))
+
+        scan = card_registration.layout(gray)
+        fits = {}
+        for name, processor in self.processors.items():
+            turns, fit = card_registration.orientation(scan, processor.reference_layout, gray.shape)
+            fits[name] = fit if turns is not None else None
+            logger.debug(f"Layout {name}: ruling lines overlap {fit:.2f}")
+        candidates = {name: fit for name, fit in fits.items() if fit is not None}
+        if not candidates:
+            metrics.inc("ocr_layout_total", layout="none")
+            raise CardOrientationError(
+                f"Scan does not match any of the {len(fits)} registered card layouts in any orientation")
+        name = max(candidates, key=candidates.get)
+        return self._matched(LayoutMatch(name, self.processors[name], candidates[name], scan=scan))
+
+    def _matched(self, match: LayoutMatch) -> LayoutMatch:
+        self.last_layout = match.name
+        self.layout_counts[match.name] += 1
+        metrics.inc("ocr_layout_total", layout=match.name)
+        return match
+
+    def process_image(self, image_path: str) -> Tuple[LayoutMatch, Dict]:
+        """Decode and gate a scan, identify its layout and read it with that layout's processor.
+
+        Returns the match and the regions, as ImageProcessor.process_image returns them.
+        With a stage cache, a scan read before resumes from its cached crops
+        (the match's fit is then None) or homography.
+
+        Raises:
+            CardOrientationError: The scan fits none of the layouts
+            ScanRejectedError: The scan failed the quality gate
+        """
+        key = self.stage_cache.input_key(image_path) if self.stage_cache is not None else None
+        if key is None:
+            return self.process_scan(next(iter(self.processors.values())).read_image(image_path))
+
+        start = time.perf_counter()
+        align_config = stage_cache.alignment_config(self.processors)
+        alignment = self.stage_cache.load_alignment(key, align_config)
+        if alignment is not None and alignment.layout in self.processors:
+            processor = self.processors[alignment.layout]
+            config = stage_cache.crop_config(processor, align_config)
+            cached = self.stage_cache.load_regions(key, config)
+            if cached is not None:
+                self.stage_cache.resumed_from("ocr", cached.seconds - (time.perf_counter() - start))
+                return self._matched(LayoutMatch(alignment.layout, processor, None)), cached.regions
+
+            # The scan passed the quality gate and was identified under the same settings
+            with metrics.collect() as timings:
+                image = page_source.read_page(image_path)
+                if image is None:
+                    raise FileNotFoundError(f"Could not read image: {image_path}")
+                known = (alignment.homography, "cached", alignment.inliers)
+                regions = processor.process_scan(image, known=known)
+            redone = sum(timings.get(stage, 0.0) for stage in ("decode", "align"))
+            self.stage_cache.resumed_from("mask", alignment.seconds - redone)
+            self.stage_cache.store_regions(key, config, CachedRegions(regions, alignment.seconds + timings["mask"]
+                                                                      + timings["crop"]))
+            return self._matched(LayoutMatch(alignment.layout, processor, None)), regions
+
+        with metrics.collect() as timings:
+            match, regions, homography, inliers = self._read_scan(
+                next(iter(self.processors.values())).read_image(image_path))
+        self.stage_cache.resumed_from("decode")
+        if inliers is not None:
+            # Only a card that was aligned is cached; the homography is this scan's own, not whatever
+            # another thread's card left on the shared processor
+            seconds = sum(timings.get(stage, 0.0) for stage in ("decode", "quality", "identify", "align"))
+            self.stage_cache.store_alignment(key, align_config, CachedAlignment(match.name, homography, inliers,
+                                                                                seconds))
+            self.stage_cache.store_regions(key, stage_cache.crop_config(match.processor, align_config),
+                                           CachedRegions(regions, sum(timings.values())))
+        return match, regions
+
+    def process_scan(self, image: np.ndarray) -> Tuple[LayoutMatch, Dict]:
+        """Identify a decoded (and gated) scan's layout and read it with that layout's processor.
+
+        Raises:
+            CardOrientationError: The scan fits none of the layouts
+            ScanRejectedError: The card was aligned on too little evidence
+        """
+        match, regions, _, _ = self._read_scan(image)
+        return match, regions
+
+    def _read_scan(self, image: np.ndarray) -> Tuple[LayoutMatch, Dict, np.ndarray, Optional[float]]:
+        """process_scan, also returning the homography and inlier ratio (None if alignment failed)"""
+        with metrics.stage("identify"):
+            match = self.identify(image)
+        logger.info(f"Scan identified as layout {match.name}")
+        return (match, *match.processor.align_and_crop(image, match.scan, match.known))
@@ -0,0 +1,151 @@
+import logging
+from typing import Dict, List, NamedTuple, Sequence
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Horizontal smear (pixels) that joins the letters of a word into one blob
+SMEAR_WIDTH = 9
+# Bands shorter than this (pixels) are underlines or stray marks, not text
+MIN_LINE_HEIGHT = 8
+# Bands shorter than this fraction of the median line height are noise
+MIN_LINE_FRACTION = 0.5
+# Row gaps below this fraction of the median line height are inside a line (i dots, descenders)
+LINE_GAP_TOLERANCE = 0.35
+# Column gaps wider than this many line heights split a line into separate segments (label / value)
+SEGMENT_GAP = 2.5
+# Bands taller than this many median line heights hold touching lines and are split
+TALL_LINE_FACTOR = 1.7
+# Pixels of margin kept around each crop
+PADDING = 4
+
+
+class LineBox(NamedTuple):
+    """One text segment on a page, in reading order (line, then segment left to right)"""
+    x: int
+    y: int
+    width: int
+    height: int
+    line: int
+    segment: int
+
+
+def ink_mask(binary: np.ndarray) -> np.ndarray:
+    """Text pixels of a thresholded page (text dark on light).
+
+    Adaptive thresholding turns scanner noise into specks all over the page
+    and keeps form rules and box borders, which would join every line they
+    cross into one band. Rules are removed with long openings; specks are
+    removed by keeping only ink whose horizontally smeared blob is at least
+    a text line tall.
+    """
+    gray = cv2.cvtColor(binary, cv2.COLOR_RGB2GRAY) if binary.ndim == 3 else binary
+    ink = (gray < 128).astype(np.uint8)
+    page_height, page_width = ink.shape
+    horizontal = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((1, max(40, page_width // 8)), np.uint8))
+    vertical = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((max(40, page_height // 8), 1), np.uint8))
+    # Grown by a pixel so the speckle along a rule's edges goes with it
+    rules = cv2.dilate(horizontal | vertical, np.ones((3, 3), np.uint8))
+    ink &= 1 - rules
+
+    strokes = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    smeared = cv2.dilate(strokes, np.ones((1, SMEAR_WIDTH), np.uint8))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(smeared, connectivity=8)
+    keep = stats[:, cv2.CC_STAT_HEIGHT] >= MIN_LINE_HEIGHT
+    keep[0] = False
+    return ink & keep[labels].astype(np.uint8)
+
+
+def _runs(profile: np.ndarray) -> List[List[int]]:
+    """[start, end) index ranges where the profile is non-zero"""
+    nonzero = np.concatenate(([0], (profile > 0).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(nonzero))
+    return [[int(start), int(end)] for start, end in zip(edges[::2], edges[1::2])]
+
+
+def _merge_runs(runs: List[List[int]], max_gap: float) -> List[List[int]]:
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] <= max_gap:
+            merged[-1][1] = run[1]
+        else:
+            merged.append(list(run))
+    return merged
+
+
+def _split_tall(band: List[int], profile: np.ndarray, line_height: float) -> List[List[int]]:
+    """Split a band holding several touching lines at the emptiest rows near the expected boundaries"""
+    start, end = band
+    pieces = int(round((end - start) / line_height))
+    if pieces < 2:
+        return [band]
+    window = max(1, int(line_height / 2))
+    cuts = [start]
+    for k in range(1, pieces):
+        expected = start + k * (end - start) // pieces
+        low, high = max(cuts[-1] + 1, expected - window), min(end - 1, expected + window)
+        if low >= high:
+            continue
+        cuts.append(low + int(np.argmin(profile[low:high])))
+    cuts.append(end)
+    return [[a, b] for a, b in zip(cuts, cuts[1:]) if b > a]
+
+
+def find_lines(ink: np.ndarray) -> List[List[int]]:
+    """Row ranges [top, bottom) of the text lines in an ink mask, top to bottom"""
+    profile = ink.sum(axis=1)
+    runs = _runs(profile)
+    if not runs:
+        return []
+    heights = [end - start for start, end in runs if end - start >= MIN_LINE_HEIGHT]
+    line_height = float(np.median(heights)) if heights else float(MIN_LINE_HEIGHT)
+    bands = _merge_runs(runs, LINE_GAP_TOLERANCE * line_height)
+    bands = [band for band in bands if band[1] - band[0] >= MIN_LINE_HEIGHT]
+    if len(bands) > 1:
+        line_height = float(np.median([end - start for start, end in bands]))
+        # Clumps of speckle can reach MIN_LINE_HEIGHT; real lines are near the median height
+        bands = [band for band in bands if band[1] - band[0] >= MIN_LINE_FRACTION * line_height]
+    lines = []
+    for band in bands:
+        if band[1] - band[0] > TALL_LINE_FACTOR * line_height:
+            lines.extend(_split_tall(band, profile, line_height))
+        else:
+            lines.append(band)
+    return lines
+
+
+def segment_lines(binary: np.ndarray) -> List[LineBox]:
+    """Cut a thresholded page into text segments in reading order.
+
+    Lines come from the horizontal projection profile of the ink; each line
+    is then split at wide column gaps so a label and its value far across
+    the form are read as separate, short crops.
+    """
+    ink = ink_mask(binary)
+    page_height, page_width = ink.shape
+    boxes = []
+    for line_index, (top, bottom) in enumerate(find_lines(ink)):
+        columns = ink[top:bottom].sum(axis=0)
+        segments = _merge_runs(_runs(columns), SEGMENT_GAP * (bottom - top))
+        for segment_index, (left, right) in enumerate(segments):
+            x0, y0 = max(0, left - PADDING), max(0, top - PADDING)
+            x1, y1 = min(page_width, right + PADDING), min(page_height, bottom + PADDING)
+            boxes.append(LineBox(x0, y0, x1 - x0, y1 - y0, line_index, segment_index))
+    logger.debug(f"Segmented {len({box.line for box in boxes})} lines, {len(boxes)} segments")
+    return boxes
+
+
+def crop(image: np.ndarray, box: LineBox) -> np.ndarray:
+    return image[box.y:box.y + box.height, box.x:box.x + box.width]
+
+
+def join_lines(boxes: Sequence[LineBox], texts: Sequence[str]) -> str:
+    """Reassemble segment texts: segments of a line joined by spaces, lines by newlines"""
+    lines: Dict[int, List[str]] = {}
+    for box, text in sorted(zip(boxes, texts), key=lambda item: (item[0].line, item[0].segment)):
+        text = text.strip()
+        if text:
+            lines.setdefault(box.line, []).append(text)
+    return "\n".join(" ".join(parts) for _, parts in sorted(lines.items()))
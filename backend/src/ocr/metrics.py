@@ -0,0 +1,277 @@
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages timed per request
+STAGES = ("decode", "split", "quality", "identify", "align", "mask", "crop", "segment", "preprocess", "encode", "generate", "postprocess")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Per-call stage timings for whoever opened a collect() block on this context
+_collector: contextvars.ContextVar = contextvars.ContextVar("ocr_stage_collector", default=None)
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process, or None if it cannot be read"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process, or None if it cannot be read"""
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        # Windows reports the peak working set directly
+        peak = getattr(info, "peak_wset", None)
+        if peak is not None:
+            return peak
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def available_memory_bytes() -> Optional[int]:
+    """Memory the OS can still hand out without swapping, or None if it cannot be read"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket that contains it"""
+        if not self.count:
+            return None
+        target = q * self.count
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe store for OCR pipeline counters and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._cache: Dict[str, Dict[str, int]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        with self._lock:
+            entry = self._cache.setdefault(cache, {"hits": 0, "misses": 0})
+            entry["hits" if hit else "misses"] += 1
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a pipeline stage into the stage histogram and any active collector"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("ocr_stage_seconds", elapsed, stage=name)
+            timings = _collector.get()
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def collect(self) -> Iterator[Dict[str, float]]:
+        """Collect per-stage timings (seconds) for the work done inside the block.
+
+        Timings collected by a nested block also count towards the enclosing one.
+        """
+        timings: Dict[str, float] = {}
+        token = _collector.set(timings)
+        try:
+            yield timings
+        finally:
+            _collector.reset(token)
+            outer = _collector.get()
+            if outer is not None:
+                for name, elapsed in timings.items():
+                    outer[name] = outer.get(name, 0.0) + elapsed
+
+    def snapshot(self) -> Dict:
+        """JSON-friendly view of every metric plus process memory"""
+        with self._lock:
+            stages = {}
+            histograms = {}
+            for (name, labels), histogram in self._histograms.items():
+                if name == "ocr_stage_seconds":
+                    stages[dict(labels)["stage"]] = histogram.snapshot()
+                else:
+                    label_text = ",".join(f"{k}={v}" for k, v in labels)
+                    histograms[f"{name}{{{label_text}}}" if label_text else name] = histogram.snapshot()
+            counters = {}
+            for (name, labels), value in self._counters.items():
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label_text}}}" if label_text else name] = value
+            caches = {
+                cache: {**entry, "hit_rate": round(entry["hits"] / (entry["hits"] + entry["misses"]), 4)
+                        if entry["hits"] + entry["misses"] else None}
+                for cache, entry in self._cache.items()
+            }
+        return {
+            "stages": stages,
+            "histograms": histograms,
+            "counters": counters,
+            "caches": caches,
+            "process": {"rss_bytes": process_rss_bytes(), "peak_rss_bytes": peak_rss_bytes()},
+        }
+
+    def render_prometheus(self, extra_gauges: Optional[Dict[str, float]] = None,
+                          extra_counters: Optional[Dict[str, float]] = None) -> str:
+        """Render every metric in the Prometheus text exposition format.
+
+        Extra samples are keyed by their name with any labels, e.g. ``ocr_queue_depth{lane="batch"}``;
+        each family gets one TYPE line however many label sets it has.
+        """
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self._counters})
+            for name in counter_names:
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+
+            histogram_names = sorted({name for name, _ in self._histograms})
+            for name in histogram_names:
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    running = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        running += count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', _format(bound)),))} {running}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+            if self._cache:
+                lines.append("# TYPE ocr_cache_requests_total counter")
+                for cache, entry in sorted(self._cache.items()):
+                    for result in ("hits", "misses"):
+                        lines.append(f'ocr_cache_requests_total{{cache="{cache}",result="{result}"}} {entry[result]}')
+
+        gauges = dict(extra_gauges or {})
+        rss = process_rss_bytes()
+        if rss is not None:
+            gauges["ocr_process_rss_bytes"] = rss
+        peak = peak_rss_bytes()
+        if peak is not None:
+            gauges["ocr_process_peak_rss_bytes"] = peak
+        for kind, samples in (("counter", extra_counters or {}), ("gauge", gauges)):
+            families: Dict[str, List[str]] = {}
+            for name, value in sorted(samples.items()):
+                if value is not None:
+                    families.setdefault(name.split("{", 1)[0], []).append(f"{name} {value}")
+            for base, family in families.items():
+                lines.append(f"# TYPE {base} {kind}")
+                lines.extend(family)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, extra_gauges: Optional[Dict[str, float]] = None,
+                         extra_counters: Optional[Dict[str, float]] = None) -> None:
+        """Atomically write the Prometheus text to a file for a node-exporter textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render_prometheus(extra_gauges, extra_counters))
+        os.replace(tmp_path, path)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._cache.clear()
+
+
+def _format(value: float) -> str:
+    return repr(float(value))
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+# Process-wide registry shared by the server, processors and image pipeline
+metrics = MetricsRegistry()
@@ -0,0 +1,193 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import torch
+from PIL import Image
+from transformers import PreTrainedModel, TrOCRProcessor, VisionEncoderDecoderModel
+
+logger = logging.getLogger(__name__)
+
+# Models are stored next to the backend, matching scripts/download_model.py
+DEFAULT_MODEL_STORE = Path(__file__).resolve().parents[2]
+
+SAFETENSORS_WEIGHTS = "model.safetensors"
+PYTORCH_WEIGHTS = "pytorch_model.bin"
+
+
+class ModelNotFoundError(Exception):
+    """Raised when a model is not in the local store and may not be downloaded"""
+    pass
+
+
+def model_store_root() -> Path:
+    """Directory holding local model copies (OCR_MODEL_STORE overrides the default)"""
+    return Path(os.environ.get("OCR_MODEL_STORE", DEFAULT_MODEL_STORE))
+
+
+def is_offline() -> bool:
+    """True when models must never be fetched from the hub"""
+    return any(os.environ.get(name, "").lower() in ("1", "true", "yes")
+               for name in ("OCR_OFFLINE", "HF_HUB_OFFLINE", "TRANSFORMERS_OFFLINE"))
+
+
+def store_path(model_name: str, revision: str = "main", store: Optional[Path] = None) -> Path:
+    """Local store directory for a hub model id, e.g. microsoft/trocr-large-handwritten -> trocr-large-handwritten"""
+    name = model_name.rstrip("/").split("/")[-1]
+    if revision and revision != "main":
+        name = f"{name}@{revision}"
+    return Path(store or model_store_root()) / name
+
+
+def _has_model_files(model_dir: Path) -> bool:
+    return (model_dir / "config.json").exists() and (
+        (model_dir / SAFETENSORS_WEIGHTS).exists() or (model_dir / PYTORCH_WEIGHTS).exists()
+    )
+
+
+def resolve_model_dir(model_name: str, revision: str = "main", use_auth_token: Optional[str] = None,
+                      store: Optional[Path] = None) -> Path:
+    """Find a model on disk, populating the local store only when it is missing.
+
+    Resolution is offline-first: an explicit local directory, then the model
+    store, then the Hugging Face cache. The hub is contacted only as a last
+    resort and never when offline mode is enabled. Whatever is found outside
+    the store is saved into it as safetensors so later starts skip all of this.
+    """
+    local = Path(model_name)
+    if local.is_dir():
+        return local
+
+    target = store_path(model_name, revision, store)
+    if _has_model_files(target):
+        return target
+
+    sources = [True] if is_offline() else [True, False]
+    for local_files_only in sources:
+        try:
+            processor = TrOCRProcessor.from_pretrained(
+                model_name, revision=revision, use_auth_token=use_auth_token, local_files_only=local_files_only
+            )
+            model = VisionEncoderDecoderModel.from_pretrained(
+                model_name, revision=revision, use_auth_token=use_auth_token, local_files_only=local_files_only
+            )
+        except (OSError, ValueError) as e:
+            logger.info(f"Model {model_name} not available "
+                        f"{'in the local cache' if local_files_only else 'from the hub'}: {str(e)}")
+            continue
+
+        logger.info(f"Saving {model_name} into the local model store at {target}")
+        target.mkdir(parents=True, exist_ok=True)
+        processor.save_pretrained(target)
+        model.save_pretrained(target, safe_serialization=True)
+        del model
+        return target
+
+    raise ModelNotFoundError(
+        f"Model {model_name} is not in the local store ({target}) and could not be fetched"
+        + (" because offline mode is enabled" if is_offline() else "")
+    )
+
+
+def ensure_safetensors(model_dir: Path) -> bool:
+    """Convert a pytorch_model.bin checkpoint to safetensors once. Returns True if converted."""
+    model_dir = Path(model_dir)
+    if (model_dir / SAFETENSORS_WEIGHTS).exists() or not (model_dir / PYTORCH_WEIGHTS).exists():
+        return False
+    if not os.access(model_dir, os.W_OK):
+        logger.warning(f"Model directory {model_dir} is read-only, keeping {PYTORCH_WEIGHTS}")
+        return False
+
+    logger.info(f"Converting {model_dir / PYTORCH_WEIGHTS} to safetensors (one-time)")
+    start = time.perf_counter()
+    model = VisionEncoderDecoderModel.from_pretrained(model_dir, use_safetensors=False, local_files_only=True)
+    model.save_pretrained(model_dir, safe_serialization=True)
+    del model
+    logger.info(f"Converted to safetensors in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def _accelerate_available() -> bool:
+    try:
+        import accelerate  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _materialize_meta_parameters(model: torch.nn.Module) -> int:
+    """Give real storage to any parameter left on the meta device after a low-memory load.
+
+    Safetensors checkpoints drop tied weights (TrOCR's output projection shares
+    the token embedding), and a low-memory load can leave them on ``meta``,
+    which later breaks ``.to(device)``. Re-tying fixes those; anything still
+    missing is allocated and initialized.
+    """
+    # The composite config does not tie, so tie each sub-model (encoder, decoder) itself
+    for module in model.modules():
+        if isinstance(module, PreTrainedModel):
+            module.tie_weights()
+    count = 0
+    for module in model.modules():
+        meta_names = [name for name, param in module.named_parameters(recurse=False) if param.device.type == "meta"]
+        for name in meta_names:
+            param = getattr(module, name)
+            setattr(module, name, torch.nn.Parameter(torch.zeros(param.shape, dtype=param.dtype),
+                                                     requires_grad=param.requires_grad))
+        if meta_names and hasattr(model, "_init_weights"):
+            model._init_weights(module)
+        count += len(meta_names)
+    return count
+
+
+def load_trocr(model_name: str, device: Union[str, torch.device] = "cpu", dtype: torch.dtype = torch.float32,
+               revision: str = "main", use_auth_token: Optional[str] = None,
+               **model_kwargs) -> Tuple[TrOCRProcessor, VisionEncoderDecoderModel]:
+    """Load a TrOCR processor and model from the local store with minimal peak memory.
+
+    Weights are read from safetensors, which are memory-mapped, and with
+    ``low_cpu_mem_usage`` the module is built on the meta device and filled
+    straight from the mapping instead of allocating a randomly initialized
+    copy first.
+    """
+    model_dir = resolve_model_dir(model_name, revision=revision, use_auth_token=use_auth_token)
+    ensure_safetensors(model_dir)
+    use_safetensors = (model_dir / SAFETENSORS_WEIGHTS).exists()
+    low_cpu_mem_usage = _accelerate_available()
+    if not low_cpu_mem_usage:
+        logger.warning("accelerate is not installed; loading without low_cpu_mem_usage (higher peak memory)")
+
+    start = time.perf_counter()
+    processor = TrOCRProcessor.from_pretrained(model_dir, local_files_only=True)
+    model = VisionEncoderDecoderModel.from_pretrained(
+        model_dir,
+        local_files_only=True,
+        use_safetensors=use_safetensors,
+        low_cpu_mem_usage=low_cpu_mem_usage,
+        torch_dtype=dtype,
+        **model_kwargs
+    )
+    materialized = _materialize_meta_parameters(model)
+    if materialized:
+        logger.info(f"Initialized {materialized} parameters missing from the checkpoint")
+
+    model = model.to(device)
+    model.eval()
+    logger.info(f"Loaded {model_name} from {model_dir} in {time.perf_counter() - start:.2f}s "
+                f"(safetensors={use_safetensors}, low_cpu_mem_usage={low_cpu_mem_usage})")
+    return processor, model
+
+
+def warm_up(processor: TrOCRProcessor, model: VisionEncoderDecoderModel,
+            device: Union[str, torch.device] = "cpu") -> float:
+    """Run one tiny inference so the first real request does not pay lazy initialization. Returns seconds."""
+    start = time.perf_counter()
+    image = Image.new("RGB", (384, 384), "white")
+    with torch.no_grad():
+        pixel_values = processor(image, return_tensors="pt").pixel_values.to(device)
+        model.generate(pixel_values, max_new_tokens=2, num_beams=1, do_sample=False)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Warm-up inference took {elapsed:.2f}s")
+    return elapsed
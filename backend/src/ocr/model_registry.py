@@ -0,0 +1,235 @@
+import ctypes
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+import torch
+
+from model_loader import load_trocr
+
+logger = logging.getLogger(__name__)
+
+# Backends a model can be served with; quantized variants are CPU-only
+BACKENDS = ("torch", "torch-qint8")
+
+
+class ModelKey(NamedTuple):
+    """Identity of a loaded model: the same key always maps to the same weights"""
+    model_id: str
+    revision: str
+    dtype: str
+    backend: str
+    device: str
+
+
+def model_size_bytes(model: torch.nn.Module) -> int:
+    """Bytes held by a module's weights, counting each shared (tied) tensor once.
+
+    Uses the state dict rather than ``parameters()`` so dynamically quantized
+    layers, whose packed weights are not parameters, are counted too.
+    """
+    seen = set()
+    size = 0
+
+    def visit(value):
+        nonlocal size
+        if isinstance(value, torch.Tensor):
+            if value.is_quantized:
+                value = value.int_repr()
+            elif value.data_ptr() in seen:
+                return
+            else:
+                seen.add(value.data_ptr())
+            size += value.numel() * value.element_size()
+        elif isinstance(value, (tuple, list)):
+            for item in value:
+                visit(item)
+
+    for value in model.state_dict(keep_vars=True).values():
+        visit(value)
+    return size
+
+
+def trim_heap() -> bool:
+    """Ask glibc to hand freed heap pages back to the OS. Returns False where unsupported."""
+    try:
+        return bool(ctypes.CDLL("libc.so.6").malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+class _Entry:
+    def __init__(self, key: ModelKey, processor: Any, model: torch.nn.Module, load_time: float):
+        self.key = key
+        self.processor = processor
+        self.model = model
+        self.size_bytes = model_size_bytes(model)
+        self.load_time = load_time
+        self.refcount = 0
+        self.last_used = time.monotonic()
+
+
+class ModelHandle:
+    """A reference to a shared model; release it (or use it as a context manager) when done"""
+
+    def __init__(self, registry: "ModelRegistry", entry: _Entry, loaded: bool):
+        self._registry = registry
+        self.key = entry.key
+        self.processor = entry.processor
+        self.model = entry.model
+        # True when this acquire had to load the weights rather than reuse them
+        self.loaded = loaded
+        self.load_time = entry.load_time if loaded else 0.0
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._registry._release(self.key)
+
+    def __enter__(self) -> "ModelHandle":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class ModelRegistry:
+    """Hands out ref-counted model instances shared across the process.
+
+    Models stay cached after their last handle is released so the next
+    acquire is free; when the total size exceeds the memory budget the least
+    recently used idle models are evicted. Models that are in use are never
+    evicted.
+    """
+
+    def __init__(self, memory_budget_bytes: Optional[int] = None, loader: Callable = load_trocr):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._loader = loader
+        self._entries: "OrderedDict[ModelKey, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks: Dict[ModelKey, threading.Lock] = {}
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_id: str, revision: str = "main", dtype: Union[str, torch.dtype] = torch.float32,
+                 backend: str = "torch", device: Union[str, torch.device] = "cpu") -> ModelKey:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}. Expected one of {', '.join(BACKENDS)}")
+        dtype_name = str(dtype).replace("torch.", "")
+        return ModelKey(model_id, revision, dtype_name, backend, torch.device(device).type)
+
+    def acquire(self, model_id: str, revision: str = "main", dtype: Union[str, torch.dtype] = torch.float32,
+                backend: str = "torch", device: Union[str, torch.device] = "cpu", **load_kwargs) -> ModelHandle:
+        """Return a handle to the model, loading it only if no instance is cached"""
+        key = self.make_key(model_id, revision, dtype, backend, device)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given key; others wait and then share it
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry.refcount += 1
+                    entry.last_used = time.monotonic()
+                    return ModelHandle(self, entry, loaded=False)
+
+            entry = self._load(key, **load_kwargs)
+            with self._lock:
+                entry.refcount += 1
+                self._entries[key] = entry
+                self._enforce_budget()
+                return ModelHandle(self, entry, loaded=True)
+
+    def _load(self, key: ModelKey, **load_kwargs) -> _Entry:
+        logger.info(f"Loading model {key.model_id} (revision={key.revision}, dtype={key.dtype}, "
+                    f"backend={key.backend}, device={key.device})")
+        start = time.perf_counter()
+        dtype = getattr(torch, key.dtype)
+        processor, model = self._loader(key.model_id, device=key.device, dtype=dtype,
+                                        revision=key.revision, **load_kwargs)
+        if key.backend == "torch-qint8":
+            if key.device != "cpu":
+                raise ValueError("The torch-qint8 backend is only supported on CPU")
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        load_time = time.perf_counter() - start
+        entry = _Entry(key, processor, model, load_time)
+        logger.info(f"Loaded {key.model_id} ({entry.size_bytes / 2**20:.0f} MB) in {load_time:.2f}s")
+        return entry
+
+    def _release(self, key: ModelKey) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refcount = max(0, entry.refcount - 1)
+            entry.last_used = time.monotonic()
+            self._enforce_budget()
+
+    def _enforce_budget(self) -> None:
+        """Evict idle models, least recently used first, until within budget"""
+        if self.memory_budget_bytes is None:
+            return
+        for key in list(self._entries):
+            if self.total_bytes() <= self.memory_budget_bytes:
+                return
+            if self._entries[key].refcount == 0:
+                self._evict(key)
+        if self.total_bytes() > self.memory_budget_bytes:
+            logger.warning(f"Models in use ({self.total_bytes() / 2**20:.0f} MB) exceed the memory budget "
+                           f"({self.memory_budget_bytes / 2**20:.0f} MB)")
+
+    def _evict(self, key: ModelKey) -> None:
+        entry = self._entries.pop(key)
+        logger.info(f"Evicting idle model {key.model_id} ({entry.size_bytes / 2**20:.0f} MB)")
+        self.evictions += 1
+        del entry
+        gc.collect()
+        trim_heap()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict_idle(self) -> int:
+        """Drop every model nobody is using. Returns the number evicted."""
+        with self._lock:
+            idle = [key for key, entry in self._entries.items() if entry.refcount == 0]
+            for key in idle:
+                self._evict(key)
+            return len(idle)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "total_bytes": self.total_bytes(),
+                "evictions": self.evictions,
+                "models": [
+                    {**entry.key._asdict(), "size_bytes": entry.size_bytes, "refcount": entry.refcount,
+                     "load_time_s": round(entry.load_time, 3)}
+                    for entry in self._entries.values()
+                ]
+            }
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """The process-wide registry; OCR_MODEL_MEMORY_BUDGET_MB sets its budget"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            budget_mb = os.environ.get("OCR_MODEL_MEMORY_BUDGET_MB")
+            _registry = ModelRegistry(int(float(budget_mb) * 2**20) if budget_mb else None)
+        return _registry
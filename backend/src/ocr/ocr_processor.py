@@ -3,15 +3,22 @@ import argparse
 import json
 import sys
 import logging
-from typing import Dict, Optional, List
+import time
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, List, Tuple
 from pathlib import Path
-from tqdm import tqdm
-import cv2
-from PIL import Image
-import torch
-import transformers
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-import re
+from metrics import metrics, SIZE_BUCKETS
+from field_batching import FieldBatcher, generated_lengths
+import field_extractor
+import page_source
+import quality_gate
+from page_source import PageSourceError
+from quality_gate import ScanRejectedError
+
+# torch, transformers, cv2, PIL and tqdm are imported where they are used, so
+# that text-only work (--text --extract) starts without loading them
+if TYPE_CHECKING:
+    import torch
 
 # Configure logging
 logging.basicConfig(
@@ -33,17 +40,49 @@ class OCRProcessingError(Exception):
     """Raised when OCR processing fails"""
     pass
 
+class OCRCancelledError(Exception):
+    """Raised when a request is cancelled or its deadline passes mid-processing"""
+    pass
+
+def is_out_of_memory(error: BaseException) -> bool:
+    """True for allocation failures that a smaller batch might avoid"""
+    if isinstance(error, MemoryError):
+        return True
+    # If torch was never imported the error cannot be one of its OOM errors
+    torch = sys.modules.get("torch")
+    oom_type = getattr(getattr(torch, "cuda", None), "OutOfMemoryError", None)
+    if oom_type is not None and isinstance(error, oom_type):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+class CancellationStoppingCriteria:
+    """Stops beam search between decoding steps once the cancel event is set
+
+    generate() only calls its stopping criteria, so this does not subclass
+    transformers.StoppingCriteria and importing it does not load transformers.
+    """
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
 class OCRProcessor:
-    def __init__(self, model_name="microsoft/trocr-large-handwritten", use_auth_token=None):
+    def __init__(self, model_name="microsoft/trocr-large-handwritten", use_auth_token=None, warm_up_model=True,
+                 revision="main"):
         """Initialize OCR processor with TrOCR model
         
         Args:
             model_name (str): Name or path of the TrOCR model (default: microsoft/trocr-large-handwritten)
             use_auth_token (Optional[str]): HuggingFace auth token for private models
+            warm_up_model (bool): Run one tiny inference before returning so the first request is not slow
+            revision (str): Model revision; a different revision is a different model in the registry
         """
         logger.info(f"Initializing OCR processor with model: {model_name}")
         
         # Check transformers version
+        import transformers
         current_version = transformers.__version__
         logger.info(f"Transformers version: {current_version}")
         
@@ -54,67 +93,97 @@ class OCRProcessor:
         # Set device with proper error handling
         self.device = self._setup_device()
         
+        self.model_name = model_name
+        self.revision = revision
+        self.use_auth_token = use_auth_token
+        self._model_handle = None
+        self.processor = None
+        self.model = None
+        
+        # Generation parameters are per instance and passed on every call,
+        # never written into the shared model's generation_config
+        self.generation_params = {
+            'max_length': 128,
+            'num_beams': 5,
+            'early_stopping': True,
+            'no_repeat_ngram_size': 3,
+            'length_penalty': 2.0,
+            'temperature': 1.0,
+            'do_sample': False
+        }
+        
+        # Full pages are cut into text lines and the lines decoded in batches of this size
+        self.line_segmentation = True
+        self.line_batch_size = 8
+        
+        # Images too blurred, faint or empty to read are rejected before the model sees them
+        self.quality_thresholds = quality_gate.QualityThresholds.from_env()
+        
         # Initialize with proper error handling
         try:
-            logger.info("Attempting to load TrOCR processor...")
-            self.processor = TrOCRProcessor.from_pretrained(
-                model_name,
-                use_auth_token=use_auth_token,
-                use_fast=True,  # Explicitly use fast tokenizer
-                revision="main"  # Explicitly use main branch
-            )
-            logger.info("TrOCR processor loaded successfully.")
-            
-            logger.info("Attempting to load TrOCR model...")
-            model_kwargs = {
-                "torch_dtype": torch.float32,
-                # "use_cache": True, # Removed - Incompatible with transformers 4.50.2
-                # "low_cpu_mem_usage": True, # Removed - Caused meta tensor error with .to(device)
-                "use_safetensors": False,  # Using pytorch_model.bin
-                "revision": "main"
-            }
-            logger.debug(f"Model kwargs: {model_kwargs}")
-            
-            try:
-                logger.info(f"Loading model '{model_name}'...")
-                # Load model with direct device placement
-                self.model = VisionEncoderDecoderModel.from_pretrained(
-                    model_name,
-                    **model_kwargs
-                )
-                logger.info("Model loaded from pretrained.")
-                
-                # Configure generation parameters
-                self.model.generation_config.max_length = 128
-                self.model.generation_config.num_beams = 5
-                self.model.generation_config.early_stopping = True
-                self.model.generation_config.no_repeat_ngram_size = 3
-                self.model.generation_config.length_penalty = 2.0
-                
-                logger.info(f"Moving model to device: {self.device}")
-                # Move to device after configuration
-                self.model = self.model.to(self.device)
-                logger.info("Model moved to device.")
-                logger.info("Setting model to evaluation mode.")
-                self.model.eval()
-                logger.info("Model set to evaluation mode.")
-                
-                # Clear CUDA cache if using GPU
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                    
-            except Exception as e:
-                logger.error(f"Model loading failed: {str(e)}")
-                raise OCRProcessingError(f"Model loading failed: {str(e)}")
-                
+            self._acquire_model(warm_up_model)
             logger.info("OCR processor initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize OCR processor: {str(e)}")
             raise OCRProcessingError(f"Model initialization failed: {str(e)}")
 
-    def _setup_device(self) -> torch.device:
+    def _acquire_model(self, warm_up_model: bool = True) -> None:
+        """Acquire the model from the shared registry, loading it if no one holds it"""
+        import torch
+        from model_loader import warm_up
+        from model_registry import get_registry
+
+        logger.info(f"Acquiring model '{self.model_name}' from the shared model registry...")
+        try:
+            # Weights are shared process-wide; only this handle is ours
+            self._model_handle = get_registry().acquire(
+                self.model_name,
+                revision=self.revision,
+                dtype=torch.float32,
+                device=self.device,
+                use_auth_token=self.use_auth_token
+            )
+            self.processor = self._model_handle.processor
+            self.model = self._model_handle.model
+            
+            # Clear CUDA cache if using GPU
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                
+        except Exception as e:
+            logger.error(f"Model loading failed: {str(e)}")
+            raise OCRProcessingError(f"Model loading failed: {str(e)}")
+
+        # Only the instance that actually loaded the weights pays for warm-up
+        if warm_up_model and self._model_handle.loaded:
+            warm_up(self.processor, self.model, self.device)
+
+    @property
+    def model_loaded(self) -> bool:
+        return self.model is not None
+
+    def unload_model(self) -> None:
+        """Drop this processor's reference to the model; text extraction keeps working"""
+        if self._model_handle is not None:
+            self._model_handle.release()
+        self._model_handle = None
+        self.processor = None
+        self.model = None
+
+    def ensure_model_loaded(self) -> float:
+        """Reacquire the model after unload_model(). Returns seconds spent, 0.0 if it was loaded."""
+        if self.model_loaded:
+            return 0.0
+        start = time.perf_counter()
+        self._acquire_model()
+        elapsed = time.perf_counter() - start
+        logger.info(f"Model reloaded in {elapsed:.2f}s")
+        return elapsed
+
+    def _setup_device(self) -> "torch.device":
         """Setup and return the appropriate torch device with logging"""
+        import torch
         if torch.cuda.is_available():
             device = torch.device("cuda")
             logger.info(f"Using CUDA device: {torch.cuda.get_device_name(0)}")
@@ -124,8 +193,14 @@ class OCRProcessor:
             logger.info("CUDA not available, using CPU")
         return device
 
+    def close(self) -> None:
+        """Release this processor's reference to the shared model"""
+        self.unload_model()
+
     def _preprocess_image(self, image):
         """Preprocess image for better OCR results"""
+        import cv2
+
         logger.debug("Preprocessing image...")
         # Convert to grayscale
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -145,94 +220,57 @@ class OCRProcessor:
 
     def _clean_field_value(self, value: str, field_type: str = None) -> str:
         """Clean and normalize field values"""
-        if not value:
-            return value
-
-        # Split on newlines and take only the first line
-        value = value.split('\n')[0].strip()
-        
-        # Remove any trailing field labels or content after the main value
-        value = re.sub(r'\s*(?:Name|DOB|Gender|Contact|Blood Type|Born|Sex|Tel|Phone|Blood Group|Some|Random|More|text|here|notes).*$', '', value, flags=re.IGNORECASE)
-        
-        # Remove trailing punctuation and whitespace
-        value = re.sub(r'[:\s]+$', '', value)
-        
-        # Additional field-specific cleaning
-        if field_type == 'gender':
-            value = value.lower().strip()
-            if value in ['m', 'male', 'm.', 'man']:
-                value = 'Male'
-            elif value in ['f', 'female', 'f.', 'woman']:
-                value = 'Female'
-            elif value:
-                value = value.capitalize()
-                if value not in ['Male', 'Female']:
-                    return None
-        elif field_type == 'name':
-            # Remove any text after the actual name
-            value = re.sub(r'\s{2,}.*$', '', value)
-            value = re.sub(r'[,;].*$', '', value)
-            value = re.sub(r'\s+(?:Some|Random|other|text|here|notes).*$', '', value, flags=re.IGNORECASE)
-        
-        return value.strip()
+        return field_extractor.clean_field_value(value, field_type)
 
     def extract_patient_data(self, text: str) -> Dict[str, str]:
         """Extract patient data from OCR text"""
-        # Normalize newlines and clean text
-        text = re.sub(r'[\r\n]+', ' ', text)
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        # Define regex patterns for each field
-        patterns = {
-            'name': r'(?:Patient\s*(?:Name)?|Name(?:\s*of\s*Patient)?)\s*:?\s*([^\n:]+?)(?=\s+(?:Date|DOB|Born|Gender|Sex|Contact|Phone|Blood|Some|Random|$))',
-            'dob': r'(?:Date\s*of\s*Birth|DOB|Born)\s*:?\s*([^\n:]+?)(?=\s+(?:Gender|Sex|Contact|Phone|Blood|Some|Random|$))',
-            'gender': r'(?:Gender|Sex)\s*:?\s*([^\n:]+?)(?=\s+(?:Contact|Phone|Tel|Blood|Some|Random|More|$)|$)',
-            'contact_number': r'(?:Contact|Phone|Tel(?:ephone)?)\s*:?\s*([^\n:]+?)(?=\s+(?:Blood|Some|Random|$)|$)',
-            'blood_type': r'(?:Blood\s*(?:Type|Group))\s*:?\s*([^\n:]+?)(?:\s*$|(?=\s+(?:Some|Random|End|\w+:)))'
-        }
-        
-        extracted_data = {}
-        
-        # Extract each field
-        for field, pattern in patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                value = match.group(1).strip()
-                value = self._clean_field_value(value, field)
-                if value:  # Only add non-empty values
-                    extracted_data[field] = value
-        
-        return extracted_data
+        return field_extractor.extract_patient_data(text)
+
+    def extract_patient_data_batch(self, texts: List[str]) -> List[Dict[str, str]]:
+        """Extract patient data from many OCR texts, in input order"""
+        return field_extractor.extract_batch(texts)
 
-    def process_batch(self, image_paths: List[str], batch_size: int = 4) -> Dict[str, str]:
+    def process_batch(self, image_paths: List[str], batch_size: int = 4, cancel_event=None) -> Dict[str, str]:
         """Process multiple images in batches with progress tracking
         
+        Multi-page TIFFs, PDFs and ZIP archives are read page by page (see
+        page_source), so no more than one batch of pages is decoded at a time.
+        
         Args:
-            image_paths (List[str]): List of paths to images
-            batch_size (int): Number of images to process simultaneously
+            image_paths (List[str]): Images, multi-page files, archives or page addresses
+            batch_size (int): Number of pages run through the model together
+            cancel_event (Optional[threading.Event]): Stops the batch between pages when set
             
         Returns:
-            Dict[str, str]: Dictionary mapping image paths to OCR results
+            Dict[str, str]: Dictionary mapping page addresses to OCR results
         """
+        from tqdm import tqdm
+
         results = {}
         errors = {}
+        pages = self._iter_pages(image_paths, errors)
         
         # Create progress bar
-        with tqdm(total=len(image_paths), desc="Processing images") as pbar:
-            # Process images in batches
-            for i in range(0, len(image_paths), batch_size):
-                batch_paths = image_paths[i:i + batch_size]
-                
-                # Process each image in the batch
-                for image_path in batch_paths:
-                    try:
-                        text = self.process_image(image_path)
-                        results[image_path] = text
-                    except Exception as e:
-                        logger.error(f"Error processing {image_path}: {str(e)}")
-                        errors[image_path] = str(e)
-                    finally:
-                        pbar.update(1)
+        with tqdm(desc="Processing pages", unit="page") as pbar:
+            # Process pages in batches, decoding each batch only when it is reached
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise OCRCancelledError(f"Batch cancelled after {len(results) + len(errors)} pages")
+                batch = list(islice(pages, batch_size))
+                if not batch:
+                    break
+                try:
+                    batch_result = self._process_pages(batch, {}, cancel_event=cancel_event)
+                    results.update(batch_result['results'])
+                    errors.update(batch_result['errors'])
+                except OCRCancelledError:
+                    raise
+                except Exception as e:
+                    addresses = [page.address for page in batch]
+                    logger.error(f"Error processing batch {addresses}: {str(e)}")
+                    errors.update({address: str(e) for address in addresses})
+                finally:
+                    pbar.update(len(batch))
         
         return {
             'results': results,
@@ -241,56 +279,191 @@ class OCRProcessor:
             'total_errors': len(errors)
         }
 
-    def process_image(self, image_path: str) -> str:
-        """Process an image and return the raw OCR text using TrOCR"""
+    def _iter_pages(self, image_paths: List[str], errors: Dict[str, str]) -> Iterator[page_source.Page]:
+        """The pages of every source in turn; a source that cannot be read is recorded in ``errors``"""
+        for image_path in image_paths:
+            try:
+                yield from page_source.iter_pages(image_path)
+            except PageSourceError as e:
+                logger.error(str(e))
+                errors[image_path] = str(e)
+
+    def _load_image(self, image_path: str):
+        """Read an image or a page address (see page_source), raising ImageLoadError if it is missing or unreadable"""
+        if not Path(page_source.split_address(image_path)[0]).exists():
+            raise ImageLoadError(f"Image file not found: {image_path}")
         try:
-            logger.info(f"Processing image: {image_path}")
-            
-            # Validate image path
-            if not Path(image_path).exists():
-                raise ImageLoadError(f"Image file not found: {image_path}")
-            
-            # Load the image
-            cv_image = cv2.imread(image_path)
-            if cv_image is None:
-                raise ImageLoadError(f"Failed to load image: {image_path}")
-            
-            # Check image dimensions
-            if cv_image.shape[0] * cv_image.shape[1] > 4096 * 4096:
-                logger.warning("Large image detected, this may impact performance")
-            
-            logger.debug(f"Image loaded successfully, shape: {cv_image.shape}")
+            cv_image = page_source.read_page(image_path)
+        except PageSourceError as e:
+            raise ImageLoadError(str(e)) from e
+        if cv_image is None:
+            raise ImageLoadError(f"Failed to load image: {image_path}")
+        if cv_image.shape[0] * cv_image.shape[1] > 4096 * 4096:
+            logger.warning("Large image detected, this may impact performance")
+        logger.debug(f"Image loaded successfully, shape: {cv_image.shape}")
+        return cv_image
 
-            # Preprocess the image
-            preprocessed_image = self._preprocess_image(cv_image)
-            
-            # Convert to PIL Image
-            pil_image = Image.fromarray(preprocessed_image)
-            
-            # Process image with TrOCR
-            with torch.no_grad():
-                # Get pixel values and move to device
-                pixel_values = self.processor(pil_image, return_tensors="pt").pixel_values
-                pixel_values = pixel_values.to(self.device)
-                
-                # Generate text with improved parameters
+    def _pixel_values(self, cv_images) -> "torch.Tensor":
+        """Preprocess images into one batch of model inputs on the target device"""
+        from PIL import Image
+
+        with metrics.stage("preprocess"):
+            pil_images = [Image.fromarray(self._preprocess_image(cv_image)) for cv_image in cv_images]
+            pixel_values = self.processor(pil_images, return_tensors="pt").pixel_values
+            return pixel_values.to(self.device)
+
+    def _generate_ids(self, pixel_values: "torch.Tensor", cancel_event=None, max_new_tokens=None) -> "torch.Tensor":
+        """Run the encoder and beam search over a batch; max_new_tokens overrides max_length"""
+        import torch
+        from transformers import StoppingCriteriaList
+
+        metrics.observe("ocr_inference_batch_size", pixel_values.shape[0], buckets=SIZE_BUCKETS)
+        stopping_criteria = None
+        if cancel_event is not None:
+            stopping_criteria = StoppingCriteriaList([CancellationStoppingCriteria(cancel_event)])
+        params = self.generation_params
+        if max_new_tokens is not None:
+            params = {k: v for k, v in params.items() if k != 'max_length'}
+            params['max_new_tokens'] = max_new_tokens
+
+        with torch.no_grad():
+            # Run the encoder separately so its cost is visible apart from beam search
+            with metrics.stage("encode"):
+                encoder_outputs = self.model.encoder(pixel_values=pixel_values)
+
+            with metrics.stage("generate"):
                 generated_ids = self.model.generate(
-                    pixel_values,
-                    max_length=128,
-                    num_beams=5,
-                    early_stopping=True,
-                    no_repeat_ngram_size=3,
-                    length_penalty=2.0,
-                    temperature=1.0,
-                    do_sample=False
+                    encoder_outputs=encoder_outputs,
+                    stopping_criteria=stopping_criteria,
+                    **params
                 )
-                
-                # Decode the generated ids
-                generated_text = self.processor.batch_decode(
-                    generated_ids, 
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True
-                )[0]
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise OCRCancelledError("Request cancelled during generation")
+        return generated_ids
+
+    def _generate(self, pixel_values: "torch.Tensor", cancel_event=None) -> List[str]:
+        """Run the encoder and beam search over a batch and decode the texts"""
+        generated_ids = self._generate_ids(pixel_values, cancel_event)
+        with metrics.stage("postprocess"):
+            return self.processor.batch_decode(
+                generated_ids,
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=True
+            )
+
+    def _read_crops(self, cv_images, max_new_tokens: int, cancel_event=None) -> List[Tuple[str, int]]:
+        """Read a batch of line crops; returns (text, generated tokens) per crop"""
+        generated_ids = self._generate_ids(self._pixel_values(cv_images), cancel_event, max_new_tokens)
+        with metrics.stage("postprocess"):
+            texts = self.processor.batch_decode(
+                generated_ids,
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=True
+            )
+            eos_token_id = self.model.generation_config.eos_token_id
+            if isinstance(eos_token_id, list):
+                eos_token_id = eos_token_id[0]
+            # Column 0 is the decoder start token
+            lengths = generated_lengths(generated_ids[:, 1:].tolist(), eos_token_id)
+        return [(text.strip(), length) for text, length in zip(texts, lengths)]
+
+    def _read_pages(self, cv_images, cancel_event=None) -> List[str]:
+        """Read whole pages line by line
+        
+        TrOCR reads a single line of text, so each page is cut into lines on
+        its adaptive-threshold image, the lines of all pages are decoded
+        together in length buckets, and each page's text is reassembled in
+        reading order. A page with no ink reads as empty text.
+        """
+        if not self.line_segmentation:
+            return self._generate(self._pixel_values(cv_images), cancel_event)
+        from line_segmentation import crop, join_lines, segment_lines
+
+        batcher = FieldBatcher(batch_size=self.line_batch_size)
+        page_boxes = []
+        for page, cv_image in enumerate(cv_images):
+            with metrics.stage("segment"):
+                boxes = segment_lines(self._preprocess_image(cv_image))
+            metrics.observe("ocr_lines_per_page", len(boxes), buckets=SIZE_BUCKETS)
+            page_boxes.append(boxes)
+            for index, box in enumerate(boxes):
+                batcher.add((page, index), "line", crop(cv_image, box))
+
+        texts = batcher.flush(lambda crops, limit: self._read_crops(crops, limit, cancel_event))
+        return [join_lines(boxes, [texts[(page, index)] for index in range(len(boxes))])
+                for page, boxes in enumerate(page_boxes)]
+
+    def process_images(self, image_paths: List[str], cancel_event=None) -> Dict[str, Dict[str, str]]:
+        """Run several images through the model as one batch
+        
+        Images that cannot be loaded, fail the quality gate or read as empty
+        go to ``errors``; the lines of the rest are decoded together.
+        Out-of-memory errors are raised (see is_out_of_memory) so the caller
+        can retry with fewer images.
+        
+        Returns:
+            Dict: {'results': {path: text}, 'errors': {path: message}}
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise OCRCancelledError("Request cancelled before processing")
+
+        errors = {}
+        pages = []
+        for image_path in image_paths:
+            try:
+                pages.append(page_source.Page(image_path, self._load_image(image_path)))
+            except ImageLoadError as e:
+                logger.error(str(e))
+                errors[image_path] = str(e)
+        return self._process_pages(pages, errors, cancel_event)
+
+    def _process_pages(self, pages: List[page_source.Page], errors: Dict[str, str],
+                       cancel_event=None) -> Dict[str, Dict[str, str]]:
+        """Gate decoded pages and read the rest as one batch; results and errors are keyed by address"""
+        loaded = []
+        for page in pages:
+            if page.image is None:
+                errors[page.address] = f"Failed to load image: {page.address}"
+                continue
+            try:
+                quality_gate.check_image(page.image, self.quality_thresholds)
+                loaded.append(page)
+            except ScanRejectedError as e:
+                logger.error(str(e))
+                errors[page.address] = str(e)
+
+        results = {}
+        if loaded:
+            self.ensure_model_loaded()
+            texts = self._read_pages([page.image for page in loaded], cancel_event)
+            for page, text in zip(loaded, texts):
+                if text.strip():
+                    results[page.address] = text
+                else:
+                    errors[page.address] = "OCR extracted empty text"
+        return {'results': results, 'errors': errors}
+
+    def process_image(self, image_path: str, cancel_event=None) -> str:
+        """Process an image and return the raw OCR text using TrOCR
+        
+        Args:
+            image_path (str): Path to the image
+            cancel_event (Optional[threading.Event]): Aborts generation between decoding steps when set
+            
+        Raises:
+            ScanRejectedError: The image failed the quality gate; the model was not run
+        """
+        try:
+            if cancel_event is not None and cancel_event.is_set():
+                raise OCRCancelledError("Request cancelled before processing")
+
+            logger.info(f"Processing image: {image_path}")
+            cv_image = self._load_image(image_path)
+            quality_gate.check_image(cv_image, self.quality_thresholds)
+            
+            self.ensure_model_loaded()
+            generated_text = self._read_pages([cv_image], cancel_event)[0]
 
             if not generated_text.strip():
                 raise OCRProcessingError("OCR extracted empty text")
@@ -299,14 +472,14 @@ class OCRProcessor:
 
         except Exception as e:
             logger.error(f"OCR processing failed: {str(e)}")
-            if isinstance(e, (ImageLoadError, OCRProcessingError)):
+            if isinstance(e, (ImageLoadError, OCRProcessingError, OCRCancelledError, ScanRejectedError)):
                 raise
             raise OCRProcessingError(f"OCR processing failed: {str(e)}")
 
 def main():
     parser = argparse.ArgumentParser(description='Process images with OCR and extract patient data')
     parser.add_argument('--image', help='Path to the image file to process')
-    parser.add_argument('--batch', help='Directory containing images to process in batch')
+    parser.add_argument('--batch', help='Directory of images, or a multi-page TIFF, PDF or ZIP archive, to process in batch')
     parser.add_argument('--batch-size', type=int, default=4, help='Batch size for processing multiple images')
     parser.add_argument('--text', help='Raw OCR text to extract data from')
     parser.add_argument('--extract', action='store_true', help='Extract patient data from text')
@@ -315,11 +488,24 @@ def main():
     args = parser.parse_args()
 
     try:
+        if not (args.batch or args.image):
+            if args.text and args.extract:
+                # Extract patient data from text; needs no model, so none is loaded
+                data = field_extractor.extract_patient_data(args.text)
+                print(json.dumps({'data': data}))
+                return
+            print(json.dumps({'error': 'Invalid arguments. Use --image, --batch, or --text with --extract'}))
+            sys.exit(1)
+
         processor = OCRProcessor()
 
         if args.batch:
-            # Process directory of images in batch
-            image_paths = [str(p) for p in Path(args.batch).glob('*.{jpg,jpeg,png,bmp}')]
+            # Process a directory of images, or the pages of one file, in batch
+            source = Path(args.batch)
+            if source.is_file():
+                image_paths = [str(source)]
+            else:
+                image_paths = sorted(str(p) for p in source.glob('*') if p.suffix.lower() in page_source.SOURCE_SUFFIXES)
             if not image_paths:
                 raise ValueError(f"No supported images found in {args.batch}")
                 
@@ -332,19 +518,10 @@ def main():
             else:
                 print(json.dumps(results, indent=2))
                 
-        elif args.image:
+        else:
             # Process single image
             text = processor.process_image(args.image)
             print(json.dumps({'text': text}))
-            
-        elif args.text and args.extract:
-            # Extract patient data from text
-            data = processor.extract_patient_data(args.text)
-            print(json.dumps({'data': data}))
-            
-        else:
-            print(json.dumps({'error': 'Invalid arguments. Use --image, --batch, or --text with --extract'}))
-            sys.exit(1)
 
     except Exception as e:
         print(json.dumps({'error': str(e)}))
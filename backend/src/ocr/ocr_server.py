@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
+import time
+
+# Taken before the heavy imports below so time-to-ready covers them
+_PROCESS_START = time.perf_counter()
+
+import gc
 import sys
 import json
 import logging
 import os
 from pathlib import Path
-from ocr_processor import OCRProcessor
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import page_source
+from ocr_processor import OCRProcessor, OCRCancelledError, is_out_of_memory
+from quality_gate import ScanRejectedError
+from batch_controller import BatchSizeController
+from resource_manager import apply_profile, load_profile, pin_current_thread
+from metrics import metrics, SIZE_BUCKETS, peak_rss_bytes, process_rss_bytes
+from model_registry import get_registry
+from request_queue import (
+    OCRJob, InFlightRegistry, LaneQueue, QueueFullError, coalescing_key, request_lane, resolve_deadline
+)
 import asyncio
 import signal
 
@@ -19,6 +36,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Replaced models remembered for rollback
+MODEL_HISTORY_LIMIT = 5
+
+KEY_PACKAGES = ("torch", "transformers", "safetensors", "accelerate", "opencv-python", "numpy", "Pillow")
+
 def validate_venv():
     """Validate that we're running in a virtual environment"""
     if not hasattr(sys, 'real_prefix') and not (hasattr(sys, 'base_prefix') and sys.base_prefix != sys.prefix):
@@ -32,30 +54,79 @@ def validate_venv():
     logger.info(f"PYTHONPATH: {os.environ.get('PYTHONPATH', 'Not set')}")
     logger.info(f"VIRTUAL_ENV: {os.environ.get('VIRTUAL_ENV', 'Not set')}")
     
-    # Log installed packages
-    try:
-        import pkg_resources
-        installed_packages = [f"{pkg.key} {pkg.version}" for pkg in pkg_resources.working_set]
-        logger.info("Installed packages:")
-        for pkg in installed_packages:
-            logger.info(f"  {pkg}")
-    except Exception as e:
-        logger.error(f"Failed to list installed packages: {e}")
+    # Log the versions of the packages the OCR pipeline depends on. Only these are
+    # looked up; enumerating every installed distribution is slow on startup.
+    from importlib import metadata
+    logger.info("Key packages:")
+    for package in KEY_PACKAGES:
+        try:
+            logger.info(f"  {package} {metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            logger.info(f"  {package} not installed")
+
+def idle_unload_seconds():
+    """Idle time before the model is unloaded, from OCR_IDLE_UNLOAD_MINUTES (unset or 0 disables it)"""
+    minutes = float(os.environ.get('OCR_IDLE_UNLOAD_MINUTES', '0') or 0)
+    return minutes * 60 if minutes > 0 else None
 
 class OCRServer:
     def __init__(self):
         """Initialize OCR server with persistent model loading"""
         self.processor = None
         self.running = False
+        # Thread budgets for OpenCV and torch (OCR_RESOURCE_MODE / OCR_RESOURCE_PROFILES)
+        self.resource_profile = load_profile()
+        # Requests are read concurrently but model work runs on a single thread
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="ocr-worker",
+            initializer=pin_current_thread, initargs=(self.resource_profile, 'inference')
+        )
+        self.queue = None
+        self.in_flight = InFlightRegistry()
+        self.stats = {
+            'requests_received': 0,
+            'requests_executed': 0,
+            'requests_coalesced': 0,
+            'requests_failed': 0,
+            'requests_cancelled': 0,
+            'requests_expired': 0,
+            'requests_rejected': 0,
+            'jobs_dropped': 0,
+            'jobs_aborted': 0,
+            'batch_preemptions': 0,
+            'model_unloads': 0,
+            'model_reloads': 0,
+            'model_swaps': 0,
+            'model_rollbacks': 0
+        }
+        self.startup = {}
+        self.processor_factory = OCRProcessor
+        # Release the model after this many idle seconds (None keeps it loaded)
+        self.idle_unload_after = idle_unload_seconds()
+        self.last_activity = time.monotonic()
+        self.last_reload_time = None
+        # The model serving requests, and the ones it replaced (most recent last) for rollback
+        self.model_spec = None
+        self.model_history = []
+        self.model_loading = False
+        self.batch_controller = BatchSizeController.from_env()
         
     async def initialize(self):
         """Initialize the OCR processor"""
         try:
             # Validate virtual environment first
             validate_venv()
+
+            # Before the model loads, so torch sizes its thread pools from the profile
+            apply_profile(self.resource_profile)
             
             logger.info("Attempting to instantiate OCRProcessor...") # New log
-            self.processor = OCRProcessor()
+            self.processor = self.processor_factory()
+            self.model_spec = {
+                'model_name': self.processor.model_name,
+                'revision': getattr(self.processor, 'revision', 'main'),
+                'version': os.environ.get('OCR_MODEL_VERSION') or self.processor.model_name
+            }
             logger.info("OCRProcessor instantiation attempted.") # New log (will likely not be reached if error is in __init__)
             logger.info("OCR processor initialized successfully")
             return True
@@ -63,8 +134,8 @@ class OCRServer:
             logger.error(f"Failed to initialize OCR processor: {str(e)}")
             return False
 
-    async def process_request(self, request_data: dict) -> dict:
-        """Process a single request"""
+    def execute_request(self, request_data: dict, cancel_event=None) -> dict:
+        """Execute a single request against the OCR processor (runs on the worker thread)"""
         try:
             if not self.processor:
                 raise Exception("OCR processor not initialized")
@@ -78,18 +149,20 @@ class OCRServer:
                 if not image_path:
                     raise ValueError("No image path provided")
                 
-                text = self.processor.process_image(image_path)
-                return {'status': 'success', 'text': text}
-                
-            elif command == 'process_batch':
-                image_paths = request_data.get('image_paths', [])
-                batch_size = request_data.get('batch_size', 4)
-                
-                if not image_paths:
-                    raise ValueError("No image paths provided")
-                    
-                results = self.processor.process_batch(image_paths, batch_size)
-                return {'status': 'success', 'results': results}
+                reload_time = self._ensure_model_loaded()
+                start_time = time.perf_counter()
+                with metrics.collect() as stage_timings:
+                    text = self.processor.process_image(image_path, cancel_event=cancel_event)
+                response = {
+                    'status': 'success',
+                    'text': text,
+                    'processing_time': round(time.perf_counter() - start_time, 4),
+                    'stage_timings': {stage: round(seconds, 4) for stage, seconds in stage_timings.items()}
+                }
+                if reload_time:
+                    response['model_reload_time'] = round(reload_time, 4)
+                response['model_version'] = self.model_version
+                return response
                 
             elif command == 'extract_data':
                 text = request_data.get('text')
@@ -98,16 +171,474 @@ class OCRServer:
                     
                 data = self.processor.extract_patient_data(text)
                 return {'status': 'success', 'data': data}
+
+            elif command == 'extract_data_batch':
+                texts = request_data.get('texts')
+                if not isinstance(texts, list):
+                    raise ValueError("No texts provided")
+                for index, text in enumerate(texts):
+                    if not isinstance(text, str):
+                        raise ValueError(f"texts[{index}] is not a string")
+
+                start_time = time.perf_counter()
+                results = self.processor.extract_patient_data_batch(texts)
+                return {
+                    'status': 'success',
+                    'results': results,
+                    'count': len(results),
+                    'processing_time': round(time.perf_counter() - start_time, 4)
+                }
                 
             else:
                 raise ValueError(f"Unknown command: {command}")
 
+        except OCRCancelledError as e:
+            logger.info(f"Request aborted: {str(e)}")
+            return {'status': 'error', 'error': str(e), 'code': 'CANCELLED'}
+        except ScanRejectedError as e:
+            logger.info(f"Request rejected: {str(e)}")
+            return {'status': 'error', 'error': str(e), 'code': 'SCAN_REJECTED', 'quality': e.report.as_dict()}
         except Exception as e:
             logger.error(f"Error processing request: {str(e)}")
             return {'status': 'error', 'error': str(e)}
 
+    @property
+    def model_version(self):
+        return self.model_spec['version'] if self.model_spec else None
+
+    async def swap_model(self, spec: dict, rollback: bool = False) -> dict:
+        """Load a model next to the serving one, switch to it, then free the old one.
+
+        The new model loads off the model thread so the old one keeps serving.
+        The switch itself runs on the model thread, so it happens between two
+        inference calls: the request the old model is working on finishes on
+        it (draining it) and every later request sees the new model.
+        """
+        if self.model_loading:
+            return {'status': 'error', 'error': 'A model is already being loaded',
+                    'code': 'MODEL_LOAD_IN_PROGRESS', 'model_version': self.model_version}
+        loop = asyncio.get_running_loop()
+        self.model_loading = True
+        try:
+            logger.info(f"Loading model {spec['model_name']} (version {spec['version']}) alongside "
+                        f"{self.model_version}")
+            start = time.perf_counter()
+            try:
+                processor = await loop.run_in_executor(
+                    None, partial(self.processor_factory, model_name=spec['model_name'], revision=spec['revision'])
+                )
+            except Exception as e:
+                logger.error(f"Failed to load model {spec['model_name']}: {str(e)}")
+                return {'status': 'error', 'error': f"Failed to load model: {str(e)}",
+                        'code': 'MODEL_LOAD_FAILED', 'model_version': self.model_version}
+            load_time = time.perf_counter() - start
+
+            old_processor, old_spec = await loop.run_in_executor(
+                self.executor, self._switch_model, processor, spec
+            )
+            if rollback:
+                self.model_history.pop()
+                self.stats['model_rollbacks'] += 1
+            elif old_spec is not None:
+                self.model_history = (self.model_history + [old_spec])[-MODEL_HISTORY_LIMIT:]
+            self.stats['model_swaps'] += 1
+
+            if old_processor is not None and old_processor is not processor:
+                await loop.run_in_executor(None, self._retire_processor, old_processor)
+            logger.info(f"Now serving model version {spec['version']} "
+                        f"(loaded in {load_time:.2f}s, replaced {old_spec and old_spec['version']})")
+            return {
+                'status': 'success',
+                'model_version': spec['version'],
+                'previous_version': old_spec['version'] if old_spec else None,
+                'load_time': round(load_time, 4)
+            }
+        finally:
+            self.model_loading = False
+
+    def _switch_model(self, processor, spec: dict):
+        """Make ``processor`` the serving model (runs on the model thread between requests)"""
+        old = self.processor, self.model_spec
+        self.processor = processor
+        self.model_spec = spec
+        return old
+
+    def _retire_processor(self, processor):
+        """Free a model that has been switched out and drained"""
+        processor.unload_model()
+        get_registry().evict_idle()
+
+    async def load_model(self, request_data: dict) -> dict:
+        """Handle the load_model command"""
+        model_name = request_data.get('model_name')
+        if not model_name:
+            return {'status': 'error', 'error': 'No model_name provided', 'model_version': self.model_version}
+        revision = request_data.get('revision') or 'main'
+        version = request_data.get('version') or (model_name if revision == 'main' else f"{model_name}@{revision}")
+        return await self.swap_model({'model_name': model_name, 'revision': revision, 'version': version})
+
+    async def rollback_model(self) -> dict:
+        """Handle the rollback command: switch back to the model the last swap replaced"""
+        if not self.model_history:
+            return {'status': 'error', 'error': 'No previous model to roll back to',
+                    'code': 'NO_PREVIOUS_MODEL', 'model_version': self.model_version}
+        return await self.swap_model(self.model_history[-1], rollback=True)
+
+    def _ensure_model_loaded(self) -> float:
+        """Reload the model if it was unloaded while idle. Returns the reload time in seconds."""
+        reload_time = self.processor.ensure_model_loaded()
+        if reload_time:
+            self.stats['model_reloads'] += 1
+            self.last_reload_time = reload_time
+            metrics.observe('ocr_model_reload_seconds', reload_time)
+            logger.info(f"Model reloaded on demand in {reload_time:.2f}s")
+        return reload_time
+
+    def _unload_idle_model(self):
+        """Release the model and give its memory back to the OS (runs on the worker thread)"""
+        if not self.processor or not self.processor.model_loaded:
+            return
+        rss_before = process_rss_bytes()
+        self.processor.unload_model()
+        get_registry().evict_idle()
+        self.stats['model_unloads'] += 1
+        rss_after = process_rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            logger.info(f"Unloaded idle model, RSS {rss_before / 2**20:.0f} MB -> {rss_after / 2**20:.0f} MB")
+        else:
+            logger.info("Unloaded idle model")
+
+    def _is_idle(self) -> bool:
+        return (self.queue is not None and self.queue.qsize() == 0 and len(self.in_flight) == 0
+                and time.monotonic() - self.last_activity >= self.idle_unload_after)
+
+    async def _idle_monitor(self, interval: float = None):
+        """Unload the model once no requests have arrived for ``idle_unload_after`` seconds"""
+        loop = asyncio.get_running_loop()
+        if interval is None:
+            interval = min(60.0, max(1.0, self.idle_unload_after / 10))
+        while True:
+            await asyncio.sleep(interval)
+            if self.processor and self.processor.model_loaded and self._is_idle():
+                logger.info(f"No requests for {time.monotonic() - self.last_activity:.0f}s, unloading the model")
+                # Use the model thread so an unload never overlaps inference
+                await loop.run_in_executor(self.executor, self._unload_idle_model)
+
+    def get_stats(self) -> dict:
+        """Return a snapshot of the server counters, queues and pipeline metrics"""
+        return {
+            **self.stats,
+            'startup': self.startup,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'lanes': self.queue.lane_stats() if self.queue else {},
+            'in_flight': len(self.in_flight),
+            'model': {
+                'version': self.model_version,
+                'loading': self.model_loading,
+                'history': [spec['version'] for spec in self.model_history],
+                'loaded': bool(self.processor and self.processor.model_loaded),
+                'idle_unload_after_s': self.idle_unload_after,
+                'idle_s': round(time.monotonic() - self.last_activity, 1),
+                'last_reload_time_s': None if self.last_reload_time is None else round(self.last_reload_time, 3)
+            },
+            'models': get_registry().stats(),
+            'batching': self.batch_controller.snapshot(),
+            'resources': self.resource_profile._asdict(),
+            'metrics': metrics.snapshot()
+        }
+
+    def _prometheus_counters(self) -> dict:
+        """Server totals in Prometheus naming; they only ever increase"""
+        return {f"ocr_server_{name}_total": value for name, value in self.stats.items()}
+
+    def _prometheus_gauges(self) -> dict:
+        """Server state and queue depths in Prometheus naming"""
+        gauges = {'ocr_server_in_flight': len(self.in_flight)}
+        gauges['ocr_model_registry_bytes'] = get_registry().total_bytes()
+        gauges['ocr_batch_size'] = self.batch_controller.size
+        if self.queue:
+            for lane, lane_stats in self.queue.lane_stats().items():
+                gauges[f'ocr_queue_depth{{lane="{lane}"}}'] = lane_stats['depth']
+                for name, value in lane_stats['wait_ms'].items():
+                    # Prometheus quantile labels are numbers: p95 -> 0.95
+                    quantile = int(name[1:]) / 100
+                    gauges[f'ocr_queue_wait_ms{{lane="{lane}",quantile="{quantile}"}}'] = value
+        return gauges
+
+    async def _write_metrics_periodically(self, path: str, interval: float):
+        """Refresh a Prometheus text file every ``interval`` seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, metrics.write_prometheus, path,
+                                           self._prometheus_gauges(), self._prometheus_counters())
+            except Exception as e:
+                logger.error(f"Failed to write metrics file {path}: {str(e)}")
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def create_queue() -> LaneQueue:
+        """Build the job queue with lane limits from the environment"""
+        limits = {}
+        for lane, variable in (('interactive', 'OCR_QUEUE_LIMIT_INTERACTIVE'), ('batch', 'OCR_QUEUE_LIMIT_BATCH')):
+            if os.environ.get(variable):
+                limits[lane] = int(os.environ[variable])
+        return LaneQueue(limits)
+
+    def cancel_request(self, request_id: str, reason: str = 'cancelled') -> bool:
+        """Detach a caller from its job, aborting the job if nobody else is waiting"""
+        job = self.in_flight.find(request_id)
+        if job is None:
+            return False
+        waiter = next((w for w in job.waiters if w.request_id == request_id), None)
+        if waiter is None:
+            return False
+        self._detach(job, waiter, reason)
+        return True
+
+    def _detach(self, job: OCRJob, waiter, reason: str):
+        """Answer a caller that is giving up and cancel the job once it is orphaned"""
+        self.in_flight.untrack(waiter.request_id)
+        if reason == 'deadline':
+            self.stats['requests_expired'] += 1
+            response = {'status': 'error', 'error': 'Request deadline exceeded', 'code': 'DEADLINE_EXCEEDED'}
+        else:
+            self.stats['requests_cancelled'] += 1
+            response = {'status': 'error', 'error': 'Request cancelled', 'code': 'CANCELLED'}
+        if not waiter.future.done():
+            waiter.future.set_result(response)
+        if job.detach(waiter):
+            self.in_flight.remove(job)
+            logger.info(f"No callers left for {job.command} job ({reason}), "
+                        f"{'aborting' if job.started else 'dropping'} it")
+
+    async def process_request(self, request_data: dict) -> dict:
+        """Process a single request, sharing work with identical in-flight requests"""
+        request_id = request_data.get('request_id')
+        command = request_data.get('command')
+
+        if command == 'stats':
+            return {'status': 'success', 'stats': self.get_stats(), 'request_id': request_id}
+        if command == 'cancel':
+            target = request_data.get('target_id')
+            if not target:
+                return {'status': 'error', 'error': 'No target_id provided', 'request_id': request_id}
+            return {'status': 'success', 'cancelled': self.cancel_request(target), 'request_id': request_id}
+        if command == 'load_model':
+            return {**await self.load_model(request_data), 'request_id': request_id}
+        if command == 'rollback':
+            return {**await self.rollback_model(), 'request_id': request_id}
+
+        # Only work requests count, so stats polls and cancels do not dilute the coalescing ratio
+        self.stats['requests_received'] += 1
+        self.last_activity = time.monotonic()
+        loop = asyncio.get_running_loop()
+        deadline = resolve_deadline(request_data, loop.time())
+        # An unknown priority is an error whether or not the request has a twin in flight
+        lane = request_lane(request_data)
+        key = await loop.run_in_executor(None, coalescing_key, request_data)
+
+        job = self.in_flight.get(key)
+        coalesced = job is not None and not job.cancelled
+        if key is not None:
+            metrics.record_cache('coalescing', coalesced)
+        if coalesced:
+            waiter = job.attach(request_id, deadline)
+            self.stats['requests_coalesced'] += 1
+            if self.queue.promote(job, lane):
+                # Priority is not part of the key, so a queued job waits in its most urgent caller's lane
+                logger.info(f"Moved queued {job.command} job to the {lane} lane")
+            logger.info(f"Coalesced {job.command} request onto in-flight job ({len(job.waiters)} waiters)")
+        else:
+            job = OCRJob(request_data, key)
+            try:
+                self.queue.put_nowait(job)
+            except QueueFullError as e:
+                # Fail fast so the caller can back off instead of timing out
+                self.stats['requests_rejected'] += 1
+                logger.warning(str(e))
+                return {'status': 'error', 'error': str(e), 'code': 'SERVER_BUSY',
+                        'lane': job.lane, 'request_id': request_id}
+            waiter = job.attach(request_id, deadline)
+            self.in_flight.add(job)
+        self.in_flight.track(request_id, job)
+
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            response = dict(await asyncio.wait_for(asyncio.shield(waiter.future), timeout))
+        except asyncio.TimeoutError:
+            self._detach(job, waiter, 'deadline')
+            response = dict(waiter.future.result())
+        finally:
+            self.in_flight.untrack(request_id)
+
+        if coalesced:
+            response['coalesced'] = True
+        if request_id is not None:
+            response['request_id'] = request_id
+        return response
+
+    async def _worker(self):
+        """Run queued jobs one at a time on the model thread, highest priority first"""
+        while True:
+            job = await self.queue.get()
+            await self._run_job(job)
+
+    async def _run_job(self, job: OCRJob):
+        """Execute a dequeued job and deliver its result to every waiter"""
+        loop = asyncio.get_running_loop()
+        if job.cancelled:
+            # Every caller already left or expired; skip the work entirely
+            self.stats['jobs_dropped'] += 1
+            self.in_flight.remove(job)
+            self.queue.task_done()
+            return
+
+        job.started = True
+        try:
+            if job.command == 'process_batch':
+                result = await self._run_batch(job)
+            else:
+                result = await loop.run_in_executor(
+                    self.executor, self.execute_request, job.request_data, job.cancel_event
+                )
+        except Exception as e:
+            result = {'status': 'error', 'error': str(e)}
+        finally:
+            self.in_flight.remove(job)
+            self.queue.task_done()
+            self.last_activity = time.monotonic()
+
+        if job.cancelled:
+            self.stats['jobs_aborted'] += 1
+            return
+        self.stats['requests_executed'] += 1
+        if result.get('status') == 'error':
+            self.stats['requests_failed'] += 1
+        metrics.inc('ocr_requests_total', command=job.command, status=result.get('status'))
+        job.resolve(result)
+
+    async def _run_preempting_jobs(self, lane: str):
+        """Run any jobs waiting in lanes with higher priority than ``lane``"""
+        while True:
+            job = self.queue.get_nowait(above=lane)
+            if job is None:
+                return
+            self.stats['batch_preemptions'] += 1
+            await self._run_job(job)
+
+    def execute_chunk(self, image_paths: list, cancel_event=None) -> dict:
+        """Run a group of batch images through the model together (runs on the worker thread)"""
+        try:
+            reload_time = self._ensure_model_loaded()
+            start_time = time.perf_counter()
+            with metrics.collect() as stage_timings:
+                batch = self.processor.process_images(image_paths, cancel_event=cancel_event)
+            return {
+                'status': 'success',
+                'results': batch['results'],
+                'errors': batch['errors'],
+                'inference_time': time.perf_counter() - start_time,
+                'stage_timings': stage_timings,
+                'model_reload_time': reload_time,
+                'model_version': self.model_version
+            }
+        except OCRCancelledError as e:
+            logger.info(f"Request aborted: {str(e)}")
+            return {'status': 'error', 'error': str(e), 'code': 'CANCELLED'}
+        except Exception as e:
+            if is_out_of_memory(e):
+                logger.warning(f"Out of memory running {len(image_paths)} images together: {str(e)}")
+                gc.collect()
+                return {'status': 'error', 'error': str(e), 'code': 'OUT_OF_MEMORY'}
+            logger.error(f"Error processing batch chunk: {str(e)}")
+            return {'status': 'error', 'error': str(e)}
+
+    async def _run_batch(self, job: OCRJob) -> dict:
+        """Run a batch in model-sized chunks, letting higher-priority work in between chunks.
+
+        Chunk sizes come from the adaptive batch controller unless the request
+        pins one with ``batch_size``. A chunk that runs out of memory is retried
+        at half its own size, below the controller's minimum if need be; a single
+        page that still runs out of memory fails with OUT_OF_MEMORY.
+        """
+        loop = asyncio.get_running_loop()
+        image_paths = job.request_data.get('image_paths', [])
+        if not image_paths:
+            raise ValueError("No image paths provided")
+
+        # Multi-page files and archives are run page by page, each page decoded in its own chunk.
+        # Counting the pages of a large PDF or archive takes a while, so it runs off the event loop
+        # and stdin (cancels, stats) keeps being read meanwhile
+        image_paths, errors = await loop.run_in_executor(None, page_source.expand, image_paths)
+        metrics.observe('ocr_request_batch_size', len(image_paths), buckets=SIZE_BUCKETS)
+        fixed_size = job.request_data.get('batch_size')
+        results = {}
+        reload_time = 0.0
+        versions = []
+        position = 0
+        # Size of the retry after a chunk ran out of memory, which the controller's minimum cannot hold up
+        retry_size = None
+        while position < len(image_paths):
+            await self._run_preempting_jobs(job.lane)
+            size = retry_size or (int(fixed_size) if fixed_size else self.batch_controller.size)
+            chunk = image_paths[position:position + size]
+            response = await loop.run_in_executor(self.executor, self.execute_chunk, chunk, job.cancel_event)
+            code = response.get('code')
+            if code == 'CANCELLED':
+                return response
+            if code == 'OUT_OF_MEMORY' and len(chunk) > 1:
+                self.batch_controller.observe_oom(len(chunk))
+                retry_size = max(1, len(chunk) // 2)
+                if fixed_size:
+                    fixed_size = retry_size
+                logger.info(f"Retrying {len(chunk)} images in chunks of {retry_size}")
+                continue
+            retry_size = None
+            position += len(chunk)
+            if code == 'OUT_OF_MEMORY':
+                errors[chunk[0]] = f"OUT_OF_MEMORY: {response['error']}"
+                continue
+            if response['status'] == 'error':
+                errors.update({image_path: response['error'] for image_path in chunk})
+                continue
+
+            if not fixed_size:
+                self.batch_controller.observe(len(chunk), response['inference_time'])
+            reload_time += response['model_reload_time']
+            if response['model_version'] not in versions:
+                versions.append(response['model_version'])
+            results.update(response['results'])
+            errors.update(response['errors'])
+
+        batch_response = {'status': 'success', 'results': {
+            'results': results,
+            'errors': errors,
+            'total_processed': len(results),
+            'total_errors': len(errors)
+        }}
+        if reload_time:
+            batch_response['model_reload_time'] = round(reload_time, 4)
+        batch_response['model_version'] = versions[-1] if versions else self.model_version
+        if len(versions) > 1:
+            # A hot-swap landed mid-batch
+            batch_response['model_versions'] = versions
+        return batch_response
+
+    async def _respond(self, request: dict):
+        """Process a request and write its response to stdout"""
+        try:
+            response = await self.process_request(request)
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            response = {'status': 'error', 'error': str(e)}
+            if request.get('request_id') is not None:
+                response['request_id'] = request['request_id']
+        print(json.dumps(response), flush=True)
+
     async def handle_stdin(self):
         """Handle stdin for communication with Node.js"""
+        pending = set()
         while self.running:
             try:
                 # Read a line from stdin
@@ -125,16 +656,23 @@ class OCRServer:
                     logger.error("Invalid JSON received")
                     continue
 
-                # Process the request
-                response = await self.process_request(request)
-                
-                # Send response
-                print(json.dumps(response), flush=True)
+                if request.get('command') == 'shutdown':
+                    logger.info("Shutdown requested")
+                    self.running = False
+                    break
+
+                # Requests are handled concurrently so duplicates can attach to in-flight work
+                task = asyncio.create_task(self._respond(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
 
             except Exception as e:
                 logger.error(f"Error handling stdin: {str(e)}")
                 print(json.dumps({'status': 'error', 'error': str(e)}), flush=True)
 
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
     def handle_signal(self, signum, frame):
         """Handle shutdown signals"""
         logger.info(f"Received signal {signum}, shutting down...")
@@ -154,12 +692,40 @@ class OCRServer:
         self.running = True
         logger.info("OCR server ready to process requests")
         
+        self.queue = self.create_queue()
+        worker = asyncio.create_task(self._worker())
+
+        metrics_file = os.environ.get('OCR_METRICS_FILE')
+        metrics_writer = None
+        if metrics_file:
+            interval = float(os.environ.get('OCR_METRICS_INTERVAL', '15'))
+            logger.info(f"Writing Prometheus metrics to {metrics_file} every {interval}s")
+            metrics_writer = asyncio.create_task(self._write_metrics_periodically(metrics_file, interval))
+
+        idle_monitor = None
+        if self.idle_unload_after:
+            logger.info(f"Unloading the model after {self.idle_unload_after:.0f}s without requests")
+            idle_monitor = asyncio.create_task(self._idle_monitor())
+
+        self.startup = {
+            'time_to_ready_s': round(time.perf_counter() - _PROCESS_START, 3),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'rss_bytes': process_rss_bytes()
+        }
+        logger.info(f"Startup: {self.startup}")
+
         # Print ready message for Node.js
-        print(json.dumps({'status': 'ready'}), flush=True)
-        
+        print(json.dumps({'status': 'ready', **self.startup}), flush=True)
+
         # Handle stdin until shutdown
         await self.handle_stdin()
         
+        worker.cancel()
+        if metrics_writer:
+            metrics_writer.cancel()
+        if idle_monitor:
+            idle_monitor.cancel()
+        self.executor.shutdown(wait=False)
         logger.info("OCR server shutting down...")
 
 async def main():
@@ -0,0 +1,252 @@
+"""Pages of scanner output: single images, multi-page TIFFs, PDFs and ZIP archives.
+
+Every page has an address: a single image is its path, and a page of a
+multi-page file is ``path#page`` (pages counted from 1). A ZIP member is
+``archive.zip#member``, and a page of a multi-page member
+``archive.zip#member#page``. Pages are decoded one at a time, by address or
+in order, so a 500-page TIFF or an archive of scans never has to be held in
+memory at once: a TIFF page is read with cv2.imreadmulti, which skips the
+pages before it without decoding them, and an archive member is extracted
+to a temporary file only while its pages are read.
+
+PDF pages are rendered with PyMuPDF, which is optional: without it a PDF
+raises PageSourceError and every other kind of file still reads.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from metrics import metrics
+
+# cv2, numpy and PyMuPDF are imported where they are used: ocr_processor
+# imports this module and its text-only path must not load them
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = "#"
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+MULTI_PAGE_SUFFIXES = (".tif", ".tiff")
+PDF_SUFFIXES = (".pdf",)
+ARCHIVE_SUFFIXES = (".zip",)
+SOURCE_SUFFIXES = IMAGE_SUFFIXES + PDF_SUFFIXES + ARCHIVE_SUFFIXES
+
+# Resolution PDF pages are rendered at (OCR_PDF_DPI)
+PDF_DPI = 300
+# TIFF pages decoded together when reading in order. Every read walks the
+# file's page directory from the start, so reading a 500-page TIFF one page at
+# a time took twice as long as decoding it whole; runs of 4 pages are within
+# 10% of that and hold 4 pages in memory rather than 500.
+TIFF_READ_AHEAD = 4
+
+
+class PageSourceError(Exception):
+    """A file that cannot be read as pages at all"""
+    pass
+
+
+class Page(NamedTuple):
+    """A page and its address; image is None when the page could not be decoded"""
+    address: str
+    image: Optional["np.ndarray"]
+
+
+def _suffix(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def split_address(address: str) -> Tuple[str, str]:
+    """The file an address is in and the rest of the address ('' for a plain path)"""
+    if os.path.isfile(address):
+        return address, ""
+    start = 0
+    while True:
+        index = address.find(SEPARATOR, start)
+        if index < 0:
+            return address, ""
+        if os.path.isfile(address[:index]):
+            return address[:index], address[index + 1:]
+        start = index + 1
+
+
+def _page_count(path: str) -> int:
+    """Pages in a file; an image that cannot be decoded still counts as one page"""
+    suffix = _suffix(path)
+    if suffix in PDF_SUFFIXES:
+        with _open_pdf(path) as document:
+            return document.page_count
+    if suffix in MULTI_PAGE_SUFFIXES:
+        import cv2
+        return max(cv2.imcount(path), 1)
+    return 1
+
+
+def _decode(path: str, number: int, count: int = 1) -> List[Optional["np.ndarray"]]:
+    """Pages ``number`` to ``number + count - 1`` (from 1) of a file as BGR images, None for a page there is not"""
+    suffix = _suffix(path)
+    with metrics.stage("decode"):
+        if suffix in PDF_SUFFIXES:
+            return [_render_pdf_page(path, page) for page in range(number, number + count)]
+        import cv2
+        if number == count == 1:
+            return [cv2.imread(path)]
+        if suffix not in MULTI_PAGE_SUFFIXES or number < 1:
+            return [None] * count
+        ok, pages = cv2.imreadmulti(path, number - 1, count, flags=cv2.IMREAD_COLOR)
+        pages = list(pages) if ok else []
+        return pages + [None] * (count - len(pages))
+
+
+@contextmanager
+def _open_pdf(path: str):
+    try:
+        import fitz
+    except ImportError as e:
+        raise PageSourceError(f"Reading PDF files needs PyMuPDF (pip install pymupdf): {path}") from e
+    try:
+        document = fitz.open(path)
+    except Exception as e:
+        raise PageSourceError(f"Could not read PDF {path}: {e}") from e
+    with document:
+        yield document
+
+
+def _render_pdf_page(path: str, number: int) -> Optional["np.ndarray"]:
+    import cv2
+    import numpy as np
+
+    with _open_pdf(path) as document:
+        if not 1 <= number <= document.page_count:
+            return None
+        pixmap = document.load_page(number - 1).get_pixmap(dpi=int(os.environ.get('OCR_PDF_DPI', PDF_DPI)))
+    image = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+    conversion = {1: cv2.COLOR_GRAY2BGR, 3: cv2.COLOR_RGB2BGR, 4: cv2.COLOR_RGBA2BGR}[pixmap.n]
+    return cv2.cvtColor(image, conversion)
+
+
+def _open_archive(path: str) -> zipfile.ZipFile:
+    try:
+        return zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise PageSourceError(f"Could not read archive {path}: {e}") from e
+
+
+def _members(archive: zipfile.ZipFile) -> List[str]:
+    """The archive's scans in archive order; folders and other files are skipped"""
+    return [info.filename for info in archive.infolist()
+            if not info.is_dir() and _suffix(info.filename) in IMAGE_SUFFIXES + PDF_SUFFIXES]
+
+
+@contextmanager
+def _extracted(archive: zipfile.ZipFile, member: str) -> Iterator[str]:
+    """A member copied to a temporary file, removed again on exit"""
+    handle, path = tempfile.mkstemp(suffix=_suffix(member))
+    try:
+        with os.fdopen(handle, "wb") as target, archive.open(member) as source:
+            shutil.copyfileobj(source, target)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def _locate(path: str) -> Iterator[Tuple[str, str, int]]:
+    """(address, file, page count) for every file of a source, the file existing while it is visited"""
+    if not os.path.isfile(path):
+        raise PageSourceError(f"File not found: {path}")
+    if _suffix(path) in ARCHIVE_SUFFIXES:
+        with _open_archive(path) as archive:
+            for member in _members(archive):
+                with _extracted(archive, member) as member_path:
+                    yield f"{path}{SEPARATOR}{member}", member_path, _page_count(member_path)
+    else:
+        yield path, path, _page_count(path)
+
+
+def _page_address(address: str, count: int, number: int) -> str:
+    """The address of page ``number`` of a file of ``count`` pages at ``address``"""
+    return address if count == 1 else f"{address}{SEPARATOR}{number}"
+
+
+def addresses(path: str) -> List[str]:
+    """The address of every page of a source file, without decoding any; a page address is its own page.
+
+    Raises:
+        PageSourceError: The file is missing or is not a readable archive or PDF
+    """
+    if split_address(path)[1]:
+        return [path]
+    return [_page_address(address, count, number)
+            for address, _, count in _locate(path) for number in range(1, count + 1)]
+
+
+def expand(paths: Iterable[str]) -> Tuple[List[str], Dict[str, str]]:
+    """The page addresses of several source files, and an error for each that cannot be read"""
+    found, errors = [], {}
+    for path in paths:
+        try:
+            found += addresses(path)
+        except PageSourceError as e:
+            logger.error(str(e))
+            errors[path] = str(e)
+    return found, errors
+
+
+def iter_pages(path: str) -> Iterator[Page]:
+    """Every page of a source file in order, each decoded only when it is reached; a page address is its own page.
+
+    Raises:
+        PageSourceError: The file is missing or is not a readable archive or PDF
+    """
+    source, rest = split_address(path)
+    kind = "zip" if _suffix(source) in ARCHIVE_SUFFIXES else "pdf" if _suffix(source) in PDF_SUFFIXES else "image"
+    if rest:
+        metrics.inc("ocr_pages_total", source=kind)
+        yield Page(path, read_page(path))
+        return
+    for address, file, count in _locate(path):
+        for start in range(1, count + 1, TIFF_READ_AHEAD):
+            run = min(TIFF_READ_AHEAD, count - start + 1)
+            for number, image in enumerate(_decode(file, start, run), start):
+                metrics.inc("ocr_pages_total", source=kind)
+                yield Page(_page_address(address, count, number), image)
+
+
+def read_page(address: str) -> Optional["np.ndarray"]:
+    """Decode the page at an address; None if there is no such page or it cannot be decoded.
+
+    Raises:
+        PageSourceError: The page is in a PDF and PyMuPDF is not installed
+    """
+    path, rest = split_address(address)
+    if not os.path.isfile(path):
+        return None
+    if _suffix(path) not in ARCHIVE_SUFFIXES:
+        return _page_of(path, rest)
+
+    try:
+        archive = _open_archive(path)
+    except PageSourceError:
+        return None
+    with archive:
+        members = _members(archive)
+        member, page = rest, ""
+        if member not in members:
+            member, _, page = rest.rpartition(SEPARATOR)
+            if member not in members:
+                return None
+        with _extracted(archive, member) as member_path:
+            return _page_of(member_path, page)
+
+
+def _page_of(path: str, page: str) -> Optional["np.ndarray"]:
+    """Page ``page`` ('' for the first) of a file"""
+    if not page:
+        return _decode(path, 1)[0]
+    if not page.isdigit():
+        return None
+    return _decode(path, int(page))[0]
@@ -1,8 +1,13 @@
+import os
 import sys
 import json
 import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 # Configure logging
 logging.basicConfig(
@@ -14,9 +19,29 @@ logger = logging.getLogger(__name__)
 # Add the form_ocr directory to Python path
 sys.path.append(str(Path(__file__).parent))
 
+import page_source
+import quality_gate
+import sheet_splitter
 from trocr_handler import TrOCRHandler
 from image_processor import ImageProcessor
+from layout_registry import LayoutRegistry
+from card_registration import CardOrientationError
+from quality_gate import ScanRejectedError
+from page_source import PageSourceError
 from analyze_phenotype_cell import is_empty_field
+from metrics import metrics
+from field_batching import FieldBatcher
+from resource_manager import apply_profile, load_profile
+
+# Field crops decoded together per length bucket
+OCR_BATCH_SIZE = 8
+
+# Cards of a stack whose fields are read as one batch (OCR_CARDS_PER_BATCH); fewer when
+# the next card is still being prepared, so the pool is never left waiting on the model
+CARDS_PER_BATCH = 8
+
+# A card worker's layouts, or the error loading them (see _start_card_worker)
+_worker_layouts: Union[LayoutRegistry, Exception, None] = None
 
 def process_caution_card(image_path: str, mask_path: str, manual_mask_path: str, coordinates_path: str) -> Dict[str, Any]:
     """
@@ -31,10 +56,7 @@ def process_caution_card(image_path: str, mask_path: str, manual_mask_path: str,
     Returns:
         Dict[str, Any]: Extracted information from the card
     """
-    try:
-        # Initialize OCR handler
-        ocr_handler = TrOCRHandler()
-        
+    def load_layouts():
         # Initialize image processor with provided paths
         image_processor = ImageProcessor(
             template_path=str(Path(__file__).parent / "resources/templates/caution_card_template.png"),
@@ -42,61 +64,180 @@ def process_caution_card(image_path: str, mask_path: str, manual_mask_path: str,
             manual_mask_path=manual_mask_path,
             coordinates_path=coordinates_path
         )
+        return LayoutRegistry({Path(coordinates_path).stem: image_processor})
+
+    with metrics.collect() as stage_timings:
+        return _process_caution_card(image_path, load_layouts, stage_timings)
+
+def process_card_layouts(image_path: str, registry: Optional[LayoutRegistry] = None) -> Dict[str, Any]:
+    """
+    Process a card scan of any registered layout, identifying which one it is.
+    
+    Args:
+        image_path (str): Path to the card image
+        registry (LayoutRegistry, optional): Layouts to choose from; by default those
+            listed in the OCR_LAYOUTS manifest (resources/layouts.json)
         
-        # Process the image
-        regions = image_processor.process_image(image_path)
-        
-        # Extract text from each region
-        results = {}
-        for region_name, region_data in regions.items():
-            if region_data is not None:
-                # Handle phenotype cells that have both image and analysis
-                if isinstance(region_data, dict) and "image" in region_data and "analysis" in region_data:
-                    results[region_name] = region_data["analysis"]
-                    logger.info(f"Phenotype analysis for {region_name}: {region_data['analysis']}")
-                else:
-                    # Apply empty cell detection to all fields using the imported function
-                    if is_empty_field(region_data, region_name):
-                        results[region_name] = None
-                        logger.info(f"Field {region_name} is blank (detected by is_empty_field)")
-                    else:
-                        # Only process non-blank fields with OCR
-                        text = ocr_handler.generate_text(region_data, region_name)
-                        results[region_name] = text
-                        logger.info(f"OCR Result for {region_name}: {text}")
+    Returns:
+        Dict[str, Any]: Extracted information from the card, with the layout in debug_info
+    """
+    with metrics.collect() as stage_timings:
+        return _process_caution_card(image_path, lambda: registry or LayoutRegistry.from_manifest(), stage_timings)
+
+def process_card_sheet(image_path: str, registry: Optional[LayoutRegistry] = None) -> Dict[str, Any]:
+    """
+    Process a sheet with several cards scanned on it, reading every card's fields as one batch.
+    
+    Args:
+        image_path (str): Path to the sheet image
+        registry (LayoutRegistry, optional): Layouts the cards may be; by default those
+            listed in the OCR_LAYOUTS manifest (resources/layouts.json)
+        
+    Returns:
+        Dict[str, Any]: One result per card found, in reading order, each as process_caution_card
+        returns it plus the card's bounds on the sheet; the sheet's throughput is in debug_info
+    """
+    with metrics.collect() as stage_timings:
+        return _process_card_sheet(image_path, lambda: registry or LayoutRegistry.from_manifest(), stage_timings)
+
+def _read_regions(regions: Dict[str, Any], batcher: FieldBatcher, card: Optional[int] = None) -> Dict[str, Any]:
+    """Results of a card's phenotype and blank fields; the rest are queued on the batcher for OCR.
+    
+    Crops are queued under their region name, or (card, region name) for a card of a sheet.
+    """
+    results = {}
+    for region_name, region_data in regions.items():
+        if region_data is not None:
+            # Handle phenotype cells that have both image and analysis
+            if isinstance(region_data, dict) and "image" in region_data and "analysis" in region_data:
+                results[region_name] = region_data["analysis"]
+                logger.info(f"Phenotype analysis for {region_name}: {region_data['analysis']}")
             else:
-                results[region_name] = None
-                logger.warning(f"No image available for region: {region_name}")
-        
-        # Helper function to convert non-empty fields to arrays
-        def to_array(value):
-            if value is None:
-                return None
-            # Split the value by common separators and remove empty elements
-            tokens = [token.strip() for token in str(value).replace(',', ' ').split() if token.strip()]
-            return tokens if tokens else None
-        
-        # Create phenotype data with arrays for non-empty fields
-        phenotype_data = {}
-        for field in ["rh_D", "rh_C", "rh_E", "rh_c", "rh_e", "kell_K", "kell_k", 
-                     "duffy_Fya", "duffy_Fyb", "kidd_Jka", "mns_N", "mns_S", "mns_s"]:
-            phenotype_data[field] = to_array(results.get(field))
+                # Apply empty cell detection to all fields using the imported function
+                if is_empty_field(region_data, region_name):
+                    results[region_name] = None
+                    logger.info(f"Field {region_name} is blank (detected by is_empty_field)")
+                else:
+                    # Only process non-blank fields with OCR
+                    batcher.add(region_name if card is None else (card, region_name), region_name, region_data)
+        else:
+            results[region_name] = None
+            logger.warning(f"No image available for region: {region_name}")
+    return results
+
+def _card_data(results: Dict[str, Any]) -> Dict[str, Any]:
+    """A card's fields in the response format"""
+    # Helper function to convert non-empty fields to arrays
+    def to_array(value):
+        if value is None:
+            return None
+        # Split the value by common separators and remove empty elements
+        tokens = [token.strip() for token in str(value).replace(',', ' ').split() if token.strip()]
+        return tokens if tokens else None
+    
+    # Create phenotype data with arrays for non-empty fields
+    phenotype_data = {}
+    for field in ["rh_D", "rh_C", "rh_E", "rh_c", "rh_e", "kell_K", "kell_k", 
+                 "duffy_Fya", "duffy_Fyb", "kidd_Jka", "mns_N", "mns_S", "mns_s"]:
+        phenotype_data[field] = to_array(results.get(field))
+    
+    return {
+        "patient_info": {
+            "name": results.get("patient_name"),
+            "mrn": results.get("fmp_ssn"),  # Map FMP/SSN to MRN
+        },
+        "phenotype_data": phenotype_data
+    }
+
+def _error_response(e: Exception) -> Dict[str, Any]:
+    """The error response for a card that could not be read"""
+    if isinstance(e, ScanRejectedError):
+        logger.error(f"Rejected caution card scan: {str(e)}")
+        return {
+            "status": "error",
+            "error": {
+                "code": "SCAN_REJECTED",
+                "message": str(e),
+                "details": {
+                    "stage": "quality",
+                    "error": str(e),
+                    "quality": e.report.as_dict()
+                }
+            }
+        }
+    if isinstance(e, CardOrientationError):
+        logger.error(f"Rejected caution card: {str(e)}")
+        return {
+            "status": "error",
+            "error": {
+                "code": "CARD_NOT_RECOGNIZED",
+                "message": str(e),
+                "details": {
+                    "stage": "align",
+                    "error": str(e)
+                }
+            }
+        }
+    logger.error(f"Error processing caution card: {str(e)}")
+    return {
+        "status": "error",
+        "error": {
+            "code": "OCR_PROCESSING_ERROR",
+            "message": str(e),
+            "details": {
+                "stage": "ocr_processing",
+                "error": str(e)
+            }
+        }
+    }
+
+def _batching_regions(registry: LayoutRegistry) -> Dict[str, Dict]:
+    """Regions of every layout, for the batcher's expected field lengths"""
+    regions = {}
+    for processor in registry.processors.values():
+        regions.update(processor.coordinates["regions"])
+    return regions
+
+def _process_caution_card(image_path: str, load_layouts: Callable[[], LayoutRegistry],
+                          stage_timings: Dict[str, float]) -> Dict[str, Any]:
+    """Run the card pipeline, reporting the per-stage timings collected in ``stage_timings``"""
+    try:
+        # Load the layouts the scan may be; a missing or broken layout file is an error like any other
+        registry = load_layouts()
+        
+        # Process the image first, so a scan that is not a readable card never loads the model
+        start_time = time.perf_counter()
+        layout, regions = registry.process_image(image_path)
+        image_seconds = time.perf_counter() - start_time
+        
+        # Initialize OCR handler; model loading is not part of the card's processing time
+        ocr_handler = TrOCRHandler()
+        start_time = time.perf_counter() - image_seconds
+        
+        # Extract text from each region; OCR crops are collected and read in length buckets
+        batcher = FieldBatcher(batch_size=OCR_BATCH_SIZE, regions=layout.processor.coordinates["regions"])
+        results = _read_regions(regions, batcher)
+        for region_name, text in batcher.flush(ocr_handler.generate_batch).items():
+            results[region_name] = text
+            logger.info(f"OCR Result for {region_name}: {text}")
         
         # Transform results to match expected format
         response = {
             "status": "success",
             "data": {
-                "patient_info": {
-                    "name": results.get("patient_name"),
-                    "mrn": results.get("fmp_ssn"),  # Map FMP/SSN to MRN
-                },
-                "phenotype_data": phenotype_data,
+                **_card_data(results),
                 "debug_info": {
-                    "processing_time": 0.0,  # TODO: Add timing
+                    "processing_time": round(time.perf_counter() - start_time, 4),
+                    "stage_timings": {stage: round(seconds, 4) for stage, seconds in stage_timings.items()},
+                    "field_batching": batcher.last_report,
+                    "layout": layout.name,
                     "confidence_scores": {}  # TODO: Add confidence scores
                 }
             }
         }
+        if registry.stage_cache is not None:
+            # Where the card resumed from its cached stage outputs, and the time that saved
+            response["data"]["debug_info"]["stage_cache"] = registry.stage_cache.last._asdict()
         
         # Log the final response
         logger.info("Final OCR Results:")
@@ -105,33 +246,280 @@ def process_caution_card(image_path: str, mask_path: str, manual_mask_path: str,
         return response
         
     except Exception as e:
-        logger.error(f"Error processing caution card: {str(e)}")
-        return {
-            "status": "error",
-            "error": {
-                "code": "OCR_PROCESSING_ERROR",
-                "message": str(e),
-                "details": {
-                    "stage": "ocr_processing",
-                    "error": str(e)
+        return _error_response(e)
+
+def _process_card_sheet(image_path: str, load_layouts: Callable[[], LayoutRegistry],
+                        stage_timings: Dict[str, float]) -> Dict[str, Any]:
+    """Split a sheet into cards and run them through the card pipeline as one batch"""
+    try:
+        registry = load_layouts()
+        processors = list(registry.processors.values())
+        
+        start_time = time.perf_counter()
+        sheet = page_source.read_page(image_path)
+        if sheet is None:
+            raise FileNotFoundError(f"Could not read image: {image_path}")
+        with metrics.stage("split"):
+            shapes = [sheet_splitter.card_shape(processor.reference_layout, processor.alignment_mask.shape)
+                      for processor in processors]
+            cards = sheet_splitter.split_sheet(sheet, shapes)
+        
+        # Every card is processed before the model loads, and a card that cannot be read
+        # is reported on its own without holding up the rest of the sheet
+        batcher = FieldBatcher(batch_size=OCR_BATCH_SIZE, regions=_batching_regions(registry))
+        card_results = []
+        for index, (card, image) in enumerate(cards):
+            bounds = dict(zip(("x", "y", "width", "height"), card.bounds))
+            try:
+                quality_gate.check_image(image, processors[0].quality_thresholds)
+                layout, regions = registry.process_scan(image)
+            except Exception as e:
+                card_results.append({**_error_response(e), "bounds": bounds})
+                continue
+            card_results.append({"status": "success", "bounds": bounds, "layout": layout.name,
+                                 "results": _read_regions(regions, batcher, index)})
+        image_seconds = time.perf_counter() - start_time
+        
+        # Initialize OCR handler only if a card has fields to read; model loading is not part
+        # of the sheet's processing time
+        if len(batcher):
+            ocr_handler = TrOCRHandler()
+            start_time = time.perf_counter() - image_seconds
+            for (index, region_name), text in batcher.flush(ocr_handler.generate_batch).items():
+                card_results[index]["results"][region_name] = text
+                logger.info(f"OCR Result for card {index} {region_name}: {text}")
+        sheet_seconds = time.perf_counter() - start_time
+        
+        for card in card_results:
+            if card["status"] == "success":
+                card["data"] = {**_card_data(card.pop("results")), "layout": card.pop("layout")}
+        read = sum(card["status"] == "success" for card in card_results)
+        response = {
+            "status": "success",
+            "data": {
+                "cards": card_results,
+                "debug_info": {
+                    "processing_time": round(sheet_seconds, 4),
+                    "stage_timings": {stage: round(seconds, 4) for stage, seconds in stage_timings.items()},
+                    "field_batching": batcher.last_report,
+                    "sheet": {
+                        "cards_found": len(cards),
+                        "cards_read": read,
+                        "cards_per_minute": round(len(cards) * 60 / sheet_seconds, 2) if sheet_seconds > 0 else None
+                    }
                 }
             }
         }
+        logger.info(f"Read {read} of {len(cards)} cards on the sheet in {sheet_seconds:.2f}s")
+        return response
+        
+    except Exception as e:
+        return _error_response(e)
+
+def process_cards(image_paths: Iterable[str], workers: Optional[int] = None,
+                  layouts: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Process a stack of cards, decoding, aligning, masking and cropping them in a process pool
+    while this process reads the fields of several cards at a time as one batch.
+    
+    Args:
+        image_paths: Card images or page addresses; every page of a multi-page file or archive is a card
+        workers (int, optional): Processes preparing cards; by default OCR_CARD_WORKERS, or one
+            per core but the one reading fields. 0 prepares them in this process
+        layouts (str, optional): Layout manifest; by default OCR_LAYOUTS (resources/layouts.json)
+        
+    Yields:
+        Dict[str, Any]: Each card's result in input order, as process_caution_card returns it
+        plus the card's "image" address, as soon as its batch is read
+    """
+    if workers is None:
+        workers = int(os.environ.get('OCR_CARD_WORKERS', max(1, (os.cpu_count() or 1) - 1)))
+    cards_per_batch = int(os.environ.get('OCR_CARDS_PER_BATCH', CARDS_PER_BATCH))
+    addresses = _card_addresses(image_paths)
+    if workers == 0:
+        _start_card_worker(layouts, pooled=False)
+        yield from _read_cards(_in_process(addresses), cards_per_batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_card_worker,
+                             initargs=(layouts, True)) as pool:
+        # Enough cards in flight to keep every worker busy while a batch is read
+        yield from _read_cards(_pooled(pool, addresses, 2 * workers + cards_per_batch), cards_per_batch)
+
+def read_card_manifest(manifest_path: str) -> List[str]:
+    """Card images listed one per line in a manifest, relative to its directory; blank lines are skipped"""
+    directory = Path(manifest_path).parent
+    with open(manifest_path, 'r') as f:
+        return [str(directory / line.strip()) for line in f if line.strip()]
+
+def _card_addresses(image_paths: Iterable[str]) -> Iterator[str]:
+    """Every card in the sources; one that cannot be listed is passed on to fail as a card"""
+    for path in image_paths:
+        try:
+            yield from page_source.addresses(path)
+        except PageSourceError:
+            yield path
+
+def _start_card_worker(layouts: Optional[str], pooled: bool) -> None:
+    """Load a card worker's layouts once; a layout that fails to load fails each card it is given"""
+    global _worker_layouts
+    if pooled:
+        # The pool is the parallelism; OpenCV threads in every worker would only contend
+        import cv2
+        cv2.setNumThreads(1)
+    try:
+        _worker_layouts = LayoutRegistry.from_manifest(layouts)
+    except Exception as e:
+        _worker_layouts = e
+
+def _prepare_card(address: str) -> Dict[str, Any]:
+    """Decode, align, mask and crop a card; the fields left to OCR are returned with their expected lengths"""
+    start_time = time.perf_counter()
+    with metrics.collect() as stage_timings:
+        try:
+            if isinstance(_worker_layouts, Exception):
+                raise _worker_layouts
+            layout, regions = _worker_layouts.process_image(address)
+            batcher = FieldBatcher(regions=layout.processor.coordinates["regions"])
+            results = _read_regions(regions, batcher)
+        except Exception as e:
+            return {"image": address, **_error_response(e)}
+    card = {
+        "image": address,
+        "status": "success",
+        "layout": layout.name,
+        "results": results,
+        "fields": [(crop.field_name, crop.image, crop.expected_tokens) for crop in batcher.pending],
+        "processing_time": round(time.perf_counter() - start_time, 4),
+        "stage_timings": {stage: round(seconds, 4) for stage, seconds in stage_timings.items()}
+    }
+    if _worker_layouts.stage_cache is not None:
+        card["stage_cache"] = _worker_layouts.stage_cache.last._asdict()
+    return card
+
+def _in_process(addresses: Iterator[str]) -> Iterator[Tuple[Dict, bool]]:
+    """Cards prepared in this process, in input order, each with whether a card follows it"""
+    card = None
+    for address in addresses:
+        if card is not None:
+            yield card, True
+        card = _prepare_card(address)
+    if card is not None:
+        yield card, False
+
+def _pooled(pool: ProcessPoolExecutor, addresses: Iterator[str], window: int) -> Iterator[Tuple[Dict, bool]]:
+    """Cards prepared in the pool, in input order with at most ``window`` in flight, each with
+    whether the card after it is ready too"""
+    in_flight = deque(pool.submit(_prepare_card, address) for address in islice(addresses, window))
+    while in_flight:
+        card = in_flight.popleft().result()
+        for address in islice(addresses, 1):
+            in_flight.append(pool.submit(_prepare_card, address))
+        yield card, bool(in_flight) and in_flight[0].done()
+
+def _read_cards(prepared: Iterable[Tuple[Dict, bool]], cards_per_batch: int) -> Iterator[Dict[str, Any]]:
+    """Read prepared cards' fields in shared batches of up to ``cards_per_batch`` cards, or fewer
+    when the next card is not ready yet, and yield each card's response.
+    
+    A batch that cannot be read fails the cards with fields in it, and the stack goes on; a model
+    that fails to load fails every card with fields to read, without loading it again.
+    """
+    ocr_handler = None
+    load_error = None
+    waiting = []
+    for card, next_ready in prepared:
+        waiting.append(card)
+        if len(waiting) < cards_per_batch and next_ready:
+            continue
+        
+        batcher = FieldBatcher(batch_size=OCR_BATCH_SIZE)
+        for index, card in enumerate(waiting):
+            for region_name, image, tokens in card.pop("fields", ()):
+                batcher.add((index, region_name), region_name, image, tokens)
+        reading = {key[0] for key in (crop.key for crop in batcher.pending)}
+        ocr_seconds = 0.0
+        failure = None
+        if len(batcher):
+            try:
+                # Load the model once, when the first card has fields to read
+                if ocr_handler is None and load_error is None:
+                    try:
+                        ocr_handler = TrOCRHandler()
+                    except Exception as e:
+                        load_error = e
+                if load_error is not None:
+                    raise load_error
+                start_time = time.perf_counter()
+                for (index, region_name), text in batcher.flush(ocr_handler.generate_batch).items():
+                    waiting[index]["results"][region_name] = text
+                    logger.info(f"OCR Result for {waiting[index]['image']} {region_name}: {text}")
+                ocr_seconds = time.perf_counter() - start_time
+            except Exception as e:
+                failure = e
+        
+        for index, card in enumerate(waiting):
+            if card["status"] != "success":
+                yield card
+                continue
+            if failure is not None and index in reading:
+                yield {"image": card["image"], **_error_response(failure)}
+                continue
+            debug_info = {
+                "processing_time": card["processing_time"],
+                "stage_timings": card["stage_timings"],
+                "layout": card["layout"],
+                # The batch this card's fields were read in, shared with the other cards in it
+                "ocr_batch": {"cards": len(waiting), "seconds": round(ocr_seconds, 4),
+                              "field_batching": batcher.last_report}
+            }
+            if "stage_cache" in card:
+                debug_info["stage_cache"] = card["stage_cache"]
+            yield {"image": card["image"], "status": "success",
+                   "data": {**_card_data(card["results"]), "debug_info": debug_info}}
+        waiting = []
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:  # Script name + 4 arguments
+    sheet = len(sys.argv) == 3 and sys.argv[1] == "--sheet"
+    cards = (len(sys.argv) in (3, 5) and sys.argv[1] == "--cards"
+             and (len(sys.argv) == 3 or sys.argv[3] == "--workers"))
+    if len(sys.argv) not in (2, 5) and not sheet and not cards:  # Script name + the image, or the image and 3 layout files
         print(json.dumps({
             "status": "error",
             "error": {
                 "code": "INVALID_ARGUMENTS",
-                "message": "Usage: python process_card.py <image_path> <mask_path> <manual_mask_path> <coordinates_path>"
+                "message": "Usage: python process_card.py <image_path> [<mask_path> <manual_mask_path> <coordinates_path>]"
+                           " | python process_card.py --sheet <sheet_image_path>"
+                           " | python process_card.py --cards <manifest_path> [--workers <count>]"
             }
         }))
         sys.exit(1)
         
-    image_path = sys.argv[1]
-    mask_path = sys.argv[2]
-    manual_mask_path = sys.argv[3]
-    coordinates_path = sys.argv[4]
-    result = process_caution_card(image_path, mask_path, manual_mask_path, coordinates_path)
+    # Split cores between OpenCV and torch before either starts its thread pool
+    apply_profile(load_profile())
+    if cards:
+        # A stack of cards listed in a manifest, one JSON line per card in manifest order
+        start_time = time.perf_counter()
+        count = 0
+        try:
+            paths = read_card_manifest(sys.argv[2])
+        except OSError as e:
+            print(json.dumps(_error_response(e)))
+            sys.exit(1)
+        for result in process_cards(paths, int(sys.argv[4]) if len(sys.argv) == 5 else None):
+            print(json.dumps(result), flush=True)
+            count += 1
+        seconds = time.perf_counter() - start_time
+        logger.info(f"Read {count} cards in {seconds:.2f}s ({count * 60 / seconds:.1f} cards/minute)")
+        sys.exit(0)
+    if sheet:
+        # Several cards of any layout in the OCR_LAYOUTS manifest
+        result = process_card_sheet(sys.argv[2])
+    elif len(sys.argv) == 2:
+        # Any layout in the OCR_LAYOUTS manifest
+        result = process_card_layouts(sys.argv[1])
+    else:
+        image_path = sys.argv[1]
+        mask_path = sys.argv[2]
+        manual_mask_path = sys.argv[3]
+        coordinates_path = sys.argv[4]
+        result = process_caution_card(image_path, mask_path, manual_mask_path, coordinates_path)
     print(json.dumps(result)) 
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""Cheap checks that a scan is worth aligning and reading.
+
+A thumbnail of the scan is measured for sharpness, contrast and ink coverage
+in a few tens of milliseconds, and an aligned card for how much of the
+evidence agrees with its homography. A scan that fails any check is rejected
+with every reason it failed, before the seconds of alignment and beam search
+that would only have produced garbage.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from metrics import metrics
+
+# cv2 and numpy are imported where they are used: ocr_processor imports this
+# module and its text-only path must not load them
+
+logger = logging.getLogger(__name__)
+
+# Longer side of the thumbnail the image checks run on
+WORK_SIZE = 1200
+
+# Contrast is measured from the darkest ink to the paper white. The ink end is a
+# small percentile so that a page with little writing on it still has contrast;
+# a few dark specks are no more than a blank page to the ink coverage check.
+INK_PERCENTILE = 0.001
+PAPER_PERCENTILE = 0.98
+
+# A pixel is ink when it is at least this far below the paper white (grey levels),
+# or half the contrast if that is more
+INK_MARGIN = 40
+
+
+class QualityThresholds(NamedTuple):
+    """Limits a scan must meet; a measure outside them is a rejection reason.
+
+    sharpness is the Laplacian variance along ink edges divided by the squared
+    contrast, so it measures blur whatever the exposure: clean card scans
+    measure 0.6-0.8, a Gaussian blur of sigma 4 scan pixels about 0.07 and
+    of sigma 6 about 0.015. contrast is the spread between ink and paper as
+    a fraction of the grey range and ink the fraction of the page that is
+    ink (a card is about 0.11). inlier_ratio is the share of alignment evidence that agrees with
+    the homography (see ImageProcessor.align_image).
+    """
+    enabled: bool = True
+    min_sharpness: float = 0.02
+    min_contrast: float = 0.35
+    min_ink: float = 0.005
+    max_ink: float = 0.5
+    min_inlier_ratio: float = 0.25
+
+    @classmethod
+    def from_env(cls) -> "QualityThresholds":
+        """Thresholds from OCR_QUALITY_* environment variables; OCR_QUALITY_GATE=0 turns the gate off"""
+        defaults = cls()
+        return cls(
+            enabled=os.environ.get('OCR_QUALITY_GATE', '1').lower() not in ('0', 'false', 'off'),
+            min_sharpness=float(os.environ.get('OCR_QUALITY_MIN_SHARPNESS', defaults.min_sharpness)),
+            min_contrast=float(os.environ.get('OCR_QUALITY_MIN_CONTRAST', defaults.min_contrast)),
+            min_ink=float(os.environ.get('OCR_QUALITY_MIN_INK', defaults.min_ink)),
+            max_ink=float(os.environ.get('OCR_QUALITY_MAX_INK', defaults.max_ink)),
+            min_inlier_ratio=float(os.environ.get('OCR_QUALITY_MIN_INLIER_RATIO', defaults.min_inlier_ratio))
+        )
+
+
+# (reason code, measure, threshold field); min_ thresholds are lower bounds, max_ upper.
+# Most basic first: a blank page is also low contrast and blurry, and is counted as blank.
+CHECKS = (
+    ("blank", "ink", "min_ink"),
+    ("too_dark", "ink", "max_ink"),
+    ("low_contrast", "contrast", "min_contrast"),
+    ("blurry", "sharpness", "min_sharpness"),
+    ("misaligned", "inlier_ratio", "min_inlier_ratio"),
+)
+
+
+class QualityReport(NamedTuple):
+    """Outcome of the gate: the measures taken and every check they failed"""
+    accepted: bool
+    reasons: List[Dict]
+    measures: Dict[str, float]
+    seconds: float
+
+    def as_dict(self) -> Dict:
+        return {
+            'accepted': self.accepted,
+            'reasons': self.reasons,
+            'measures': {name: round(value, 4) for name, value in self.measures.items()},
+            'seconds': round(self.seconds, 4)
+        }
+
+
+class ScanRejectedError(Exception):
+    """Raised when a scan fails the quality gate; ``report`` holds the reasons"""
+
+    def __init__(self, report: QualityReport):
+        super().__init__("Scan rejected: " + "; ".join(reason['message'] for reason in report.reasons))
+        self.report = report
+
+
+def measure(image) -> Dict[str, float]:
+    """Sharpness, contrast and ink coverage of a BGR or grayscale image"""
+    import cv2
+    import numpy as np
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape
+    step = -(-max(height, width) // WORK_SIZE)
+    if step > 1 and min(height, width) >= step:
+        # Cropped to a whole number of steps, INTER_AREA reduces by an integer factor several times faster
+        height, width = height // step, width // step
+        gray = cv2.resize(gray[:height * step, :width * step], (width, height), interpolation=cv2.INTER_AREA)
+
+    cumulative = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel().cumsum()
+    cumulative /= cumulative[-1]
+    dark = int(np.searchsorted(cumulative, INK_PERCENTILE))
+    light = int(np.searchsorted(cumulative, PAPER_PERCENTILE))
+    spread = max(light - dark, 1)
+
+    ink = gray < light - max(INK_MARGIN, spread / 2)
+    # Blur shows where ink meets paper, so the Laplacian is read on a band around the ink
+    edges = cv2.dilate(ink.view(np.uint8), np.ones((3, 3), np.uint8)).view(bool)
+    if edges.any():
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F)[edges].var()) / spread ** 2
+    else:
+        sharpness = 0.0
+    return {'sharpness': sharpness, 'contrast': spread / 255, 'ink': float(ink.mean())}
+
+
+def _report(measures: Dict[str, float], thresholds: QualityThresholds, start: float) -> QualityReport:
+    reasons = []
+    for code, name, field in CHECKS:
+        if name not in measures:
+            continue
+        value, limit = measures[name], getattr(thresholds, field)
+        lower = field.startswith('min_')
+        if (value < limit) if lower else (value > limit):
+            reasons.append({
+                'code': code,
+                'measure': name,
+                'value': round(value, 4),
+                'threshold': limit,
+                'message': f"{name} {value:.3g} {'below minimum' if lower else 'above maximum'} {limit}"
+            })
+    return QualityReport(not reasons, reasons, measures, time.perf_counter() - start)
+
+
+def assess(image, thresholds: QualityThresholds) -> QualityReport:
+    """Measure an image and compare it with the thresholds"""
+    start = time.perf_counter()
+    return _report(measure(image), thresholds, start)
+
+
+def assess_alignment(inlier_ratio: Optional[float], thresholds: QualityThresholds) -> QualityReport:
+    """Compare an alignment's inlier ratio (None when alignment failed) with the threshold"""
+    start = time.perf_counter()
+    return _report({'inlier_ratio': inlier_ratio or 0.0}, thresholds, start)
+
+
+def enforce(report: QualityReport) -> QualityReport:
+    """Count a rejected report under its first reason and raise it; an accepted one is returned"""
+    if not report.accepted:
+        metrics.inc("ocr_quality_rejections_total", reason=report.reasons[0]['code'])
+        logger.warning(f"Scan rejected: {[reason['message'] for reason in report.reasons]}")
+        raise ScanRejectedError(report)
+    return report
+
+
+def check_image(image, thresholds: QualityThresholds) -> Optional[QualityReport]:
+    """Gate an image before alignment or OCR; None when the gate is off.
+
+    Raises:
+        ScanRejectedError: The image failed a check
+    """
+    if not thresholds.enabled:
+        return None
+    with metrics.stage("quality"):
+        return enforce(assess(image, thresholds))
+
+
+def check_alignment(inlier_ratio: Optional[float], thresholds: QualityThresholds) -> Optional[QualityReport]:
+    """Gate an aligned card on its inlier ratio; None when the gate is off.
+
+    Raises:
+        ScanRejectedError: Too little of the evidence agrees with the alignment
+    """
+    if not thresholds.enabled:
+        return None
+    return enforce(assess_alignment(inlier_ratio, thresholds))
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Commands whose results depend only on their inputs and can be shared
+COALESCABLE_COMMANDS = ("process_image", "process_batch", "extract_data", "extract_data_batch")
+
+# Priority lanes, highest priority first
+LANES = ("interactive", "batch")
+
+# Default per-lane queue limits; batch jobs are large so only a few may wait
+DEFAULT_LANE_LIMITS = {"interactive": 32, "batch": 8}
+
+
+class QueueFullError(Exception):
+    """Raised when a lane is at capacity and the request is rejected"""
+    pass
+
+
+def request_lane(request_data: Dict[str, Any]) -> str:
+    """Return the priority lane for a request.
+
+    An explicit ``priority`` wins; otherwise bulk ``process_batch`` work goes to
+    the batch lane and everything else is treated as interactive.
+    """
+    lane = request_data.get("priority")
+    if lane is None:
+        lane = "batch" if request_data.get("command") == "process_batch" else "interactive"
+    if lane not in LANES:
+        raise ValueError(f"Unknown priority: {lane}. Expected one of {', '.join(LANES)}")
+    return lane
+
+
+def percentile(values, q: float) -> Optional[float]:
+    """Nearest-rank percentile of a sequence, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> Optional[str]:
+    """Return the SHA-256 hex digest of a file's contents, or None if unreadable"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def coalescing_key(request_data: Dict[str, Any]) -> Optional[str]:
+    """Build the single-flight key for a request.
+
+    The key covers the command, a hash of the input content and every parameter
+    that changes the result. Requests that cannot be keyed (unknown command,
+    unreadable input) return None and are always executed on their own.
+    """
+    command = request_data.get("command")
+    if command not in COALESCABLE_COMMANDS:
+        return None
+
+    if command == "process_image":
+        image_path = request_data.get("image_path")
+        if not image_path:
+            return None
+        content = file_digest(image_path)
+        if content is None:
+            return None
+        params = {"content": content}
+
+    elif command == "process_batch":
+        image_paths = request_data.get("image_paths") or []
+        if not image_paths:
+            return None
+        digests = [file_digest(p) for p in image_paths]
+        if any(d is None for d in digests):
+            return None
+        # Batch results are keyed by path, so paths are part of the identity
+        params = {"content": list(zip(image_paths, digests))}
+
+    elif command == "extract_data_batch":
+        texts = request_data.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return None
+        params = {"content": hashlib.sha256(json.dumps(texts).encode("utf-8")).hexdigest()}
+
+    else:
+        text = request_data.get("text")
+        if not text:
+            return None
+        params = {"content": hashlib.sha256(text.encode("utf-8")).hexdigest()}
+
+    payload = json.dumps({"command": command, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def resolve_deadline(request_data: Dict[str, Any], now: float) -> Optional[float]:
+    """Convert a request's deadline into event-loop time.
+
+    Callers may send either ``timeout_ms`` (relative to receipt) or ``deadline``
+    (absolute Unix time in seconds). Returns None when the request has no deadline.
+    """
+    timeout_ms = request_data.get("timeout_ms")
+    if timeout_ms is not None:
+        return now + float(timeout_ms) / 1000.0
+    deadline = request_data.get("deadline")
+    if deadline is not None:
+        return now + (float(deadline) - time.time())
+    return None
+
+
+class Waiter:
+    """One caller waiting on a job's result"""
+
+    def __init__(self, request_id: Optional[str], deadline: Optional[float]):
+        self.request_id = request_id
+        self.deadline = deadline
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class OCRJob:
+    """A unit of work shared by every request waiting on the same result"""
+
+    def __init__(self, request_data: Dict[str, Any], key: Optional[str] = None):
+        self.request_data = request_data
+        self.command = request_data.get("command")
+        self.key = key
+        self.lane = request_lane(request_data)
+        self.waiters: List[Waiter] = []
+        self.enqueued_at = time.monotonic()
+        self.started = False
+        # Set when nobody is waiting any more; checked between images and decoding steps
+        self.cancel_event = threading.Event()
+
+    def attach(self, request_id: Optional[str] = None, deadline: Optional[float] = None) -> Waiter:
+        """Register a caller waiting on this job's result"""
+        waiter = Waiter(request_id, deadline)
+        self.waiters.append(waiter)
+        return waiter
+
+    def detach(self, waiter: Waiter) -> bool:
+        """Remove a caller; cancels the job and returns True once no callers remain"""
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+        if not self.waiters:
+            self.cancel_event.set()
+            return True
+        return False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def resolve(self, result: Dict[str, Any]) -> None:
+        """Deliver the result to every caller still waiting"""
+        for waiter in self.waiters:
+            if not waiter.future.done():
+                waiter.future.set_result(result)
+
+
+class InFlightRegistry:
+    """Tracks queued and running jobs by coalescing key and request id"""
+
+    def __init__(self):
+        self._jobs: Dict[str, OCRJob] = {}
+        self._by_request_id: Dict[str, OCRJob] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def get(self, key: Optional[str]) -> Optional[OCRJob]:
+        if key is None:
+            return None
+        return self._jobs.get(key)
+
+    def find(self, request_id: str) -> Optional[OCRJob]:
+        """Return the job a given request id is waiting on"""
+        return self._by_request_id.get(request_id)
+
+    def add(self, job: OCRJob) -> None:
+        if job.key is not None:
+            self._jobs[job.key] = job
+
+    def track(self, request_id: Optional[str], job: OCRJob) -> None:
+        if request_id is not None:
+            self._by_request_id[request_id] = job
+
+    def untrack(self, request_id: Optional[str]) -> None:
+        if request_id is not None:
+            self._by_request_id.pop(request_id, None)
+
+    def remove(self, job: OCRJob) -> None:
+        if job.key is not None and self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+
+
+class LaneQueue:
+    """Bounded multi-lane job queue that always serves the highest-priority lane first"""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, history: int = 1024):
+        self.limits = {**DEFAULT_LANE_LIMITS, **(limits or {})}
+        self._lanes: Dict[str, Deque[OCRJob]] = {lane: deque() for lane in LANES}
+        self._wait_times: Dict[str, Deque[float]] = {lane: deque(maxlen=history) for lane in LANES}
+        self._rejected: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._not_empty = asyncio.Event()
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self) -> int:
+        return sum(len(jobs) for jobs in self._lanes.values())
+
+    def depth(self, lane: str) -> int:
+        return len(self._lanes[lane])
+
+    def put_nowait(self, job: OCRJob) -> None:
+        """Enqueue a job, raising QueueFullError when its lane is at capacity"""
+        lane = self._lanes[job.lane]
+        if len(lane) >= self.limits[job.lane]:
+            self._rejected[job.lane] += 1
+            raise QueueFullError(f"Server busy: {job.lane} queue is full ({self.limits[job.lane]} waiting)")
+        job.enqueued_at = time.monotonic()
+        lane.append(job)
+        self._unfinished += 1
+        self._finished.clear()
+        self._not_empty.set()
+
+    def promote(self, job: OCRJob, lane: str) -> bool:
+        """Move a job still waiting to a higher-priority lane, e.g. when an interactive caller
+        joins a queued batch-priority job; returns whether it moved. The lane's limit does not
+        apply, since the job was already accepted."""
+        if LANES.index(lane) >= LANES.index(job.lane) or job not in self._lanes[job.lane]:
+            return False
+        self._lanes[job.lane].remove(job)
+        job.lane = lane
+        self._lanes[lane].append(job)
+        return True
+
+    def get_nowait(self, above: Optional[str] = None) -> Optional[OCRJob]:
+        """Pop the next job, optionally only from lanes with higher priority than ``above``"""
+        lanes = LANES if above is None else LANES[:LANES.index(above)]
+        for lane in lanes:
+            if self._lanes[lane]:
+                job = self._lanes[lane].popleft()
+                self._wait_times[lane].append(time.monotonic() - job.enqueued_at)
+                if not self.qsize():
+                    self._not_empty.clear()
+                return job
+        return None
+
+    async def get(self) -> OCRJob:
+        while True:
+            job = self.get_nowait()
+            if job is not None:
+                return job
+            await self._not_empty.wait()
+
+    def task_done(self) -> None:
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._finished.set()
+
+    async def join(self) -> None:
+        await self._finished.wait()
+
+    def lane_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-lane depth, limit, rejections and wait-time percentiles (milliseconds)"""
+        stats = {}
+        for lane in LANES:
+            waits = list(self._wait_times[lane])
+            stats[lane] = {
+                "depth": len(self._lanes[lane]),
+                "limit": self.limits[lane],
+                "rejected": self._rejected[lane],
+                "wait_ms": {
+                    name: None if value is None else round(value * 1000.0, 2)
+                    for name, value in (("p50", percentile(waits, 50)),
+                                        ("p95", percentile(waits, 95)),
+                                        ("p99", percentile(waits, 99)))
+                }
+            }
+        return stats
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+MODES = ("latency", "throughput")
+DEFAULT_PROFILE_PATH = Path(__file__).parent / "resources" / "config" / "resource_profiles.json"
+# A real scan to tune on; the template has no ruling lines, so it is not a card the pipeline reads
+DEFAULT_SAMPLE_PATH = Path(__file__).parent.parent.parent / "test_data" / "sample_caution_card.png"
+
+
+class ThreadProfile(NamedTuple):
+    """Thread budgets for the two CPU-heavy halves of the pipeline.
+
+    OpenCV and torch thread pools are process-wide, so the budgets are split
+    so that preprocessing (``cv2_threads`` per worker) and inference
+    (``torch_threads``) running at the same time never ask for more cores
+    than the machine has.
+    """
+    mode: str
+    cv2_threads: int
+    torch_threads: int
+    torch_interop_threads: int
+    preprocess_workers: int
+    # Optional CPU pinning: {"inference": [0, 1, 2], "preprocess": [3]}
+    affinity: Optional[Dict[str, List[int]]] = None
+
+
+def cpu_count() -> int:
+    """Cores this process may run on (respects affinity masks and container limits)"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def default_profile(mode: str = "latency", cores: Optional[int] = None, pin: bool = False) -> ThreadProfile:
+    """Split the cores between preprocessing and inference for a mode.
+
+    latency: one card at a time, so beam search gets most cores and
+        OpenCV a quarter for the alignment running ahead of it.
+    throughput: several cards in flight, so preprocessing workers run
+        single-threaded side by side and inference gets the rest.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown resource mode: {mode}. Expected one of {', '.join(MODES)}")
+    cores = cores or cpu_count()
+    if mode == "latency":
+        workers = 1
+        cv2_threads = max(1, cores // 4)
+    else:
+        workers = max(1, cores // 4)
+        cv2_threads = 1
+    torch_threads = max(1, cores - workers * cv2_threads)
+    affinity = None
+    if pin and cores > 1:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(cores))
+        affinity = {"inference": cpus[:torch_threads], "preprocess": cpus[torch_threads:] or cpus[-1:]}
+    return ThreadProfile(mode, cv2_threads, torch_threads, 1, workers, affinity)
+
+
+def apply_profile(profile: ThreadProfile) -> None:
+    """Set the process-wide OpenCV and torch thread pools"""
+    import cv2
+    cv2.setNumThreads(profile.cv2_threads)
+    try:
+        import torch
+        torch.set_num_threads(profile.torch_threads)
+        try:
+            torch.set_num_interop_threads(profile.torch_interop_threads)
+        except RuntimeError:
+            # Only allowed before the first parallel torch op; the intra-op budget still applies
+            logger.debug("torch inter-op threads already fixed for this process")
+    except ImportError:
+        pass
+    logger.info(f"Applied {profile.mode} thread profile: cv2={profile.cv2_threads}, "
+                f"torch={profile.torch_threads}/{profile.torch_interop_threads}, "
+                f"preprocess workers={profile.preprocess_workers}")
+
+
+def pin_current_thread(profile: ThreadProfile, stage: str) -> bool:
+    """Pin the calling thread to the cores its stage owns. Returns False if not pinned."""
+    cpus = (profile.affinity or {}).get(stage)
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return False
+    # On Linux pid 0 means the calling thread, not the whole process
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def load_profile(mode: Optional[str] = None, path: Optional[Path] = None) -> ThreadProfile:
+    """The profile for a mode from the profile file, or the computed default.
+
+    OCR_RESOURCE_MODE picks the mode and OCR_RESOURCE_PROFILES the file. A
+    saved profile is only used on a machine with the core count it was tuned on.
+    """
+    mode = mode or os.environ.get("OCR_RESOURCE_MODE", "latency")
+    path = Path(path or os.environ.get("OCR_RESOURCE_PROFILES", DEFAULT_PROFILE_PATH))
+    if path.exists():
+        with open(path, "r") as f:
+            saved = json.load(f).get(mode)
+        if saved and saved.get("cores") == cpu_count():
+            fields = {name: saved[name] for name in ThreadProfile._fields if name in saved}
+            return ThreadProfile(**{**fields, "mode": mode})
+        if saved:
+            logger.info(f"Ignoring {mode} profile tuned for {saved.get('cores')} cores on a {cpu_count()}-core machine")
+    return default_profile(mode)
+
+
+def save_profile(profile: ThreadProfile, path: Optional[Path] = None, benchmark: Optional[Dict] = None) -> Path:
+    """Write a profile into the profile file, keeping the other modes"""
+    path = Path(path or os.environ.get("OCR_RESOURCE_PROFILES", DEFAULT_PROFILE_PATH))
+    profiles = {}
+    if path.exists():
+        with open(path, "r") as f:
+            profiles = json.load(f)
+    profiles[profile.mode] = {**profile._asdict(), "cores": cpu_count(), "benchmark": benchmark}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
+    return path
+
+
+def candidate_profiles(mode: str, cores: Optional[int] = None) -> List[ThreadProfile]:
+    """Budget splits worth benchmarking on this machine"""
+    cores = cores or cpu_count()
+    candidates = {default_profile(mode, cores)}
+    for workers in sorted({1, max(1, cores // 4), max(1, cores // 2)}):
+        for cv2_threads in sorted({1, max(1, cores // 4), max(1, cores // 2)}):
+            for torch_threads in sorted({max(1, cores - workers * cv2_threads), max(1, cores // 2), cores}):
+                if mode == "latency" and workers > 1:
+                    continue
+                candidates.add(ThreadProfile(mode, cv2_threads, torch_threads, 1, workers))
+    return sorted(candidates, key=lambda p: (p.preprocess_workers, p.cv2_threads, p.torch_threads))
+
+
+# Stands in for a rejected card's preprocessing output
+_REJECTED = object()
+
+
+def run_pipeline(profile: ThreadProfile, preprocess: Callable[[int], object],
+                 infer: Callable[[object], object], items: int) -> float:
+    """Push ``items`` through preprocess workers feeding one inference thread. Returns seconds."""
+    apply_profile(profile)
+    todo = queue.Queue()
+    for i in range(items):
+        todo.put(i)
+    ready = queue.Queue()
+
+    def preprocess_worker():
+        while True:
+            try:
+                item = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                ready.put(preprocess(item))
+            except Exception as e:
+                # Hand the failure to the inference loop instead of leaving it waiting
+                ready.put(e)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=preprocess_worker) for _ in range(profile.preprocess_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for _ in range(items):
+            item = ready.get()
+            if isinstance(item, Exception):
+                raise item
+            infer(item)
+    finally:
+        for worker in workers:
+            worker.join()
+    return time.perf_counter() - start
+
+
+def autotune(preprocess: Callable[[int], object], infer: Callable[[object], object], mode: str = "throughput",
+             items: int = 4, candidates: Optional[List[ThreadProfile]] = None,
+             rejects: Tuple[Type[Exception], ...] = ()) -> List[Dict]:
+    """Benchmark thread budgets on a real workload. Returns results, best first.
+
+    latency mode times single cards end to end; throughput mode times a
+    stream of ``items`` cards with preprocessing overlapping inference.
+    A card whose preprocessing raises one of ``rejects`` (a scan the
+    pipeline refuses) is skipped, and counted in its result's "rejected".
+    """
+    rejected = []
+
+    def checked(item):
+        try:
+            return preprocess(item)
+        except rejects as e:
+            if not rejected:
+                logger.warning(f"Sample card rejected, so it is not timed: {str(e)}")
+            rejected.append(e)
+            return _REJECTED
+
+    def infer_read(item):
+        if item is not _REJECTED:
+            infer(item)
+
+    results = []
+    for profile in candidates or candidate_profiles(mode):
+        rejected.clear()
+        if mode == "latency":
+            # Median of single-card runs
+            timings = sorted(run_pipeline(profile, checked, infer_read, 1) for _ in range(items))
+            seconds = timings[len(timings) // 2]
+            score = {"seconds_per_card": round(seconds, 4)}
+        else:
+            seconds = run_pipeline(profile, checked, infer_read, items)
+            score = {"cards_per_minute": round(items * 60 / seconds, 2), "seconds": round(seconds, 4)}
+        logger.info(f"{profile._asdict()} -> {score}")
+        results.append({"profile": profile, "seconds": seconds, **score, "rejected": len(rejected)})
+    results.sort(key=lambda result: result["seconds"])
+    return results
+
+
+def _card_workload(image_path: str, model_name: str):
+    """Preprocess and inference steps of the card pipeline on a sample scan, and the errors
+    that reject a scan"""
+    import cv2
+    import numpy as np
+    from card_registration import CardOrientationError
+    from image_processor import ImageProcessor
+    from ocr_processor import OCRProcessor
+    from quality_gate import ScanRejectedError
+
+    resources = Path(__file__).parent / "resources"
+    image_processor = ImageProcessor(
+        str(resources / "templates" / "caution_card_template.png"),
+        str(resources / "masks" / "alignment_mask.png"),
+        str(resources / "masks" / "manualmask.png"),
+        str(resources / "coordinates" / "caution_card_coords.json"),
+    )
+    ocr = OCRProcessor(model_name)
+
+    def preprocess(_):
+        crops = []
+        for crop in image_processor.process_image(image_path).values():
+            if isinstance(crop, np.ndarray) and crop.size:
+                crops.append(cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR) if crop.ndim == 2 else crop)
+        return crops[:8]
+
+    def infer(crops):
+        if crops:
+            ocr._generate(ocr._pixel_values(crops))
+
+    return preprocess, infer, (CardOrientationError, ScanRejectedError)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU thread budgets for the OCR pipeline')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show = subparsers.add_parser('show', help='Print the profile that would be applied')
+    show.add_argument('--mode', choices=MODES)
+    tune = subparsers.add_parser('autotune', help='Benchmark thread budgets and save the fastest')
+    tune.add_argument('--mode', choices=MODES, default='throughput')
+    tune.add_argument('--image', default=str(DEFAULT_SAMPLE_PATH), help='Sample card scan')
+    tune.add_argument('--model', default='microsoft/trocr-large-handwritten', help='Model to benchmark with')
+    tune.add_argument('--items', type=int, default=4, help='Cards per measurement')
+    tune.add_argument('--output', help='Profile file to update (default: the bundled config)')
+    tune.add_argument('--dry-run', action='store_true', help='Report without writing the profile')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print(json.dumps(load_profile(args.mode)._asdict(), indent=2))
+        return
+
+    preprocess, infer, rejects = _card_workload(args.image, args.model)
+    results = autotune(preprocess, infer, mode=args.mode, items=args.items, rejects=rejects)
+    report = [{**result["profile"]._asdict(), **{k: v for k, v in result.items() if k != "profile"}}
+              for result in results]
+    print(json.dumps(report, indent=2))
+    if all(result["rejected"] == args.items for result in results):
+        # Nothing but rejections was timed, so no profile is better than another
+        print(f"The pipeline rejects {args.image}; not saving a profile. Tune with --image <a card scan>")
+        sys.exit(1)
+    if not args.dry_run:
+        best = results[0]
+        path = save_profile(best["profile"], args.output,
+                            benchmark={k: v for k, v in best.items() if k != "profile"})
+        print(f"Saved {args.mode} profile to {path}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,101 @@
+"""Several cards scanned on one sheet, cut apart for the card pipeline.
+
+Cards are found by their printed outer box: the ruling lines of the whole
+sheet are found as for one card, and every box shaped like a layout's
+largest box, about as large as the largest such box and not inside a card
+already found, is a card. Each is cut out with room for the rest of the card
+around its box, whichever way up it lies; aligning the crop then places it
+exactly.
+"""
+import logging
+from typing import List, NamedTuple, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import card_registration
+from card_registration import Layout
+
+logger = logging.getLogger(__name__)
+
+# A box is card-shaped when its aspect ratio is within this fraction of a layout's largest box
+MAX_CARD_ASPECT_ERROR = 0.1
+# Card-shaped boxes smaller than this fraction of the largest one are fields, not cards
+MIN_CARD_AREA_RATIO = 0.5
+# Extra room (fraction of the card's size) cut out around where the card should be
+CROP_MARGIN = 0.05
+
+
+class CardShape(NamedTuple):
+    """A layout's largest box and how far the card reaches beyond it, in box lengths"""
+    aspect: float
+    long_extent: float
+    short_extent: float
+
+
+class SheetCard(NamedTuple):
+    """A card found on a sheet: its printed box and the crop (x, y, width, height) it is cut out as"""
+    box: np.ndarray
+    bounds: Tuple[int, int, int, int]
+
+
+def card_shape(reference: Layout, shape: Tuple[int, ...]) -> CardShape:
+    """The card shape of a layout from its reference boxes and page (template) shape"""
+    box = reference.boxes[0]
+    height, width = shape[:2]
+    left, top = box[:, 0].min(), box[:, 1].min()
+    right, bottom = box[:, 0].max(), box[:, 1].max()
+    box_width, box_height = right - left, bottom - top
+    # The card may lie any way up, so the larger overhang is allowed on both sides
+    across = float(max(left, width - right) / box_width)
+    down = float(max(top, height - bottom) / box_height)
+    if box_width >= box_height:
+        return CardShape(float(box_width / box_height), across, down)
+    return CardShape(float(box_height / box_width), down, across)
+
+
+def find_cards(gray: np.ndarray, shapes: Sequence[CardShape]) -> List[SheetCard]:
+    """Cards on a grayscale sheet, in reading order (rows top to bottom, left to right)"""
+    lines, scale = card_registration.ruling_lines(gray)
+    candidates = []
+    for box in card_registration.find_boxes(lines, scale):
+        (x, y), (width, height), angle = cv2.minAreaRect(box)
+        long_side, short_side = max(width, height), max(min(width, height), 1e-6)
+        for shape in shapes:
+            if abs(long_side / short_side / shape.aspect - 1) <= MAX_CARD_ASPECT_ERROR:
+                candidates.append((box, ((x, y), (width, height), angle), shape))
+                break
+    if not candidates:
+        return []
+
+    largest = cv2.contourArea(candidates[0][0])
+    page_height, page_width = gray.shape[:2]
+    cards = []
+    for box, ((x, y), (width, height), angle), shape in candidates:
+        if cv2.contourArea(box) < MIN_CARD_AREA_RATIO * largest:
+            continue
+        if any(cv2.pointPolygonTest(card.box, (float(x), float(y)), False) >= 0 for card in cards):
+            continue
+        long_grow, short_grow = 1 + 2 * (shape.long_extent + CROP_MARGIN), 1 + 2 * (shape.short_extent + CROP_MARGIN)
+        size = (width * long_grow, height * short_grow) if width >= height else (width * short_grow, height * long_grow)
+        x0, y0, w, h = cv2.boundingRect(cv2.boxPoints(((x, y), size, angle)).astype(np.int32))
+        x0, y0 = max(0, x0), max(0, y0)
+        cards.append(SheetCard(box, (x0, y0, min(page_width, x0 + w) - x0, min(page_height, y0 + h) - y0)))
+
+    # A card starts a new row when its box's middle is below the first box of the current row
+    rows: List[List[SheetCard]] = []
+    for card in sorted(cards, key=lambda card: card.box[:, 1].mean()):
+        if rows and card.box[:, 1].mean() < rows[-1][0].box[:, 1].max():
+            rows[-1].append(card)
+        else:
+            rows.append([card])
+    return [card for row in rows for card in sorted(row, key=lambda card: card.box[:, 0].mean())]
+
+
+def split_sheet(image: np.ndarray, shapes: Sequence[CardShape]) -> List[Tuple[SheetCard, np.ndarray]]:
+    """Each card on a sheet with its crop (a view of the sheet); no cards if none is found"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    cards = find_cards(gray, shapes)
+    logger.info(f"Found {len(cards)} cards on the sheet")
+    return [(card, image[card.bounds[1]:card.bounds[1] + card.bounds[3], card.bounds[0]:card.bounds[0] + card.bounds[2]])
+            for card in cards]
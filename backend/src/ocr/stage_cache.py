@@ -0,0 +1,198 @@
+"""Card pipeline stage outputs kept on disk, so a re-run resumes where its configuration changed.
+
+A card's outputs are keyed by a digest of the scan and, for each stage, a
+digest of everything that stage's output depends on (see
+ImageProcessor.stage_settings):
+
+- align: the layout the scan was identified as and its homography. Depends
+  on every registered layout's alignment mask and template size, the
+  registration settings and the quality thresholds.
+- crop: the masked field crops and the phenotype cells' results. Depends in
+  addition on the layout's manual mask, field coordinates and denoising.
+
+OCR is never cached. A re-run after a model upgrade or a change to the
+generation settings reads the cached crops without decoding, aligning or
+masking a scan; one after a change to the manual mask, coordinates or
+denoising decodes the scan and warps it with the cached homography, skipping
+identification and registration. Bump CACHE_VERSION when a code change
+changes what a stage outputs.
+
+Off unless OCR_STAGE_CACHE names a directory. Entries are written to a
+temporary file and renamed into place, so several processes can share one.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import page_source
+from metrics import metrics
+from request_queue import file_digest
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+# The stage a card's processing resumed from: nothing cached, the homography, or the crops
+RESUME_STAGES = ("decode", "mask", "ocr")
+
+
+class CachedAlignment(NamedTuple):
+    """A scan's layout and homography, and the seconds decoding, gating, identifying and aligning it took"""
+    layout: str
+    homography: np.ndarray
+    inliers: Optional[float]
+    seconds: float
+
+
+class CachedRegions(NamedTuple):
+    """A card's regions as ImageProcessor.process_scan returns them, and the seconds producing them took"""
+    regions: Dict[str, Any]
+    seconds: float
+
+
+class CacheOutcome(NamedTuple):
+    """Where a card's processing resumed and the pipeline time that saved"""
+    resumed_from: str
+    seconds_saved: float
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def alignment_config(processors: Dict[str, Any]) -> str:
+    """Digest of what a cached layout and homography depend on, for a set of layouts"""
+    return _digest({"version": CACHE_VERSION,
+                    "layouts": {name: processor.stage_settings()["align"] for name, processor in processors.items()}})
+
+
+def crop_config(processor: Any, align_config: str) -> str:
+    """Digest of what a layout's cached crops depend on"""
+    return _digest({"version": CACHE_VERSION, "align": align_config, "crop": processor.stage_settings()["crop"]})
+
+
+class StageCache:
+    """Per-card stage outputs in a directory, with the time they saved"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.last: Optional[CacheOutcome] = None
+        self.resumed = {stage: 0 for stage in RESUME_STAGES}
+        self.seconds_saved = 0.0
+        # File digests by (path, size, modification time), so a multi-page file is hashed once
+        self._file_digests: Dict[Tuple[str, int, int], str] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["StageCache"]:
+        """The cache in the OCR_STAGE_CACHE directory, or None when it is not set"""
+        directory = os.environ.get('OCR_STAGE_CACHE')
+        return cls(directory) if directory else None
+
+    def input_key(self, address: str) -> Optional[str]:
+        """Key for a scan's outputs: a digest of its file and page (see page_source); None if unreadable"""
+        path, page = page_source.split_address(address)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._file_digests.get(memo)
+        if digest is None:
+            digest = file_digest(path)
+            if digest is None:
+                return None
+            self._file_digests[memo] = digest
+        return _digest([digest, page]) if page else digest
+
+    def _path(self, key: str, stage: str, config: str) -> Path:
+        return self.directory / key[:2] / key / f"{stage}-{config[:32]}.npz"
+
+    def _load(self, key: str, stage: str, config: str) -> Optional[Tuple[Dict, Any]]:
+        """An entry's metadata and arrays, or None when it is missing or unreadable"""
+        path = self._path(key, stage, config)
+        hit = path.exists()
+        if hit:
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    arrays = {name: data[name] for name in data.files if name != "meta"}
+                    meta = json.loads(str(data["meta"]))
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                logger.warning(f"Ignoring unreadable stage cache entry {path}: {e}")
+                hit = False
+        metrics.record_cache(f"stage_{stage}", hit)
+        return (meta, arrays) if hit else None
+
+    def _store(self, key: str, stage: str, config: str, meta: Dict, arrays: Dict[str, np.ndarray]) -> None:
+        path = self._path(key, stage, config)
+        temporary = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(handle, "wb") as f:
+                np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"Could not write stage cache entry {path}: {e}")
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+
+    def load_alignment(self, key: str, config: str) -> Optional[CachedAlignment]:
+        entry = self._load(key, "align", config)
+        if entry is None:
+            return None
+        meta, arrays = entry
+        return CachedAlignment(meta["layout"], arrays["homography"], meta["inliers"], meta["seconds"])
+
+    def store_alignment(self, key: str, config: str, alignment: CachedAlignment) -> None:
+        inliers = None if alignment.inliers is None else float(alignment.inliers)
+        self._store(key, "align", config, {"layout": alignment.layout, "inliers": inliers, "seconds": alignment.seconds},
+                    {"homography": np.asarray(alignment.homography, np.float64)})
+
+    def load_regions(self, key: str, config: str) -> Optional[CachedRegions]:
+        entry = self._load(key, "crop", config)
+        if entry is None:
+            return None
+        meta, arrays = entry
+        regions = {}
+        for name, kind in meta["regions"].items():
+            if kind is None:
+                regions[name] = None
+            elif kind == "crop":
+                regions[name] = arrays[name]
+            else:
+                regions[name] = {"image": arrays[name], "analysis": kind["analysis"]}
+        return CachedRegions(regions, meta["seconds"])
+
+    def store_regions(self, key: str, config: str, cached: CachedRegions) -> None:
+        kinds, arrays = {}, {}
+        for name, region in cached.regions.items():
+            if region is None:
+                kinds[name] = None
+            elif isinstance(region, dict):
+                kinds[name] = {"analysis": region["analysis"]}
+                arrays[name] = np.asarray(region["image"])
+            else:
+                kinds[name] = "crop"
+                arrays[name] = np.asarray(region)
+        self._store(key, "crop", config, {"regions": kinds, "seconds": cached.seconds}, arrays)
+
+    def resumed_from(self, stage: str, seconds_saved: float = 0.0) -> CacheOutcome:
+        """Record where a card's processing resumed and the time that saved"""
+        seconds_saved = max(0.0, seconds_saved)
+        self.last = CacheOutcome(stage, round(seconds_saved, 4))
+        self.resumed[stage] += 1
+        self.seconds_saved += seconds_saved
+        metrics.inc("ocr_stage_cache_resumed_total", stage=stage)
+        metrics.inc("ocr_stage_cache_seconds_saved", seconds_saved)
+        return self.last
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cards by the stage they resumed from, and the total time saved"""
+        return {"resumed_from": dict(self.resumed), "seconds_saved": round(self.seconds_saved, 4)}
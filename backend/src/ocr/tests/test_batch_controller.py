@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from batch_controller import BatchSizeController
+
+
+def batch_latency(size, fixed=1.0, per_item=0.5):
+    """Batch latency with a fixed overhead amortized across the batch"""
+    return fixed + per_item * size
+
+
+class TestBatchSizeController:
+    def test_grows_while_per_item_latency_improves(self):
+        controller = BatchSizeController(min_size=1, max_size=8, initial_size=2)
+        for _ in range(10):
+            controller.observe(controller.size, batch_latency(controller.size, fixed=4.0))
+        assert controller.size == 8
+        assert controller.snapshot()['decision_counts']['grow'] == 6
+
+    def test_settles_where_bigger_batches_stop_paying_off(self):
+        controller = BatchSizeController(min_size=1, max_size=16, initial_size=2)
+
+        def latency(size):
+            # Cheaper per item up to 4, then contention makes every item slower
+            return batch_latency(size) if size <= 4 else batch_latency(size, per_item=1.5)
+
+        for _ in range(20):
+            controller.observe(controller.size, latency(controller.size))
+        assert controller.size == 4
+        assert controller.decisions[-1]['reason'] == 'at_best_size'
+
+    def test_latency_slo_caps_growth(self):
+        controller = BatchSizeController(max_size=16, initial_size=2, latency_slo_s=3.2)
+        for _ in range(20):
+            controller.observe(controller.size, batch_latency(controller.size))
+        # 4 items take 3.0s; 5 take 3.5s which misses the SLO
+        assert controller.size <= 5
+        assert any(d['reason'] == 'latency_slo' for d in controller.decisions)
+
+    def test_memory_pressure_halves(self):
+        controller = BatchSizeController(initial_size=8, min_free_bytes=1000)
+        assert controller.observe(8, 4.0, free_bytes=10) == 4
+        assert controller.decisions[-1]['reason'] == 'memory_pressure'
+
+    def test_oom_halves_within_bounds(self):
+        controller = BatchSizeController(min_size=2, initial_size=8)
+        assert controller.observe_oom(8) == 4
+        assert controller.observe_oom(4) == 2
+        assert controller.observe_oom(2) == 2
+
+    def test_partial_batches_do_not_change_size(self):
+        controller = BatchSizeController(initial_size=4)
+        assert controller.observe(1, 0.1) == 4
+        assert controller.decisions[-1]['reason'] == 'partial_batch'
+
+    def test_invalid_bounds(self):
+        with pytest.raises(ValueError):
+            BatchSizeController(min_size=4, max_size=2)
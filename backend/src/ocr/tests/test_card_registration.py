@@ -0,0 +1,283 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import card_registration
+from card_registration import CardOrientationError
+from image_processor import ImageProcessor
+from metrics import metrics
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def reference_mask():
+    mask = cv2.imread(str(RESOURCES / "masks/alignment_mask.png"), cv2.IMREAD_GRAYSCALE)
+    return cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+def scan_of(mask, scale=2.1, angle=0.6, offset=(140, 260), size=(3300, 5100)):
+    """The mask printed on a larger page: scaled, slightly rotated and shifted. Returns (scan, scan-to-mask homography)."""
+    radians = np.deg2rad(angle)
+    to_scan = np.array([[scale * np.cos(radians), -scale * np.sin(radians), offset[0]],
+                        [scale * np.sin(radians), scale * np.cos(radians), offset[1]],
+                        [0, 0, 1]])
+    scan = cv2.warpPerspective(mask, to_scan, (size[1], size[0]), borderValue=255)
+    # A header box above the card, like the caution banner the mask leaves out
+    cv2.rectangle(scan, (offset[0], 40), (offset[0] + 2400, offset[1] - 60), 0, 8)
+    return scan, np.linalg.inv(to_scan)
+
+
+def corner_error(homography, expected, shape):
+    height, width = shape
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height], [width / 2, height / 2]]).reshape(-1, 1, 2)
+    in_scan = cv2.perspectiveTransform(corners, np.linalg.inv(expected))
+    return np.abs(cv2.perspectiveTransform(in_scan, homography) - corners).max()
+
+
+class TestRegister:
+    def setup_method(self):
+        self.mask = reference_mask()
+        self.reference = card_registration.layout(self.mask)
+
+    def test_reference_has_boxes(self):
+        assert len(self.reference.boxes) >= card_registration.MIN_MATCHED_BOXES
+        # Largest first: the lower table, which the scans show in full
+        areas = [cv2.contourArea(box) for box in self.reference.boxes]
+        assert areas[0] == max(areas)
+        assert areas[0] > 0.25 * self.mask.size
+
+    @pytest.mark.parametrize("scale,angle", [(2.1, 0.6), (2.0, -1.0), (1.0, 0.0)])
+    def test_recovers_homography(self, scale, angle):
+        scan, expected = scan_of(self.mask, scale=scale, angle=angle,
+                                 size=(3300, 5100) if scale > 1 else (1900, 2700))
+        registration = card_registration.register(scan, self.reference)
+        assert registration is not None
+        assert registration.boxes >= card_registration.MIN_MATCHED_BOXES
+        assert registration.overlap > 0.9
+        assert corner_error(registration.homography, expected, self.mask.shape) < 3
+
+    def test_blank_page_is_rejected(self):
+        assert card_registration.register(np.full((3300, 5100), 255, np.uint8), self.reference) is None
+
+    def test_other_form_is_rejected(self):
+        page = np.full((3300, 5100), 255, np.uint8)
+        for i in range(4):
+            cv2.rectangle(page, (200 + 1200 * i, 300), (1100 + 1200 * i, 3000), 0, 8)
+        assert card_registration.register(page, self.reference) is None
+
+    def test_sideways_card_is_rejected(self):
+        scan, _ = scan_of(self.mask)
+        assert card_registration.register(cv2.rotate(scan, cv2.ROTATE_90_CLOCKWISE), self.reference) is None
+
+
+class TestOrientation:
+    def setup_method(self):
+        self.mask = reference_mask()
+        self.reference = card_registration.layout(self.mask)
+        self.scan, self.homography = scan_of(self.mask)
+
+    @pytest.mark.parametrize("rotation,turns", [(None, 0), (cv2.ROTATE_90_COUNTERCLOCKWISE, 3),
+                                                (cv2.ROTATE_180, 2), (cv2.ROTATE_90_CLOCKWISE, 1)])
+    def test_finds_turns_back_to_upright(self, rotation, turns):
+        page = self.scan if rotation is None else cv2.rotate(self.scan, rotation)
+        found, fit = card_registration.orientation(card_registration.layout(page), self.reference, page.shape)
+        assert found == turns
+        assert fit > 0.9
+        assert (np.rot90(page, turns) == self.scan).all()
+
+    def test_registers_turned_card(self):
+        page = cv2.rotate(self.scan, cv2.ROTATE_180)
+        registration = card_registration.register(page, self.reference, turns=2)
+        # The homography is for the page as scanned: the turn is part of it
+        expected = self.homography @ card_registration.quarter_turn(2, page.shape)
+        assert corner_error(registration.homography, expected, self.mask.shape) < 3
+
+    def test_quarter_turn_matches_rot90(self):
+        page = np.arange(12).reshape(3, 4)
+        for turns in range(4):
+            turned = np.rot90(page, turns)
+            turn = card_registration.quarter_turn(turns, page.shape)
+            for y in range(3):
+                for x in range(4):
+                    tx, ty, _ = turn @ [x, y, 1]
+                    assert turned[int(round(ty)), int(round(tx))] == page[y, x]
+
+    def test_blank_and_other_pages_fit_no_orientation(self):
+        blank = np.full((3300, 5100), 255, np.uint8)
+        assert card_registration.orientation(card_registration.layout(blank), self.reference, blank.shape) == (None, 0.0)
+        page = np.full((3300, 5100), 255, np.uint8)
+        cv2.rectangle(page, (200, 300), (4900, 3000), 0, 8)
+        for y in range(600, 3000, 300):
+            cv2.line(page, (200, y), (4900, y), 0, 4)
+        assert card_registration.orientation(card_registration.layout(page), self.reference, page.shape)[0] is None
+
+
+class TestCheckAlignment:
+    def setup_method(self):
+        self.mask = reference_mask()
+        self.thumbnail = card_registration.thumbnail(self.mask)
+        self.scan, self.homography = scan_of(self.mask)
+
+    def test_accepts_fitting_homography(self):
+        assert card_registration.check_alignment(self.scan, self.thumbnail, self.homography) is not None
+
+    def test_accepts_identity_for_registered_scan(self):
+        assert card_registration.check_alignment(self.mask, self.thumbnail, np.eye(3)) is not None
+
+    @pytest.mark.parametrize("shift", [4, 10, 60])
+    def test_rejects_shifted_homography(self, shift):
+        shifted = np.array([[1, 0, shift], [0, 1, 0], [0, 0, 1]]) @ self.homography
+        assert card_registration.check_alignment(self.scan, self.thumbnail, shifted) is None
+
+    def test_rejects_other_page(self):
+        blank = np.full(self.scan.shape, 255, np.uint8)
+        assert card_registration.check_alignment(blank, self.thumbnail, self.homography) is None
+
+
+class TestAlignImage:
+    def setup_method(self):
+        self.processor = ImageProcessor(
+            str(RESOURCES / "templates/caution_card_template.png"),
+            str(RESOURCES / "masks/alignment_mask.png"),
+            str(RESOURCES / "masks/manualmask.png"),
+            str(RESOURCES / "coordinates/caution_card_coords.json"))
+        self.sift_calls = 0
+        metrics.reset()
+
+    def fake_sift(self, homography, inliers=0.5):
+        def sift_homography(gray):
+            self.sift_calls += 1
+            return homography, None if homography is None else inliers
+        self.processor._sift_homography = sift_homography
+
+    def test_fast_path_skips_sift(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(None)
+        scan, expected = scan_of(self.processor.alignment_mask)
+        aligned, homography, _ = self.processor.align_image(cv2.cvtColor(scan, cv2.COLOR_GRAY2BGR))
+        assert self.sift_calls == 0
+        assert aligned.shape[:2] == self.processor.template.shape[:2]
+        assert corner_error(homography, expected, self.processor.alignment_mask.shape) < 3
+        assert self.processor.alignment_counts["contour"] == 1
+        assert sum(self.processor.alignment_counts.values()) == 1
+        assert metrics.snapshot()["counters"]["ocr_alignment_total{method=contour}"] == 1
+
+    def test_falls_back_to_sift(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(card_registration, "register", lambda *args: None)
+        self.fake_sift(np.eye(3))
+        scan, _ = scan_of(self.processor.alignment_mask)
+        self.processor.align_image(scan)
+        assert self.sift_calls == 1
+        assert self.processor.alignment_counts["sift"] == 1
+
+        self.fake_sift(None)
+        image, homography, inliers = self.processor.align_image(scan)
+        assert image is scan and (homography == np.eye(3)).all() and inliers is None
+        assert self.processor.alignment_counts["failed"] == 1
+
+    def test_blank_page_is_rejected_before_sift(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(np.eye(3))
+        with pytest.raises(CardOrientationError):
+            self.processor.align_image(np.full((1000, 1500, 3), 255, np.uint8))
+        assert self.sift_calls == 0
+        assert self.processor.alignment_counts["rejected"] == 1
+
+    @pytest.mark.parametrize("rotation,turns", [(cv2.ROTATE_90_CLOCKWISE, 1), (cv2.ROTATE_180, 2),
+                                                (cv2.ROTATE_90_COUNTERCLOCKWISE, 3)])
+    def test_turned_card_is_aligned_upright(self, rotation, turns, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(None)
+        scan, expected = scan_of(self.processor.alignment_mask, angle=0)
+        page = cv2.rotate(scan, rotation)
+        aligned, homography, _ = self.processor.align_image(page)
+        assert self.processor.alignment_counts["contour"] == 1
+        assert aligned.shape[:2] == self.processor.template.shape[:2]
+        expected = expected @ card_registration.quarter_turn(turns, page.shape)
+        assert corner_error(homography, expected, self.processor.alignment_mask.shape) < 3
+        assert metrics.snapshot()["counters"][f"ocr_orientation_total{{degrees={90 * turns}}}"] == 1
+
+    def test_sift_sees_turned_card_upright(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(card_registration, "register", lambda *args: None)
+        shapes = []
+
+        def sift_homography(gray):
+            shapes.append(gray.shape)
+            return np.eye(3), 0.5
+        self.processor._sift_homography = sift_homography
+        scan, _ = scan_of(self.processor.alignment_mask)
+        _, homography, _ = self.processor.align_image(cv2.rotate(scan, cv2.ROTATE_90_CLOCKWISE))
+        assert shapes == [scan.shape]
+        # Identity on the upright card is a quarter turn of the page as scanned
+        assert (homography == card_registration.quarter_turn(1, scan.shape[::-1])).all()
+
+    def test_fast_path_can_be_disabled(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(np.eye(3))
+        self.processor.fast_registration = False
+        scan, _ = scan_of(self.processor.alignment_mask)
+        self.processor.align_image(scan)
+        assert self.sift_calls == 1
+
+    def test_next_card_reuses_session_alignment(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(None)
+        scan, expected = scan_of(self.processor.alignment_mask, angle=0)
+        self.processor.align_image(scan)
+
+        def register(gray, reference):
+            raise AssertionError("registered a card whose placement was already known")
+        monkeypatch.setattr(card_registration, "register", register)
+        _, homography, _ = self.processor.align_image(scan)
+        assert self.processor.alignment_counts["session"] == 1
+        assert corner_error(homography, expected, self.processor.alignment_mask.shape) < 3
+
+        self.processor.reset_session()
+        monkeypatch.undo()
+        self.processor.align_image(scan)
+        assert self.processor.alignment_counts["contour"] == 2
+
+    def test_moved_card_is_registered_again(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(None)
+        self.processor.align_image(scan_of(self.processor.alignment_mask, angle=0)[0])
+        moved, expected = scan_of(self.processor.alignment_mask, angle=0, offset=(190, 230))
+        _, homography, _ = self.processor.align_image(moved)
+        assert self.processor.alignment_counts["contour"] == 2
+        assert corner_error(homography, expected, self.processor.alignment_mask.shape) < 3
+
+    def test_template_sized_scan_uses_identity(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.fake_sift(None)
+        _, homography, _ = self.processor.align_image(self.processor.alignment_mask)
+        assert self.processor.alignment_counts["identity"] == 1
+        assert (homography == np.eye(3)).all()
+
+
+class TestProcessCard:
+    def test_unrecognized_card_fails_before_loading_model(self, tmp_path, monkeypatch):
+        import process_card
+
+        def load_model():
+            raise AssertionError("loaded the OCR model for a scan that is not a card")
+        monkeypatch.setattr(process_card, "TrOCRHandler", load_model)
+        monkeypatch.chdir(tmp_path)
+        # A clean scan of another form: it passes the quality gate, not orientation detection
+        page = np.full((3300, 5100), 255, np.uint8)
+        for i in range(4):
+            cv2.rectangle(page, (200 + 1200 * i, 300), (1100 + 1200 * i, 3000), 0, 8)
+        cv2.imwrite(str(tmp_path / "form.png"), page)
+        result = process_card.process_caution_card(str(tmp_path / "form.png"), str(RESOURCES / "masks/alignment_mask.png"),
+                                                   str(RESOURCES / "masks/manualmask.png"),
+                                                   str(RESOURCES / "coordinates/caution_card_coords.json"))
+        assert result["status"] == "error"
+        assert result["error"]["code"] == "CARD_NOT_RECOGNIZED"
+        assert result["error"]["details"]["stage"] == "align"
@@ -0,0 +1,118 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import denoising
+from image_processor import ImageProcessor
+from metrics import metrics
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def written_page(paper=220):
+    """Paper a little below white, so noise on it is not clipped, with a few lines of writing"""
+    page = np.full((600, 900), paper, np.uint8)
+    for i, text in enumerate(["John Smith", "O POS", "12/03/1980"]):
+        cv2.putText(page, text, (40, 120 + 150 * i), cv2.FONT_HERSHEY_SIMPLEX, 3, 30, 6)
+    return page
+
+
+def with_noise(gray, sigma, seed=0):
+    noise = np.random.default_rng(seed).normal(0, sigma, gray.shape)
+    return np.clip(gray + noise, 0, 255).astype(np.uint8)
+
+
+class TestEstimateNoise:
+    def setup_method(self):
+        self.keep = np.full((600, 900), 255, np.uint8)
+
+    def test_clean_page_has_no_noise(self):
+        # Stroke edges are not background, so the writing itself is not taken for noise
+        assert denoising.estimate_noise(written_page(), self.keep) < 0.5
+
+    @pytest.mark.parametrize("sigma", [2, 5, 10])
+    def test_recovers_noise_level(self, sigma):
+        estimate = denoising.estimate_noise(with_noise(written_page(), sigma), self.keep)
+        assert estimate == pytest.approx(sigma, rel=0.15)
+
+    def test_only_kept_paper_is_measured(self):
+        page = written_page()
+        page[:, 450:] = with_noise(page[:, 450:], 10)
+        self.keep[:, 450:] = 0
+        assert denoising.estimate_noise(page, self.keep) < 0.5
+        assert denoising.estimate_noise(page, np.zeros_like(self.keep)) == 0.0
+
+    def test_methods_by_noise(self):
+        assert denoising.choose_method(0.0) == "none"
+        assert denoising.choose_method(denoising.CLEAN_NOISE) == "none"
+        assert denoising.choose_method(denoising.CLEAN_NOISE + 0.1) == "bilateral"
+        assert denoising.choose_method(denoising.BILATERAL_NOISE + 0.1) == "nlmeans"
+
+
+class TestDenoise:
+    def setup_method(self):
+        self.page = with_noise(written_page(), 10)
+        self.keep = np.zeros(self.page.shape, np.uint8)
+        self.keep[100:300, 100:500] = 255
+        self.keep[350:550, 550:850] = 255
+
+    @pytest.mark.parametrize("method", ["bilateral", "nlmeans"])
+    def test_cleans_only_kept_pixels(self, method):
+        result = denoising.denoise(self.page, self.keep, method)
+        kept = self.keep > 0
+        assert (result[~kept] == self.page[~kept]).all()
+        assert denoising.estimate_noise(result, self.keep) < denoising.estimate_noise(self.page, self.keep) / 2
+
+    def test_kept_pixels_match_filtering_the_whole_page(self):
+        # Each kept area gets enough context that cropping it out changes nothing
+        result = denoising.denoise(self.page, self.keep, "nlmeans")
+        whole = cv2.fastNlMeansDenoising(self.page, None, 10, 7, 21)
+        kept = self.keep > 0
+        assert (result[kept] == whole[kept]).all()
+
+    def test_none_and_unknown_methods(self):
+        assert denoising.denoise(self.page, self.keep, "none") is self.page
+        with pytest.raises(ValueError):
+            denoising.denoise(self.page, self.keep, "median")
+
+
+class TestApplyMask:
+    def setup_method(self):
+        self.processor = ImageProcessor(
+            str(RESOURCES / "templates/caution_card_template.png"),
+            str(RESOURCES / "masks/alignment_mask.png"),
+            str(RESOURCES / "masks/manualmask.png"),
+            str(RESOURCES / "coordinates/caution_card_coords.json"))
+        mask = self.processor.alignment_mask
+        self.card = cv2.cvtColor(np.where(mask > 0, 255, 20).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+        metrics.reset()
+
+    def test_clean_card_is_not_denoised(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(denoising, "FILTERS", {})
+        masked = self.processor.apply_mask(self.card)
+        assert masked.shape == self.card.shape
+        assert self.processor.denoise_counts["none"] == 1
+        assert metrics.snapshot()["counters"]["ocr_denoise_total{method=none}"] == 1
+
+    def test_noisy_card_is_denoised(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        paper = np.where(self.card > 0, 225, 20).astype(np.uint8)
+        self.processor.apply_mask(with_noise(paper, 12))
+        assert self.processor.denoise_counts["nlmeans"] == 1
+
+    def test_method_can_be_fixed(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        def estimate_noise(gray, keep):
+            raise AssertionError("estimated the noise with the method fixed")
+        monkeypatch.setattr(denoising, "estimate_noise", estimate_noise)
+        self.processor.denoising = "bilateral"
+        self.processor.apply_mask(self.card)
+        assert self.processor.denoise_counts["bilateral"] == 1
@@ -0,0 +1,82 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from field_batching import FieldBatcher, bucket_for, expected_tokens, padding_waste
+
+COORDINATES = Path(__file__).parent.parent / "resources" / "coordinates" / "caution_card_coords.json"
+
+
+def crop(width, height):
+    return np.zeros((height, width), dtype=np.uint8)
+
+
+class FakeRun:
+    """Pretends every crop's text is exactly its true length, capped by max_new_tokens"""
+
+    def __init__(self, true_lengths):
+        self.true_lengths = true_lengths
+        self.calls = []
+
+    def __call__(self, images, max_new_tokens):
+        self.calls.append((len(images), max_new_tokens))
+        outputs = []
+        for image in images:
+            length = min(self.true_lengths[image.shape], max_new_tokens)
+            outputs.append((f"{length} tokens", length))
+        return outputs
+
+
+class TestExpectedLength:
+    def test_field_hints(self):
+        assert expected_tokens("rh_D", 99, 56) == 4
+        assert expected_tokens("patient_name", 952, 142) == 24
+        assert expected_tokens("restriction_3", 371, 131) == 32
+
+    def test_region_override_and_aspect_fallback(self):
+        assert expected_tokens("patient_name", 952, 142, {"max_length": 40}) == 40
+        assert expected_tokens("notes", 1000, 50) == 42
+        assert expected_tokens("stamp", 50, 50) == 8
+
+    def test_buckets(self):
+        assert [bucket_for(t) for t in (1, 8, 9, 30, 200)] == [8, 8, 16, 32, 64]
+
+    def test_every_card_region_gets_a_bucket(self):
+        regions = json.loads(COORDINATES.read_text())["regions"]
+        for name, region in regions.items():
+            tokens = expected_tokens(name, region["width"], region["height"], region)
+            assert bucket_for(tokens) in (8, 16, 32, 64)
+
+
+class TestFieldBatcher:
+    def test_padding_waste(self):
+        assert padding_waste([[4, 4], [2, 8]])["padding_waste"] == round(6 / 24, 4)
+        assert padding_waste([])["padding_waste"] == 0.0
+
+    def test_buckets_run_with_their_own_limits(self):
+        # Phenotype cells, a name and restrictions from two cards interleaved
+        shapes = {(56, 99): 2, (142, 952): 14, (131, 371): 28}
+        run = FakeRun(shapes)
+        batcher = FieldBatcher(batch_size=4)
+        for card in ("card_1", "card_2"):
+            batcher.add((card, "rh_D"), "rh_D", crop(99, 56))
+            batcher.add((card, "patient_name"), "patient_name", crop(952, 142))
+            batcher.add((card, "rh_C"), "rh_C", crop(99, 56))
+            batcher.add((card, "restriction_1"), "restriction_1", crop(371, 131))
+
+        results = batcher.flush(run)
+
+        assert results[("card_2", "patient_name")] == "14 tokens"
+        assert sorted(run.calls) == [(4, 8), (4, 32)]
+        report = batcher.last_report
+        assert report["buckets"] == {8: 4, 32: 4}
+        assert report["bucketed"]["padding_waste"] < report["unbucketed"]["padding_waste"]
+        assert len(batcher) == 0
+
+    def test_flush_empty(self):
+        assert FieldBatcher().flush(FakeRun({})) == {}
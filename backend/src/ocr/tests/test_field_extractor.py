@@ -0,0 +1,106 @@
+import random
+import re
+import sys
+from pathlib import Path
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from field_extractor import FieldExtractor, clean_field_value, extract_batch, extract_patient_data, normalize
+
+
+def legacy_clean_field_value(value, field_type=None):
+    """OCRProcessor._clean_field_value before the extractor was precompiled"""
+    if not value:
+        return value
+    value = value.split('\n')[0].strip()
+    value = re.sub(r'\s*(?:Name|DOB|Gender|Contact|Blood Type|Born|Sex|Tel|Phone|Blood Group|Some|Random|More|text|here|notes).*$', '', value, flags=re.IGNORECASE)
+    value = re.sub(r'[:\s]+$', '', value)
+    if field_type == 'gender':
+        value = value.lower().strip()
+        if value in ['m', 'male', 'm.', 'man']:
+            value = 'Male'
+        elif value in ['f', 'female', 'f.', 'woman']:
+            value = 'Female'
+        elif value:
+            value = value.capitalize()
+            if value not in ['Male', 'Female']:
+                return None
+    elif field_type == 'name':
+        value = re.sub(r'\s{2,}.*$', '', value)
+        value = re.sub(r'[,;].*$', '', value)
+        value = re.sub(r'\s+(?:Some|Random|other|text|here|notes).*$', '', value, flags=re.IGNORECASE)
+    return value.strip()
+
+
+def legacy_extract_patient_data(text):
+    """OCRProcessor.extract_patient_data before the extractor was precompiled"""
+    text = re.sub(r'[\r\n]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    patterns = {
+        'name': r'(?:Patient\s*(?:Name)?|Name(?:\s*of\s*Patient)?)\s*:?\s*([^\n:]+?)(?=\s+(?:Date|DOB|Born|Gender|Sex|Contact|Phone|Blood|Some|Random|$))',
+        'dob': r'(?:Date\s*of\s*Birth|DOB|Born)\s*:?\s*([^\n:]+?)(?=\s+(?:Gender|Sex|Contact|Phone|Blood|Some|Random|$))',
+        'gender': r'(?:Gender|Sex)\s*:?\s*([^\n:]+?)(?=\s+(?:Contact|Phone|Tel|Blood|Some|Random|More|$)|$)',
+        'contact_number': r'(?:Contact|Phone|Tel(?:ephone)?)\s*:?\s*([^\n:]+?)(?=\s+(?:Blood|Some|Random|$)|$)',
+        'blood_type': r'(?:Blood\s*(?:Type|Group))\s*:?\s*([^\n:]+?)(?:\s*$|(?=\s+(?:Some|Random|End|\w+:)))'
+    }
+    extracted_data = {}
+    for field, pattern in patterns.items():
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            value = legacy_clean_field_value(match.group(1).strip(), field)
+            if value:
+                extracted_data[field] = value
+    return extracted_data
+
+
+# Fragments OCR text is built from, including label look-alikes inside words
+# and characters that case-fold onto ASCII labels (long s, Kelvin sign)
+FRAGMENTS = [
+    "Patient Name:", "Name of Patient", "PATIENT", "name", "Surname:", "Date of Birth:", "DOB", "Born",
+    "Gender:", "SEX", "sexton", "Contact:", "Phone", "Telephone:", "tel", "Blood Type:", "blood group",
+    "Bloody", "John Smith", "Mary-Ann O'Neil", "Sherry", "01/02/1980", "555-1234", "O POS", "AB-", "M", "f.",
+    "female", "woman", "X", "Some", "Random", "notes here", "More text", "End", "Ward:", ":", ",", ";",
+    "\n", "\r\n", "  ", "\t", "ſex", "Kelly", "Dátè", "Ñame",
+]
+
+
+def random_text(rng):
+    return " ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 14)))
+
+
+class TestFieldExtractor:
+    def setup_method(self):
+        self.extractor = FieldExtractor()
+
+    def test_matches_legacy_on_random_texts(self):
+        rng = random.Random(1234)
+        for _ in range(20000):
+            text = random_text(rng)
+            assert self.extractor.extract(text) == legacy_extract_patient_data(text), text
+
+    def test_clean_field_value_matches_legacy(self):
+        rng = random.Random(99)
+        for _ in range(5000):
+            value = random_text(rng)
+            for field in (None, 'name', 'gender', 'dob'):
+                assert clean_field_value(value, field) == legacy_clean_field_value(value, field), (value, field)
+
+    def test_typical_card_text(self):
+        text = ("Patient Name: John Smith\nDate of Birth: 01/02/1980\nGender: M\n"
+                "Contact: 555-1234\nBlood Type: O POS\nSome notes here")
+        assert extract_patient_data(text) == {
+            'name': 'John Smith',
+            'dob': '01/02/1980',
+            'gender': 'Male',
+            'contact_number': '555-1234',
+            'blood_type': 'O POS'
+        }
+
+    def test_batch_keeps_order(self):
+        texts = ["Name: Ann Lee Gender: F", "", "Blood Type: AB-"]
+        assert extract_batch(texts) == [legacy_extract_patient_data(text) for text in texts]
+        assert extract_batch(texts)[1] == {}
+
+    def test_normalize(self):
+        assert normalize("  a\r\n\n b\t c  ") == "a b c"
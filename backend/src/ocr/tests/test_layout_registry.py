@@ -0,0 +1,158 @@
+import json
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import card_registration
+from card_registration import CardOrientationError
+from layout_registry import LayoutRegistry
+from metrics import metrics
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def mirrored_layout(directory):
+    """A second card revision: the caution card mirrored left to right, fields and all"""
+    directory.mkdir()
+    files = {
+        "template": "templates/caution_card_template.png",
+        "alignment_mask": "masks/alignment_mask.png",
+        "manual_mask": "masks/manualmask.png",
+    }
+    for key, name in files.items():
+        cv2.imwrite(str(directory / f"{key}.png"), cv2.imread(str(RESOURCES / name))[:, ::-1])
+    coordinates = json.loads((RESOURCES / "coordinates/caution_card_coords.json").read_text())
+    width = coordinates["template_dimensions"]["width"]
+    for region in coordinates["regions"].values():
+        region["x"] = width - region["x"] - region["width"]
+    (directory / "coordinates.json").write_text(json.dumps(coordinates))
+    return {key: str(directory / f"{key}.png") for key in files} | {"coordinates": str(directory / "coordinates.json")}
+
+
+def write_manifest(tmp_path):
+    original = {
+        "template": str(RESOURCES / "templates/caution_card_template.png"),
+        "alignment_mask": str(RESOURCES / "masks/alignment_mask.png"),
+        "manual_mask": str(RESOURCES / "masks/manualmask.png"),
+        "coordinates": str(RESOURCES / "coordinates/caution_card_coords.json"),
+    }
+    manifest = {"layouts": {"v1": original, "v2": mirrored_layout(tmp_path / "v2")}}
+    (tmp_path / "layouts.json").write_text(json.dumps(manifest))
+    return tmp_path / "layouts.json"
+
+
+def card_scan(mask, offset=(140, 260)):
+    """An alignment mask printed at scan scale on a larger page, with a line of writing in it"""
+    scan = np.full((3300, 5100), 255, np.uint8)
+    printed = cv2.resize(mask, None, fx=1.9, fy=1.9, interpolation=cv2.INTER_LINEAR)
+    height, width = printed.shape
+    scan[offset[1]:offset[1] + height, offset[0]:offset[0] + width] = printed
+    cv2.putText(scan, "John Smith  O POS", (offset[0] + 600, offset[1] + 900), cv2.FONT_HERSHEY_SIMPLEX, 5, 30, 10)
+    return cv2.cvtColor(scan, cv2.COLOR_GRAY2BGR)
+
+
+class TestLayoutRegistry:
+    @pytest.fixture(autouse=True)
+    def registry(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.registry = LayoutRegistry.from_manifest(write_manifest(tmp_path))
+        self.scans = {name: card_scan(processor.alignment_mask)
+                      for name, processor in self.registry.processors.items()}
+        metrics.reset()
+
+    def test_manifest_loads_every_layout(self, tmp_path):
+        assert list(self.registry.processors) == ["v1", "v2"]
+        v1, v2 = self.registry.processors.values()
+        assert (v2.alignment_mask == v1.alignment_mask[:, ::-1]).all()
+        (tmp_path / "broken.json").write_text(json.dumps({"layouts": {"v3": {"template": "t.png"}}}))
+        with pytest.raises(ValueError):
+            LayoutRegistry.from_manifest(tmp_path / "broken.json")
+
+    def test_manifest_from_env(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("OCR_LAYOUTS", str(tmp_path / "layouts.json"))
+        assert list(LayoutRegistry.from_manifest().processors) == ["v1", "v2"]
+
+    @pytest.mark.parametrize("name", ["v1", "v2"])
+    def test_identifies_each_revision(self, name):
+        match = self.registry.identify(self.scans[name])
+        assert match.name == name
+        assert match.processor is self.registry.processors[name]
+        assert match.fit > card_registration.MIN_ORIENTATION_OVERLAP
+        assert metrics.snapshot()["counters"][f"ocr_layout_total{{layout={name}}}"] == 1
+
+    def test_identifies_turned_card(self):
+        assert self.registry.identify(cv2.rotate(self.scans["v2"], cv2.ROTATE_180)).name == "v2"
+
+    def test_next_card_of_same_layout_is_checked_on_a_thumbnail(self, monkeypatch):
+        match = self.registry.identify(self.scans["v2"])
+        match.processor.process_scan(self.scans["v2"], match.scan, match.known)
+
+        def layout(gray):
+            raise AssertionError("found the ruling lines of a card whose layout was already known")
+        monkeypatch.setattr(card_registration, "layout", layout)
+        match = self.registry.identify(self.scans["v2"])
+        assert match.name == "v2"
+        assert match.known is not None and match.scan is None
+
+    def test_card_of_another_layout_is_identified_again(self):
+        for name in ["v1", "v2", "v1"]:
+            match = self.registry.identify(self.scans[name])
+            assert match.name == name
+            match.processor.process_scan(self.scans[name], match.scan, match.known)
+        assert self.registry.layout_counts == {"v1": 2, "v2": 1}
+
+    def test_other_form_matches_no_layout(self):
+        page = np.full((3300, 5100), 255, np.uint8)
+        for i in range(4):
+            cv2.rectangle(page, (200 + 1200 * i, 300), (1100 + 1200 * i, 3000), 0, 8)
+        with pytest.raises(CardOrientationError):
+            self.registry.identify(page)
+        assert metrics.snapshot()["counters"]["ocr_layout_total{layout=none}"] == 1
+
+    def test_single_layout_is_not_measured(self, monkeypatch):
+        registry = LayoutRegistry({"v2": self.registry.processors["v2"]})
+
+        def layout(gray):
+            raise AssertionError("measured a scan with only one layout to choose from")
+        monkeypatch.setattr(card_registration, "layout", layout)
+        match = registry.identify(self.scans["v1"])
+        assert match.name == "v2" and match.fit is None
+
+    def test_process_image_reads_fields_of_identified_layout(self, tmp_path):
+        cv2.imwrite(str(tmp_path / "card.png"), self.scans["v2"])
+        match, regions = self.registry.process_image(str(tmp_path / "card.png"))
+        assert match.name == "v2"
+        assert set(regions) == set(match.processor.coordinates["regions"])
+        assert self.registry.processors["v2"].alignment_counts["contour"] == 1
+        assert self.registry.processors["v1"].alignment_counts["contour"] == 0
+        assert "identify" in metrics.snapshot()["stages"]
+
+
+class FakeHandler:
+    def generate_batch(self, images, max_length):
+        return [("text", 4)] * len(images)
+
+
+class TestProcessCardLayouts:
+    def test_reports_identified_layout(self, tmp_path, monkeypatch):
+        import process_card
+        monkeypatch.setattr(process_card, "TrOCRHandler", FakeHandler)
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("OCR_LAYOUTS", str(write_manifest(tmp_path)))
+        mirrored = cv2.imread(str(RESOURCES / "masks/alignment_mask.png"), cv2.IMREAD_GRAYSCALE)[:, ::-1]
+        cv2.imwrite(str(tmp_path / "card.png"), card_scan(cv2.threshold(mirrored, 127, 255, cv2.THRESH_BINARY)[1]))
+        result = process_card.process_card_layouts(str(tmp_path / "card.png"))
+        assert result["status"] == "success", result
+        assert result["data"]["debug_info"]["layout"] == "v2"
+
+    def test_missing_manifest_is_an_error(self, tmp_path, monkeypatch):
+        import process_card
+        monkeypatch.setenv("OCR_LAYOUTS", str(tmp_path / "missing.json"))
+        result = process_card.process_card_layouts(str(tmp_path / "card.png"))
+        assert result["status"] == "error"
@@ -0,0 +1,110 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from field_batching import generated_lengths
+from line_segmentation import LineBox, join_lines, segment_lines
+from ocr_processor import OCRProcessor
+
+LINES = ["Patient Name: John Smith", "Date of Birth: 01/02/1980", "Gender: Male", "Blood Type: O POS"]
+
+
+def render(lines, positions=None, size=(400, 1000), rules=False, noise=0):
+    """A white BGR page with each line of text drawn at its (x, baseline y)"""
+    page = np.full((*size, 3), 255, dtype=np.uint8)
+    positions = positions or [(40, 60 + 70 * i) for i in range(len(lines))]
+    for text, (x, y) in zip(lines, positions):
+        cv2.putText(page, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+        if rules:
+            cv2.line(page, (20, y + 14), (size[1] - 20, y + 14), (0, 0, 0), 1)
+    if noise:
+        page = np.clip(page + np.random.default_rng(0).normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    return page
+
+
+def threshold(page):
+    """The same adaptive threshold OCRProcessor._preprocess_image applies"""
+    gray = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+
+class TestSegmentLines:
+    def test_lines_in_reading_order(self):
+        boxes = segment_lines(threshold(render(LINES)))
+        assert [box.line for box in boxes] == [0, 1, 2, 3]
+        tops = [box.y for box in boxes]
+        assert tops == sorted(tops)
+        # Every box covers its line's baseline
+        for box, (_, baseline) in zip(boxes, [(40, 60 + 70 * i) for i in range(4)]):
+            assert box.y < baseline <= box.y + box.height
+
+    def test_form_rules_and_scanner_noise(self):
+        boxes = segment_lines(threshold(render(LINES, rules=True, noise=6)))
+        assert len(boxes) == 4
+        # The rules span the page; the crops only span the text
+        assert all(box.width < 500 for box in boxes)
+
+    def test_label_and_distant_value_are_separate_segments(self):
+        page = render(["Gender:", "Male"], positions=[(40, 60), (700, 60)])
+        boxes = segment_lines(threshold(page))
+        assert [(box.line, box.segment) for box in boxes] == [(0, 0), (0, 1)]
+        assert boxes[0].x < boxes[1].x
+
+    def test_touching_lines_are_split(self):
+        page = render(["HEIGHT LINE", "BOTTOM LINE", "THIRD LINE", "FOURTH LINE"],
+                      positions=[(40, 50), (40, 100), (40, 124), (40, 190)])
+        assert len({box.line for box in segment_lines(threshold(page))}) == 4
+
+    def test_blank_page(self):
+        assert segment_lines(threshold(render([], noise=6))) == []
+
+
+class TestJoinLines:
+    def test_reading_order_and_empty_segments(self):
+        boxes = [LineBox(0, 50, 10, 10, 1, 0), LineBox(0, 0, 10, 10, 0, 1),
+                 LineBox(0, 0, 10, 10, 0, 0), LineBox(0, 90, 10, 10, 2, 0)]
+        assert join_lines(boxes, ["Gender: Male", "John Smith", "Patient Name:", "  "]) == \
+            "Patient Name: John Smith\nGender: Male"
+
+    def test_generated_lengths(self):
+        assert generated_lengths([[5, 6, 2, 1, 1], [5, 6, 7]], eos_token_id=2) == [3, 3]
+
+
+class TestReadPages:
+    def setup_method(self):
+        # Only the reading pipeline is exercised; the model is replaced by _read_crops
+        self.processor = OCRProcessor.__new__(OCRProcessor)
+        self.processor.line_segmentation = True
+        self.processor.line_batch_size = 8
+        self.calls = []
+
+        def read_crops(crops, max_new_tokens, cancel_event=None):
+            self.calls.append(len(crops))
+            # Name each crop by its height so the result shows which line it came from
+            return [(f"line{crop.shape[0]}", 1) for crop in crops]
+
+        self.processor._read_crops = read_crops
+
+    def test_lines_of_all_pages_share_batches(self):
+        pages = [render(LINES), render(LINES[:2])]
+        texts = self.processor._read_pages(pages)
+        assert [len(text.split("\n")) for text in texts] == [4, 2]
+        assert sum(self.calls) == 6
+        assert len(self.calls) < 6
+
+    def test_blank_page_reads_empty(self):
+        assert self.processor._read_pages([render([])]) == [""]
+        assert self.calls == []
+
+    def test_extraction_sees_reassembled_lines(self):
+        boxes = segment_lines(threshold(render(LINES)))
+        text = join_lines(boxes, LINES)
+        data = self.processor.extract_patient_data(text)
+        assert data["name"] == "John Smith"
+        assert data["gender"] == "Male"
+        assert data["blood_type"] == "O POS"
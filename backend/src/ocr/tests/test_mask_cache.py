@@ -0,0 +1,133 @@
+import sys
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import image_processor
+from image_processor import ImageProcessor
+from metrics import metrics
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def reference_mask(manual_mask, gray):
+    """Masking as it was done on every call: clean up the mask at this size, keep text, paint the form white"""
+    if manual_mask.shape != gray.shape:
+        manual_mask = cv2.resize(manual_mask, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_NEAREST)
+    kernel = np.ones((3, 3), np.uint8)
+    keep = cv2.morphologyEx(manual_mask, cv2.MORPH_CLOSE, kernel)
+    keep = cv2.morphologyEx(keep, cv2.MORPH_OPEN, kernel)
+    white = np.full_like(gray, 255)
+    result = cv2.bitwise_and(gray, gray, mask=keep)
+    return cv2.add(result, cv2.bitwise_and(white, white, mask=cv2.bitwise_not(keep)))
+
+
+def card(shape, seed=0):
+    """A noiseless aligned card of the given (height, width) with some writing on it"""
+    page = np.random.default_rng(seed).integers(150, 256, shape, dtype=np.uint8)
+    cv2.putText(page, "John Smith", (shape[1] // 10, shape[0] // 3), cv2.FONT_HERSHEY_SIMPLEX, 3, 20, 6)
+    return cv2.cvtColor(page, cv2.COLOR_GRAY2BGR)
+
+
+class TestMaskCache:
+    def setup_method(self):
+        self.processor = ImageProcessor(
+            str(RESOURCES / "templates/caution_card_template.png"),
+            str(RESOURCES / "masks/alignment_mask.png"),
+            str(RESOURCES / "masks/manualmask.png"),
+            str(RESOURCES / "coordinates/caution_card_coords.json"))
+        # Masking alone is compared; denoising is covered by test_denoising
+        self.processor.denoising = "none"
+        self.manual_mask = self.processor.manual_mask.copy()
+        self.template_shape = self.manual_mask.shape
+        metrics.reset()
+
+    def test_template_size_matches_previous_masking(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        image = card(self.template_shape)
+        masked = self.processor.apply_mask(image)
+        expected = reference_mask(self.manual_mask, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        assert (masked[..., 0] == expected).all()
+
+    def test_mixed_resolutions_do_not_degrade_the_mask(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        height, width = self.template_shape
+        shapes = [(height, width), (height // 2, width // 2), (height * 3 // 2, width * 3 // 2)]
+        for _ in range(3):
+            for index, shape in enumerate(shapes):
+                image = card(shape, seed=index)
+                masked = self.processor.apply_mask(image)
+                expected = reference_mask(self.manual_mask, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+                assert masked.shape == image.shape
+                assert (masked[..., 0] == expected).all()
+        # Resizing to one scan's size used to overwrite the mask every later scan was cut with
+        assert (self.processor.manual_mask == self.manual_mask).all()
+        assert self.processor.manual_mask.shape == self.template_shape
+
+    def test_masks_are_computed_once_per_resolution(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        calls = []
+        morphology = cv2.morphologyEx
+
+        def counting_morphology(*args, **kwargs):
+            calls.append(args[1])
+            return morphology(*args, **kwargs)
+        monkeypatch.setattr(image_processor.cv2, "morphologyEx", counting_morphology)
+        small = (self.template_shape[0] // 2, self.template_shape[1] // 2)
+        for shape in [self.template_shape, small, self.template_shape, small, small]:
+            self.processor.apply_mask(card(shape))
+        assert len(calls) == 4
+        assert metrics.snapshot()["caches"]["processed_mask"]["hits"] == 3
+        with pytest.raises(ValueError):
+            self.processor._masks_for(small).keep[0, 0] = 0
+
+    def test_cache_keeps_the_most_recent_resolutions(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(image_processor, "MASK_CACHE_SIZE", 2)
+        shapes = [(400 + 10 * i, 600) for i in range(3)]
+        for shape in shapes[:2]:
+            self.processor.apply_mask(card(shape))
+        self.processor.apply_mask(card(shapes[0]))
+        self.processor.apply_mask(card(shapes[2]))
+        assert list(self.processor._mask_cache) == [shapes[0], shapes[2]]
+
+    def test_results_do_not_share_the_working_buffer(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        first_card, second_card = card(self.template_shape, seed=1), card(self.template_shape, seed=2)
+        first = self.processor.apply_mask(first_card)
+        kept = first.copy()
+        second = self.processor.apply_mask(second_card)
+        assert (first == kept).all()
+        assert not (first == second).all()
+
+    def test_grayscale_input_is_not_modified(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        gray = cv2.cvtColor(card(self.template_shape), cv2.COLOR_BGR2GRAY)
+        original = gray.copy()
+        masked = self.processor.apply_mask(gray)
+        assert (gray == original).all()
+        assert (masked[..., 0] == reference_mask(self.manual_mask, original)).all()
+
+    def test_threads_mask_into_their_own_buffers(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        shape = (self.template_shape[0] // 2, self.template_shape[1] // 2)
+        images = [card(shape, seed=seed) for seed in range(4)]
+        expected = [reference_mask(self.manual_mask, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)) for image in images]
+        results = {}
+
+        def work(index):
+            for _ in range(3):
+                results[index] = self.processor.apply_mask(images[index])[..., 0]
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(len(images))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for index, mask in enumerate(expected):
+            assert (results[index] == mask).all()
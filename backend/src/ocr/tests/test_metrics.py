@@ -0,0 +1,122 @@
+import sys
+import time
+from pathlib import Path
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from metrics import Histogram, MetricsRegistry
+
+
+def parse_families(text):
+    """Samples by metric family, as a Prometheus text parser reads them; fails on a second TYPE line"""
+    families = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE"):
+            _, _, family, kind = line.split()
+            assert family not in families, f"second TYPE line for metric name {family}"
+            families[family] = {"type": kind, "samples": []}
+        else:
+            name = line.split("{", 1)[0].split()[0]
+            assert family is not None and (name == family or name.startswith(f"{family}_")), line
+            families[family]["samples"].append(line)
+    return families
+
+
+class TestHistogram:
+    def test_quantiles_use_bucket_bounds(self):
+        histogram = Histogram((0.1, 1.0, 10.0))
+        for value in (0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+        assert histogram.count == 4
+        assert histogram.quantile(0.5) == 0.1
+        assert histogram.quantile(0.99) == 10.0
+
+    def test_values_above_last_bucket(self):
+        histogram = Histogram((1.0,))
+        histogram.observe(5.0)
+        assert histogram.counts == [0]
+        assert histogram.quantile(0.5) == float("inf")
+
+    def test_empty_snapshot(self):
+        snapshot = Histogram().snapshot()
+        assert snapshot["count"] == 0
+        assert snapshot["p95"] is None
+
+
+class TestMetricsRegistry:
+    def setup_method(self):
+        self.registry = MetricsRegistry()
+
+    def test_collect_gathers_stage_timings(self):
+        with self.registry.collect() as timings:
+            with self.registry.stage("align"):
+                time.sleep(0.01)
+            with self.registry.stage("generate"):
+                pass
+            with self.registry.stage("generate"):
+                pass
+
+        assert set(timings) == {"align", "generate"}
+        assert timings["align"] >= 0.01
+        assert self.registry.snapshot()["stages"]["generate"]["count"] == 2
+
+    def test_nested_collect_counts_towards_outer(self):
+        with self.registry.collect() as outer:
+            with self.registry.stage("decode"):
+                pass
+            with self.registry.collect() as inner:
+                with self.registry.stage("align"):
+                    time.sleep(0.01)
+        assert set(inner) == {"align"}
+        assert set(outer) == {"decode", "align"}
+        assert outer["align"] == inner["align"]
+
+    def test_stage_outside_collect_only_records_histogram(self):
+        with self.registry.stage("mask"):
+            pass
+        assert self.registry.snapshot()["stages"]["mask"]["count"] == 1
+
+    def test_cache_hit_rate(self):
+        self.registry.record_cache("coalescing", True)
+        self.registry.record_cache("coalescing", False)
+        self.registry.record_cache("coalescing", False)
+        self.registry.record_cache("coalescing", True)
+
+        caches = self.registry.snapshot()["caches"]
+        assert caches["coalescing"]["hit_rate"] == 0.5
+
+    def test_prometheus_text(self, tmp_path):
+        self.registry.inc("ocr_requests_total", command="process_image", status="success")
+        with self.registry.stage("decode"):
+            pass
+
+        text = self.registry.render_prometheus({'ocr_queue_depth{lane="batch"}': 3})
+
+        assert "# TYPE ocr_requests_total counter" in text
+        assert 'ocr_requests_total{command="process_image",status="success"} 1' in text
+        assert '# TYPE ocr_stage_seconds histogram' in text
+        assert 'ocr_stage_seconds_bucket{stage="decode",le="+Inf"} 1' in text
+        assert 'ocr_stage_seconds_count{stage="decode"} 1' in text
+        assert 'ocr_queue_depth{lane="batch"} 3' in text
+
+        path = tmp_path / "ocr.prom"
+        self.registry.write_prometheus(str(path))
+        assert path.read_text().startswith("# TYPE")
+
+    def test_one_type_line_per_family(self):
+        self.registry.inc("ocr_requests_total", command="process_image", status="success")
+        self.registry.inc("ocr_requests_total", command="process_image", status="error")
+        gauges = {f'ocr_queue_depth{{lane="{lane}"}}': 1 for lane in ("interactive", "batch")}
+        gauges.update({f'ocr_queue_wait_ms{{lane="batch",quantile="{q}"}}': 2.5 for q in (0.5, 0.95, 0.99)})
+        counters = {"ocr_server_requests_received_total": 4, "ocr_server_requests_failed_total": 1}
+
+        families = parse_families(self.registry.render_prometheus(gauges, counters))
+        assert families["ocr_requests_total"]["type"] == "counter"
+        assert len(families["ocr_requests_total"]["samples"]) == 2
+        assert families["ocr_queue_depth"]["type"] == "gauge"
+        assert len(families["ocr_queue_wait_ms"]["samples"]) == 3
+        assert families["ocr_server_requests_received_total"] == {
+            "type": "counter", "samples": ["ocr_server_requests_received_total 4"]}
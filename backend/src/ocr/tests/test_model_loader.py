@@ -0,0 +1,74 @@
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import torch
+from transformers import TrOCRConfig, ViTConfig, VisionEncoderDecoderConfig, VisionEncoderDecoderModel
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import model_loader
+from model_loader import ModelNotFoundError, ensure_safetensors, resolve_model_dir, store_path
+
+
+def save_tiny_model(path: Path, safe: bool = False) -> VisionEncoderDecoderModel:
+    """Save a randomly initialized, very small TrOCR-shaped model"""
+    torch.manual_seed(0)
+    encoder = ViTConfig(hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64,
+                        image_size=64, patch_size=16)
+    decoder = TrOCRConfig(vocab_size=50, d_model=32, decoder_layers=1, decoder_attention_heads=2,
+                          decoder_ffn_dim=64, max_position_embeddings=64)
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id, config.pad_token_id, config.eos_token_id = 0, 1, 2
+    model = VisionEncoderDecoderModel(config)
+    model.save_pretrained(path, safe_serialization=safe)
+    return model
+
+
+class TestModelStore:
+    def test_store_path_uses_model_basename(self, tmp_path):
+        assert store_path("microsoft/trocr-large-handwritten", store=tmp_path) == tmp_path / "trocr-large-handwritten"
+        assert store_path("microsoft/trocr-small", "v2", store=tmp_path) == tmp_path / "trocr-small@v2"
+
+    def test_local_directory_wins(self, tmp_path):
+        assert resolve_model_dir(str(tmp_path)) == tmp_path
+
+    def test_store_hit_never_touches_the_hub(self, tmp_path):
+        save_tiny_model(tmp_path / "tiny")
+        with patch.object(model_loader.VisionEncoderDecoderModel, "from_pretrained") as from_pretrained:
+            assert resolve_model_dir("org/tiny", store=tmp_path) == tmp_path / "tiny"
+        from_pretrained.assert_not_called()
+
+    def test_offline_miss_raises(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("OCR_OFFLINE", "1")
+        with patch.object(model_loader.TrOCRProcessor, "from_pretrained", side_effect=OSError("not cached")) as load:
+            with pytest.raises(ModelNotFoundError):
+                resolve_model_dir("org/missing", store=tmp_path)
+        # Only the local cache was consulted
+        assert load.call_count == 1
+        assert load.call_args.kwargs["local_files_only"] is True
+
+
+class TestSafetensorsConversion:
+    def test_converts_once_and_keeps_weights(self, tmp_path):
+        reference = save_tiny_model(tmp_path)
+
+        assert ensure_safetensors(tmp_path) is True
+        assert (tmp_path / "model.safetensors").exists()
+        assert ensure_safetensors(tmp_path) is False
+
+        loaded = VisionEncoderDecoderModel.from_pretrained(tmp_path, use_safetensors=True)
+        for name, value in reference.state_dict().items():
+            assert torch.equal(value, loaded.state_dict()[name])
+
+    def test_tied_weights_are_restored(self, tmp_path):
+        save_tiny_model(tmp_path, safe=True)
+        model = VisionEncoderDecoderModel.from_pretrained(tmp_path, use_safetensors=True)
+        model.decoder.output_projection.weight = torch.nn.Parameter(
+            torch.empty(model.decoder.output_projection.weight.shape, device="meta"))
+
+        model_loader._materialize_meta_parameters(model)
+
+        assert model.decoder.output_projection.weight is model.decoder.model.decoder.embed_tokens.weight
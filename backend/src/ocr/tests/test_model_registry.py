@@ -0,0 +1,114 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+import torch
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from model_registry import ModelRegistry, model_size_bytes
+
+
+class FakeLoader:
+    """Builds a small module per call so tests can count loads and control sizes"""
+
+    def __init__(self, features=256):
+        self.features = features
+        self.loads = []
+        self.lock = threading.Lock()
+
+    def __call__(self, model_name, device="cpu", dtype=torch.float32, revision="main", **kwargs):
+        with self.lock:
+            self.loads.append((model_name, revision, dtype))
+        model = torch.nn.Sequential(torch.nn.Linear(self.features, self.features)).to(dtype)
+        return f"processor for {model_name}", model
+
+
+MODEL_BYTES = model_size_bytes(torch.nn.Linear(256, 256))
+
+
+class TestModelRegistry:
+    def setup_method(self):
+        self.loader = FakeLoader()
+        self.registry = ModelRegistry(loader=self.loader)
+
+    def test_same_key_shares_one_instance(self):
+        first = self.registry.acquire("trocr-large")
+        second = self.registry.acquire("trocr-large")
+
+        assert first.model is second.model
+        assert first.loaded and not second.loaded
+        assert len(self.loader.loads) == 1
+        assert self.registry.stats()["models"][0]["refcount"] == 2
+
+    def test_key_includes_revision_dtype_and_backend(self):
+        base = self.registry.acquire("trocr-large")
+        revised = self.registry.acquire("trocr-large", revision="v2")
+        half = self.registry.acquire("trocr-large", dtype=torch.bfloat16)
+        quantized = self.registry.acquire("trocr-large", backend="torch-qint8")
+
+        assert len({id(h.model) for h in (base, revised, half, quantized)}) == 4
+        assert half.key.dtype == "bfloat16"
+        assert quantized.key.backend == "torch-qint8"
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            self.registry.acquire("trocr-large", backend="onnx")
+
+    def test_released_models_stay_cached_without_budget(self):
+        self.registry.acquire("trocr-large").release()
+        handle = self.registry.acquire("trocr-large")
+        assert not handle.loaded
+        assert len(self.loader.loads) == 1
+
+    def test_budget_evicts_least_recently_used_idle_model(self):
+        registry = ModelRegistry(memory_budget_bytes=2 * MODEL_BYTES, loader=self.loader)
+        with registry.acquire("small"):
+            pass
+        with registry.acquire("large"):
+            pass
+        # Touch "small" so "large" becomes the least recently used
+        with registry.acquire("small"):
+            pass
+        with registry.acquire("quantized"):
+            pass
+
+        names = [model["model_id"] for model in registry.stats()["models"]]
+        assert names == ["small", "quantized"]
+        assert registry.evictions == 1
+
+    def test_models_in_use_are_never_evicted(self):
+        registry = ModelRegistry(memory_budget_bytes=MODEL_BYTES, loader=self.loader)
+        first = registry.acquire("small")
+        second = registry.acquire("large")
+
+        assert registry.total_bytes() == 2 * MODEL_BYTES
+        assert registry.evictions == 0
+
+        second.release()
+        assert [model["model_id"] for model in registry.stats()["models"]] == ["small"]
+        first.release()
+
+    def test_concurrent_acquires_load_once(self):
+        handles = []
+
+        def acquire():
+            handles.append(self.registry.acquire("trocr-large"))
+
+        threads = [threading.Thread(target=acquire) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(self.loader.loads) == 1
+        assert len({id(handle.model) for handle in handles}) == 1
+
+    def test_evict_idle(self):
+        held = self.registry.acquire("small")
+        self.registry.acquire("large").release()
+        assert self.registry.evict_idle() == 1
+        assert [model["model_id"] for model in self.registry.stats()["models"]] == ["small"]
+        held.release()
@@ -0,0 +1,681 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import page_source
+from ocr_server import OCRServer
+from ocr_processor import OCRCancelledError
+from request_queue import LaneQueue, coalescing_key, request_lane
+from batch_controller import BatchSizeController
+from quality_gate import QualityReport, ScanRejectedError
+from metrics import metrics
+
+
+class FakeProcessor:
+    """Stands in for OCRProcessor so the server can be tested without a model"""
+
+    def __init__(self, delay=0.1, reload_delay=0.02, model_name='fake-trocr', revision='main'):
+        self.model_name = model_name
+        self.revision = revision
+        self.delay = delay
+        self.reload_delay = reload_delay
+        self.calls = []
+        self.chunks = []
+        self.lock = threading.Lock()
+        self.model_loaded = True
+
+    def unload_model(self):
+        self.model_loaded = False
+
+    def ensure_model_loaded(self):
+        if self.model_loaded:
+            return 0.0
+        time.sleep(self.reload_delay)
+        self.model_loaded = True
+        return self.reload_delay
+
+    def process_image(self, image_path, cancel_event=None):
+        with self.lock:
+            self.calls.append(image_path)
+        # Sleep in small steps the way generation checks its stopping criteria
+        for _ in range(10):
+            if cancel_event is not None and cancel_event.is_set():
+                raise OCRCancelledError("Request cancelled during generation")
+            time.sleep(self.delay / 10)
+        return f"text for {Path(image_path).name}"
+
+    def process_images(self, image_paths, cancel_event=None):
+        with self.lock:
+            self.chunks.append(list(image_paths))
+        results = {}
+        for p in image_paths:
+            results[p] = self.process_image(p, cancel_event=cancel_event)
+        return {'results': results, 'errors': {}}
+
+    def process_batch(self, image_paths, batch_size=4, cancel_event=None):
+        results = {}
+        for p in image_paths:
+            if cancel_event is not None and cancel_event.is_set():
+                raise OCRCancelledError("Batch cancelled")
+            results[p] = self.process_image(p, cancel_event=cancel_event)
+        return {'results': results, 'errors': {}, 'total_processed': len(results), 'total_errors': 0}
+
+    def extract_patient_data(self, text):
+        return {'name': text}
+
+    def extract_patient_data_batch(self, texts):
+        return [self.extract_patient_data(text) for text in texts]
+
+
+def run_server(server, coro_factory):
+    """Start the worker for a server and run a coroutine against it"""
+    async def runner():
+        server.queue = server.create_queue()
+        worker = asyncio.create_task(server._worker())
+        try:
+            return await coro_factory()
+        finally:
+            worker.cancel()
+    return asyncio.run(runner())
+
+
+@pytest.fixture
+def card_images(tmp_path):
+    first = tmp_path / "card_a.png"
+    second = tmp_path / "card_b.png"
+    copy = tmp_path / "card_a_copy.png"
+    first.write_bytes(b"card-a-bytes")
+    second.write_bytes(b"card-b-bytes")
+    copy.write_bytes(b"card-a-bytes")
+    return first, second, copy
+
+
+class TestCoalescing:
+    def setup_method(self):
+        self.server = OCRServer()
+        self.processor = FakeProcessor()
+        self.server.processor = self.processor
+
+    def test_key_is_content_based(self, card_images):
+        first, second, copy = card_images
+        key_a = coalescing_key({'command': 'process_image', 'image_path': str(first)})
+        key_copy = coalescing_key({'command': 'process_image', 'image_path': str(copy)})
+        key_b = coalescing_key({'command': 'process_image', 'image_path': str(second)})
+        assert key_a == key_copy
+        assert key_a != key_b
+
+    def test_unkeyable_requests(self, tmp_path):
+        assert coalescing_key({'command': 'process_image', 'image_path': str(tmp_path / "missing.png")}) is None
+        assert coalescing_key({'command': 'stats'}) is None
+
+    def test_duplicate_requests_share_one_execution(self, card_images):
+        first, _, copy = card_images
+
+        async def scenario():
+            return await asyncio.gather(
+                self.server.process_request({'command': 'process_image', 'image_path': str(first), 'request_id': 'a'}),
+                self.server.process_request({'command': 'process_image', 'image_path': str(copy), 'request_id': 'b'}),
+            )
+
+        first_response, second_response = run_server(self.server, scenario)
+
+        assert len(self.processor.calls) == 1
+        assert first_response['text'] == second_response['text']
+        assert first_response['request_id'] == 'a'
+        assert second_response['request_id'] == 'b'
+        assert second_response.get('coalesced') is True
+        assert self.server.stats['requests_coalesced'] == 1
+        assert len(self.server.in_flight) == 0
+
+    def test_distinct_requests_run_separately(self, card_images):
+        first, second, _ = card_images
+
+        async def scenario():
+            return await asyncio.gather(
+                self.server.process_request({'command': 'process_image', 'image_path': str(first)}),
+                self.server.process_request({'command': 'process_image', 'image_path': str(second)}),
+            )
+
+        run_server(self.server, scenario)
+        assert len(self.processor.calls) == 2
+        assert self.server.stats['requests_coalesced'] == 0
+
+    def test_completed_requests_are_not_reused(self, card_images):
+        first, _, _ = card_images
+        request = {'command': 'process_image', 'image_path': str(first)}
+
+        async def scenario():
+            await self.server.process_request(dict(request))
+            return await self.server.process_request(dict(request))
+
+        run_server(self.server, scenario)
+        assert len(self.processor.calls) == 2
+
+    def test_stats_command(self):
+        async def scenario():
+            return await self.server.process_request({'command': 'stats'})
+
+        response = run_server(self.server, scenario)
+        assert response['status'] == 'success'
+        assert 'requests_coalesced' in response['stats']
+
+    def test_control_commands_are_not_counted_as_requests(self, card_images):
+        async def scenario():
+            await self.server.process_request({'command': 'process_image', 'image_path': str(card_images[0])})
+            await self.server.process_request({'command': 'stats'})
+            await self.server.process_request({'command': 'cancel', 'target_id': 'gone'})
+
+        run_server(self.server, scenario)
+        assert self.server.stats['requests_received'] == 1
+
+
+class TestDeadlinesAndCancellation:
+    def setup_method(self):
+        self.server = OCRServer()
+        self.processor = FakeProcessor(delay=0.3)
+        self.server.processor = self.processor
+
+    def test_expired_queued_request_is_never_run(self, card_images):
+        first, second, _ = card_images
+
+        async def scenario():
+            return await asyncio.gather(
+                self.server.process_request({'command': 'process_image', 'image_path': str(first)}),
+                self.server.process_request({'command': 'process_image', 'image_path': str(second),
+                                             'request_id': 'late', 'timeout_ms': 50}),
+            )
+
+        first_response, expired = run_server(self.server, scenario)
+
+        assert first_response['status'] == 'success'
+        assert expired['code'] == 'DEADLINE_EXCEEDED'
+        assert expired['request_id'] == 'late'
+        assert self.processor.calls == [str(first)]
+        assert self.server.stats['jobs_dropped'] == 1
+
+    def test_cancel_running_request(self, card_images):
+        first, _, _ = card_images
+
+        async def scenario():
+            request = asyncio.create_task(self.server.process_request(
+                {'command': 'process_image', 'image_path': str(first), 'request_id': 'r1'}))
+            await asyncio.sleep(0.1)
+            cancel = await self.server.process_request({'command': 'cancel', 'target_id': 'r1'})
+            response = await request
+            await self.server.queue.join()
+            return response, cancel
+
+        response, cancel = run_server(self.server, scenario)
+
+        assert cancel['cancelled'] is True
+        assert response['code'] == 'CANCELLED'
+        assert self.server.stats['jobs_aborted'] == 1
+        assert self.server.stats['requests_executed'] == 0
+
+    def test_cancel_one_of_coalesced_waiters_keeps_job(self, card_images):
+        first, _, copy = card_images
+
+        async def scenario():
+            kept = asyncio.create_task(self.server.process_request(
+                {'command': 'process_image', 'image_path': str(first), 'request_id': 'kept'}))
+            dropped = asyncio.create_task(self.server.process_request(
+                {'command': 'process_image', 'image_path': str(copy), 'request_id': 'dropped'}))
+            await asyncio.sleep(0.1)
+            await self.server.process_request({'command': 'cancel', 'target_id': 'dropped'})
+            return await kept, await dropped
+
+        kept, dropped = run_server(self.server, scenario)
+
+        assert kept['status'] == 'success'
+        assert dropped['code'] == 'CANCELLED'
+        assert len(self.processor.calls) == 1
+
+    def test_cancel_unknown_request(self):
+        async def scenario():
+            return await self.server.process_request({'command': 'cancel', 'target_id': 'nope'})
+
+        assert run_server(self.server, scenario)['cancelled'] is False
+
+
+class TestPriorityLanes:
+    def setup_method(self):
+        self.server = OCRServer()
+        self.processor = FakeProcessor(delay=0.05)
+        self.server.processor = self.processor
+
+    def test_interactive_request_preempts_batch(self, tmp_path):
+        batch_paths = []
+        for i in range(5):
+            path = tmp_path / f"batch_{i}.png"
+            path.write_bytes(f"batch-{i}".encode())
+            batch_paths.append(str(path))
+        card = tmp_path / "card.png"
+        card.write_bytes(b"interactive")
+
+        async def scenario():
+            batch = asyncio.create_task(self.server.process_request(
+                {'command': 'process_batch', 'image_paths': batch_paths}))
+            await asyncio.sleep(0.08)
+            single = await self.server.process_request({'command': 'process_image', 'image_path': str(card)})
+            return await batch, single
+
+        batch, single = run_server(self.server, scenario)
+
+        assert single['status'] == 'success'
+        assert batch['results']['total_processed'] == 5
+        # The card ran between batch images rather than after the whole batch
+        assert self.processor.calls.index(str(card)) < len(batch_paths)
+        assert self.server.stats['batch_preemptions'] == 1
+
+    def test_interactive_duplicate_promotes_queued_batch_job(self, tmp_path):
+        paths = {}
+        for name in ("running", "other", "queued"):
+            paths[name] = tmp_path / f"{name}.png"
+            paths[name].write_bytes(name.encode())
+
+        def request(name, **extra):
+            return self.server.process_request({'command': 'process_image', 'image_path': str(paths[name]), **extra})
+
+        async def scenario():
+            running = asyncio.create_task(request('running', priority='batch'))
+            await asyncio.sleep(0.01)
+            other = asyncio.create_task(request('other', priority='batch'))
+            await asyncio.sleep(0)
+            queued = asyncio.create_task(request('queued', priority='batch'))
+            await asyncio.sleep(0.01)
+            assert self.server.queue.depth('batch') == 2
+            duplicate = await request('queued')
+            return duplicate, await asyncio.gather(running, other, queued)
+
+        duplicate, _ = run_server(self.server, scenario)
+
+        assert duplicate['coalesced'] is True
+        # The interactive caller's job ran ahead of the batch job queued before it
+        assert self.processor.calls.index(str(paths['queued'])) < self.processor.calls.index(str(paths['other']))
+
+    def test_unknown_priority_is_rejected_even_when_coalescable(self, card_images):
+        first = str(card_images[0])
+
+        async def scenario():
+            running = asyncio.create_task(self.server.process_request(
+                {'command': 'process_image', 'image_path': first}))
+            await asyncio.sleep(0.01)
+            with pytest.raises(ValueError, match="Unknown priority"):
+                await self.server.process_request(
+                    {'command': 'process_image', 'image_path': first, 'priority': 'urgent'})
+            return await running
+
+        assert run_server(self.server, scenario)['status'] == 'success'
+        assert self.server.stats['requests_coalesced'] == 0
+
+    def test_full_lane_rejects_fast(self, card_images):
+        first, second, _ = card_images
+        self.server.create_queue = lambda: LaneQueue({'interactive': 1})
+
+        async def scenario():
+            running = asyncio.create_task(self.server.process_request(
+                {'command': 'process_image', 'image_path': str(first)}))
+            await asyncio.sleep(0.01)
+            queued = asyncio.create_task(self.server.process_request(
+                {'command': 'extract_data', 'text': 'Name: A'}))
+            await asyncio.sleep(0.01)
+            rejected = await self.server.process_request(
+                {'command': 'process_image', 'image_path': str(second), 'request_id': 'busy'})
+            await asyncio.gather(running, queued)
+            return rejected
+
+        rejected = run_server(self.server, scenario)
+
+        assert rejected['code'] == 'SERVER_BUSY'
+        assert rejected['request_id'] == 'busy'
+        assert self.server.stats['requests_rejected'] == 1
+        assert self.server.get_stats()['lanes']['interactive']['rejected'] == 1
+
+    def test_lane_stats_report_wait_percentiles(self, card_images):
+        first, second, _ = card_images
+
+        async def scenario():
+            await asyncio.gather(
+                self.server.process_request({'command': 'process_image', 'image_path': str(first)}),
+                self.server.process_request({'command': 'process_image', 'image_path': str(second)}),
+            )
+            return self.server.get_stats()
+
+        lanes = run_server(self.server, scenario)['lanes']
+        assert lanes['interactive']['depth'] == 0
+        assert lanes['interactive']['wait_ms']['p95'] is not None
+        assert lanes['batch']['wait_ms']['p50'] is None
+
+    def test_prometheus_export(self, card_images):
+        async def scenario():
+            await self.server.process_request({'command': 'process_image', 'image_path': str(card_images[0])})
+
+        run_server(self.server, scenario)
+        text = metrics.render_prometheus(self.server._prometheus_gauges(), self.server._prometheus_counters())
+        families = [line.split()[2] for line in text.splitlines() if line.startswith('# TYPE')]
+        assert len(families) == len(set(families))
+        assert '# TYPE ocr_server_requests_received_total counter' in text
+        assert 'ocr_server_requests_received_total 1' in text
+        assert 'ocr_queue_depth{lane="batch"} 0' in text
+        assert 'ocr_queue_wait_ms{lane="interactive",quantile="0.95"}' in text
+
+    def test_request_lane_defaults(self):
+        assert request_lane({'command': 'process_batch'}) == 'batch'
+        assert request_lane({'command': 'process_image'}) == 'interactive'
+        assert request_lane({'command': 'process_batch', 'priority': 'interactive'}) == 'interactive'
+        with pytest.raises(ValueError):
+            request_lane({'command': 'extract_data', 'priority': 'urgent'})
+
+
+class TestIdleUnload:
+    def setup_method(self):
+        self.server = OCRServer()
+        self.processor = FakeProcessor(delay=0.01)
+        self.server.processor = self.processor
+        self.server.idle_unload_after = 0.1
+
+    def test_idle_model_is_unloaded_and_reloaded_on_demand(self, card_images):
+        first, _, _ = card_images
+
+        async def scenario():
+            monitor = asyncio.create_task(self.server._idle_monitor(interval=0.02))
+            try:
+                await self.server.process_request({'command': 'process_image', 'image_path': str(first)})
+                await asyncio.sleep(0.3)
+                unloaded = not self.processor.model_loaded
+                response = await self.server.process_request({'command': 'process_image', 'image_path': str(first)})
+                return unloaded, response
+            finally:
+                monitor.cancel()
+
+        unloaded, response = run_server(self.server, scenario)
+
+        assert unloaded
+        assert response['status'] == 'success'
+        assert response['model_reload_time'] > 0
+        assert self.server.stats['model_unloads'] == 1
+        assert self.server.stats['model_reloads'] == 1
+        assert self.server.get_stats()['model']['loaded'] is True
+
+    def test_busy_server_keeps_model(self, card_images):
+        first, _, _ = card_images
+        self.processor.delay = 0.3
+
+        async def scenario():
+            self.server.last_activity -= 1
+            monitor = asyncio.create_task(self.server._idle_monitor(interval=0.02))
+            try:
+                response = await self.server.process_request({'command': 'process_image', 'image_path': str(first)})
+                return response
+            finally:
+                monitor.cancel()
+
+        response = run_server(self.server, scenario)
+
+        assert 'model_reload_time' not in response
+        assert self.server.stats['model_unloads'] == 0
+
+    def test_extract_data_does_not_reload(self):
+        self.processor.unload_model()
+
+        async def scenario():
+            return await self.server.process_request({'command': 'extract_data', 'text': 'Name: A'})
+
+        response = run_server(self.server, scenario)
+        assert response['data'] == {'name': 'Name: A'}
+        assert self.processor.model_loaded is False
+
+
+class TestExtractDataBatch:
+    def setup_method(self):
+        self.server = OCRServer()
+        self.processor = FakeProcessor()
+        self.server.processor = self.processor
+
+    def test_results_in_input_order(self):
+        texts = [f"Name: {i}" for i in range(1000)]
+
+        async def scenario():
+            return await self.server.process_request({'command': 'extract_data_batch', 'texts': texts})
+
+        response = run_server(self.server, scenario)
+        assert response['status'] == 'success'
+        assert response['count'] == 1000
+        assert response['results'][0] == {'name': 'Name: 0'}
+        assert response['results'][-1] == {'name': 'Name: 999'}
+
+    def test_rejects_non_text_items(self):
+        async def scenario():
+            return await asyncio.gather(
+                self.server.process_request({'command': 'extract_data_batch', 'texts': ['Name: A', None]}),
+                self.server.process_request({'command': 'extract_data_batch', 'text': 'Name: A'}),
+            )
+
+        bad_item, missing = run_server(self.server, scenario)
+        assert bad_item['status'] == 'error'
+        assert 'texts[1]' in bad_item['error']
+        assert missing['status'] == 'error'
+
+    def test_coalescing_key_covers_order(self):
+        key = coalescing_key({'command': 'extract_data_batch', 'texts': ['a', 'b']})
+        assert key == coalescing_key({'command': 'extract_data_batch', 'texts': ['a', 'b']})
+        assert key != coalescing_key({'command': 'extract_data_batch', 'texts': ['b', 'a']})
+        assert coalescing_key({'command': 'extract_data_batch', 'texts': ['a', 1]}) is None
+
+
+class RejectingProcessor(FakeProcessor):
+    """Fails every image at the quality gate"""
+
+    def process_image(self, image_path, cancel_event=None):
+        reason = {'code': 'blurry', 'measure': 'sharpness', 'value': 0.003, 'threshold': 0.02,
+                  'message': 'sharpness 0.003 below minimum 0.02'}
+        raise ScanRejectedError(QualityReport(False, [reason], {'sharpness': 0.003}, 0.02))
+
+
+class TestScanRejected:
+    def test_rejection_is_structured(self, card_images):
+        server = OCRServer()
+        server.processor = RejectingProcessor()
+
+        async def scenario():
+            return await server.process_request({'command': 'process_image', 'image_path': str(card_images[0])})
+
+        response = run_server(server, scenario)
+        assert response['status'] == 'error'
+        assert response['code'] == 'SCAN_REJECTED'
+        assert response['quality']['reasons'][0]['code'] == 'blurry'
+        assert response['quality']['measures'] == {'sharpness': 0.003}
+
+
+class TestModelHotSwap:
+    def setup_method(self):
+        self.server = OCRServer()
+        self.old = FakeProcessor(delay=0.2)
+        self.server.processor = self.old
+        self.server.model_spec = {'model_name': 'fake-trocr', 'revision': 'main', 'version': 'v1'}
+        self.loaded = []
+
+        def factory(model_name, revision='main'):
+            if model_name == 'missing':
+                raise OSError("no such model")
+            time.sleep(0.05)
+            processor = FakeProcessor(delay=0.01, model_name=model_name, revision=revision)
+            self.loaded.append(processor)
+            return processor
+
+        self.server.processor_factory = factory
+
+    def test_swap_drains_old_model_then_frees_it(self, card_images):
+        first, second, _ = card_images
+
+        async def scenario():
+            running = asyncio.create_task(self.server.process_request(
+                {'command': 'process_image', 'image_path': str(first)}))
+            await asyncio.sleep(0.02)
+            swap = await self.server.process_request(
+                {'command': 'load_model', 'model_name': 'fine-tuned', 'version': 'v2'})
+            after = await self.server.process_request({'command': 'process_image', 'image_path': str(second)})
+            return await running, swap, after
+
+        before, swap, after = run_server(self.server, scenario)
+
+        assert swap['status'] == 'success'
+        assert swap['previous_version'] == 'v1'
+        assert before['model_version'] == 'v1'
+        assert after['model_version'] == 'v2'
+        assert self.server.processor is self.loaded[0]
+        assert self.old.model_loaded is False
+        assert self.server.get_stats()['model']['history'] == ['v1']
+
+    def test_rollback_restores_previous_model(self):
+        async def scenario():
+            await self.server.process_request({'command': 'load_model', 'model_name': 'fine-tuned'})
+            rollback = await self.server.process_request({'command': 'rollback'})
+            again = await self.server.process_request({'command': 'rollback'})
+            return rollback, again
+
+        rollback, again = run_server(self.server, scenario)
+
+        assert rollback['model_version'] == 'v1'
+        assert self.server.processor.model_name == 'fake-trocr'
+        assert again['code'] == 'NO_PREVIOUS_MODEL'
+        assert self.server.stats['model_rollbacks'] == 1
+
+    def test_failed_load_keeps_serving_old_model(self, card_images):
+        first, _, _ = card_images
+
+        async def scenario():
+            swap = await self.server.process_request({'command': 'load_model', 'model_name': 'missing'})
+            response = await self.server.process_request({'command': 'process_image', 'image_path': str(first)})
+            return swap, response
+
+        swap, response = run_server(self.server, scenario)
+
+        assert swap['code'] == 'MODEL_LOAD_FAILED'
+        assert response['model_version'] == 'v1'
+        assert self.server.processor is self.old
+
+    def test_concurrent_loads_are_refused(self):
+        async def scenario():
+            return await asyncio.gather(
+                self.server.process_request({'command': 'load_model', 'model_name': 'a'}),
+                self.server.process_request({'command': 'load_model', 'model_name': 'b'}),
+            )
+
+        first, second = run_server(self.server, scenario)
+        assert first['status'] == 'success'
+        assert second['code'] == 'MODEL_LOAD_IN_PROGRESS'
+
+
+class OutOfMemoryProcessor(FakeProcessor):
+    """Runs out of memory whenever more than ``limit`` images share a batch"""
+
+    def __init__(self, limit=2, **kwargs):
+        super().__init__(**kwargs)
+        self.limit = limit
+
+    def process_images(self, image_paths, cancel_event=None):
+        if len(image_paths) > self.limit:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return super().process_images(image_paths, cancel_event=cancel_event)
+
+
+class TestAdaptiveBatching:
+    def make_batch(self, tmp_path, count):
+        paths = []
+        for i in range(count):
+            path = tmp_path / f"batch_{i}.png"
+            path.write_bytes(f"batch-{i}".encode())
+            paths.append(str(path))
+        return paths
+
+    def test_batch_runs_in_controller_sized_chunks(self, tmp_path):
+        server = OCRServer()
+        server.processor = FakeProcessor(delay=0.01)
+        server.batch_controller = BatchSizeController(initial_size=3, max_size=3)
+        paths = self.make_batch(tmp_path, 7)
+
+        async def scenario():
+            return await server.process_request({'command': 'process_batch', 'image_paths': paths})
+
+        response = run_server(server, scenario)
+
+        assert response['results']['total_processed'] == 7
+        assert [len(chunk) for chunk in server.processor.chunks] == [3, 3, 1]
+        assert server.get_stats()['batching']['per_item_ms']
+
+    def test_explicit_batch_size_is_honoured(self, tmp_path):
+        server = OCRServer()
+        server.processor = FakeProcessor(delay=0.01)
+        paths = self.make_batch(tmp_path, 4)
+
+        async def scenario():
+            return await server.process_request(
+                {'command': 'process_batch', 'image_paths': paths, 'batch_size': 1})
+
+        run_server(server, scenario)
+        assert [len(chunk) for chunk in server.processor.chunks] == [1, 1, 1, 1]
+        assert server.batch_controller.snapshot()['decision_counts']['grow'] == 0
+
+    def test_out_of_memory_halves_and_retries(self, tmp_path):
+        server = OCRServer()
+        server.processor = OutOfMemoryProcessor(limit=2, delay=0.01)
+        server.batch_controller = BatchSizeController(initial_size=8, max_size=8)
+        paths = self.make_batch(tmp_path, 6)
+
+        async def scenario():
+            return await server.process_request({'command': 'process_batch', 'image_paths': paths})
+
+        response = run_server(server, scenario)
+
+        assert response['results']['total_processed'] == 6
+        assert response['results']['total_errors'] == 0
+        assert all(len(chunk) <= 2 for chunk in server.processor.chunks)
+        reasons = [d['reason'] for d in server.batch_controller.decisions]
+        assert reasons[:2] == ['out_of_memory', 'out_of_memory']
+
+    def test_pages_are_counted_off_the_event_loop(self, tmp_path, monkeypatch):
+        server = OCRServer()
+        server.processor = FakeProcessor()
+        paths = self.make_batch(tmp_path, 2)
+        expand = page_source.expand
+        threads = []
+
+        def recording(image_paths):
+            threads.append(threading.get_ident())
+            return expand(image_paths)
+        monkeypatch.setattr(page_source, "expand", recording)
+
+        async def scenario():
+            response = await server.process_request({'command': 'process_batch', 'image_paths': paths})
+            return response, threading.get_ident()
+
+        response, loop_thread = run_server(server, scenario)
+        assert response['results']['total_processed'] == 2
+        assert threads and loop_thread not in threads
+
+    def test_out_of_memory_below_controller_minimum(self, tmp_path):
+        server = OCRServer()
+        server.processor = OutOfMemoryProcessor(limit=0, delay=0.01)
+        server.batch_controller = BatchSizeController(initial_size=2, min_size=2, max_size=8)
+        paths = self.make_batch(tmp_path, 3)
+
+        async def scenario():
+            return await asyncio.wait_for(
+                server.process_request({'command': 'process_batch', 'image_paths': paths}), timeout=10)
+
+        response = run_server(server, scenario)
+
+        assert response['status'] == 'success'
+        assert response['results']['total_processed'] == 0
+        errors = response['results']['errors']
+        assert list(errors) == paths
+        assert all(error.startswith('OUT_OF_MEMORY') for error in errors.values())
+        assert server.batch_controller.size == 2
@@ -0,0 +1,137 @@
+import sys
+import zipfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import page_source
+from page_source import PageSourceError
+from quality_gate import QualityThresholds
+
+
+def page(number):
+    """A page with its number written on it, told apart by its pixels"""
+    image = np.full((300, 400, 3), 255, np.uint8)
+    cv2.putText(image, f"page {number}", (40, 160), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+    return image
+
+
+def write_tiff(path, count, first=1):
+    cv2.imwritemulti(str(path), [page(number) for number in range(first, first + count)])
+    return str(path)
+
+
+def same(image, number):
+    return image is not None and np.array_equal(image, page(number))
+
+
+class TestPageSource:
+    @pytest.fixture(autouse=True)
+    def files(self, tmp_path, monkeypatch):
+        # Extracted archive members go here, so a leftover one is noticed
+        (tmp_path / "tmp").mkdir()
+        monkeypatch.setattr(page_source.tempfile, "tempdir", str(tmp_path / "tmp"))
+        self.tmp = tmp_path
+        self.tiff = write_tiff(tmp_path / "scans#1.tif", 3)
+        self.png = str(tmp_path / "card.png")
+        cv2.imwrite(self.png, page(9))
+        self.archive = str(tmp_path / "batch.zip")
+        with zipfile.ZipFile(self.archive, "w") as archive:
+            archive.writestr("cards/", "")
+            archive.writestr("cards/first.png", cv2.imencode(".png", page(4))[1].tobytes())
+            archive.write(write_tiff(tmp_path / "member.tif", 2, first=5), "cards/more.tif")
+            archive.writestr("notes.txt", "not a scan")
+
+    def test_multi_page_tiff_is_addressed_by_page(self):
+        assert page_source.addresses(self.tiff) == [f"{self.tiff}#1", f"{self.tiff}#2", f"{self.tiff}#3"]
+        pages = list(page_source.iter_pages(self.tiff))
+        assert [p.address for p in pages] == page_source.addresses(self.tiff)
+        assert all(same(p.image, number) for p, number in zip(pages, [1, 2, 3]))
+        assert same(page_source.read_page(f"{self.tiff}#2"), 2)
+        assert page_source.read_page(f"{self.tiff}#4") is None
+        assert page_source.read_page(f"{self.tiff}#two") is None
+
+    def test_single_image_is_its_own_address(self):
+        assert page_source.addresses(self.png) == [self.png]
+        assert same(page_source.read_page(self.png), 9)
+        assert [p.address for p in page_source.iter_pages(f"{self.tiff}#3")] == [f"{self.tiff}#3"]
+
+    def test_archive_members_and_their_pages(self):
+        first, more = f"{self.archive}#cards/first.png", f"{self.archive}#cards/more.tif"
+        assert page_source.addresses(self.archive) == [first, f"{more}#1", f"{more}#2"]
+        pages = list(page_source.iter_pages(self.archive))
+        assert all(same(p.image, number) for p, number in zip(pages, [4, 5, 6]))
+        assert same(page_source.read_page(first), 4)
+        assert same(page_source.read_page(f"{more}#2"), 6)
+        assert page_source.read_page(f"{self.archive}#notes.txt") is None
+        assert list((self.tmp / "tmp").iterdir()) == []
+
+    def test_pages_are_decoded_only_when_reached(self, monkeypatch):
+        decoded = []
+        decode = page_source._decode
+
+        def counting(path, number, count=1):
+            decoded.append((number, count))
+            return decode(path, number, count)
+        monkeypatch.setattr(page_source, "_decode", counting)
+        pages = page_source.iter_pages(write_tiff(self.tmp / "long.tif", 10))
+        assert same(next(pages).image, 1)
+        assert decoded == [(1, page_source.TIFF_READ_AHEAD)]
+        assert all(same(p.image, number) for p, number in zip(pages, range(2, 11)))
+        assert decoded == [(1, 4), (5, 4), (9, 2)]
+
+    def test_unreadable_sources(self):
+        (self.tmp / "broken.zip").write_bytes(b"not an archive")
+        with pytest.raises(PageSourceError):
+            page_source.addresses(str(self.tmp / "missing.tif"))
+        with pytest.raises(PageSourceError):
+            list(page_source.iter_pages(str(self.tmp / "broken.zip")))
+        found, errors = page_source.expand([self.png, str(self.tmp / "broken.zip")])
+        assert found == [self.png]
+        assert list(errors) == [str(self.tmp / "broken.zip")]
+        assert page_source.read_page(str(self.tmp / "missing.tif#1")) is None
+
+    def test_pdf_without_pymupdf(self, monkeypatch):
+        (self.tmp / "scans.pdf").write_bytes(b"%PDF-1.4")
+        monkeypatch.setitem(sys.modules, "fitz", None)
+        with pytest.raises(PageSourceError, match="PyMuPDF"):
+            page_source.addresses(str(self.tmp / "scans.pdf"))
+
+    def test_pdf_pages(self):
+        fitz = pytest.importorskip("fitz")
+        document = fitz.open()
+        for number in (1, 2):
+            document.new_page().insert_text((72, 72), f"page {number}", fontsize=40)
+        document.save(str(self.tmp / "scans.pdf"))
+        path = str(self.tmp / "scans.pdf")
+        assert page_source.addresses(path) == [f"{path}#1", f"{path}#2"]
+        image = page_source.read_page(f"{path}#2")
+        assert image.ndim == 3 and image.shape[2] == 3
+        assert image.shape[1] == round(document[0].rect.width * page_source.PDF_DPI / 72)
+
+
+class TestProcessBatchPages:
+    def test_batches_stream_pages_by_address(self, tmp_path):
+        from ocr_processor import OCRProcessor
+
+        tiff = write_tiff(tmp_path / "scans.tif", 5)
+        processor = OCRProcessor.__new__(OCRProcessor)
+        processor.quality_thresholds = QualityThresholds(enabled=False)
+        processor.ensure_model_loaded = lambda: 0.0
+        batches = []
+
+        def read_pages(images, cancel_event=None):
+            batches.append(len(images))
+            return [f"text {len(batches)}"] * len(images)
+        processor._read_pages = read_pages
+
+        result = processor.process_batch([tiff, str(tmp_path / "missing.png"), f"{tiff}#9"], batch_size=2)
+        assert batches == [2, 2, 1]
+        assert list(result['results']) == [f"{tiff}#{number}" for number in range(1, 6)]
+        assert set(result['errors']) == {str(tmp_path / "missing.png"), f"{tiff}#9"}
+        assert processor.process_images([f"{tiff}#3"])['results'] == {f"{tiff}#3": "text 4"}
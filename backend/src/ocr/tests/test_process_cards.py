@@ -0,0 +1,165 @@
+import json
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import process_card
+from field_batching import FieldBatcher
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+NAMES = ["Ann Lee", "Bo Diaz", "Cy Wu", "Di Ray", "Ed Fox"]
+
+
+def card_scan(mask, name):
+    """An alignment mask printed at scan scale on a larger page, with a patient's name in its name field"""
+    scan = np.full((3300, 5100), 255, np.uint8)
+    card = mask.copy()
+    cv2.putText(card, name, (120, 110), cv2.FONT_HERSHEY_SIMPLEX, 2.5, 30, 6)
+    printed = cv2.resize(card, None, fx=1.9, fy=1.9, interpolation=cv2.INTER_LINEAR)
+    scan[260:260 + printed.shape[0], 140:140 + printed.shape[1]] = printed
+    return cv2.cvtColor(scan, cv2.COLOR_GRAY2BGR)
+
+
+class FakeHandler:
+    """Reads every crop as the number of the handler's batch it was in"""
+    created = 0
+
+    def __init__(self):
+        FakeHandler.created += 1
+        self.batches = 0
+
+    def generate_batch(self, images, max_length):
+        self.batches += 1
+        return [(f"batch {self.batches}", 2)] * len(images)
+
+
+class UnloadableHandler:
+    """A model that fails to load"""
+    created = 0
+
+    def __init__(self):
+        UnloadableHandler.created += 1
+        raise OSError("model weights not found")
+
+
+class FailingFirstBatchHandler(FakeHandler):
+    """Fails the first batch of fields it is given"""
+
+    failed = False
+
+    def generate_batch(self, images, max_length):
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError("CUDA out of memory")
+        return super().generate_batch(images, max_length)
+
+
+class RecordingBatcher(FieldBatcher):
+    """Records the cards whose crops are in each batch sent to the model"""
+    batches = []
+
+    def flush(self, run):
+        RecordingBatcher.batches += [{crop.key[0] for crop in batch}
+                                     for batches in self.plan().values() for batch in batches]
+        return super().flush(run)
+
+
+class TestProcessCards:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(process_card, "TrOCRHandler", FakeHandler)
+        monkeypatch.delenv("OCR_LAYOUTS", raising=False)
+        monkeypatch.delenv("OCR_STAGE_CACHE", raising=False)
+        monkeypatch.delenv("OCR_CARDS_PER_BATCH", raising=False)
+        FakeHandler.created = 0
+        mask = cv2.imread(str(RESOURCES / "masks/alignment_mask.png"), cv2.IMREAD_GRAYSCALE)
+        self.paths = []
+        for name in NAMES:
+            self.paths.append(str(tmp_path / f"{name.split()[0]}.png"))
+            cv2.imwrite(self.paths[-1], card_scan(mask, name))
+        self.tmp = tmp_path
+
+    def test_cards_in_input_order(self):
+        results = list(process_card.process_cards(self.paths, workers=0))
+        assert [result["image"] for result in results] == self.paths
+        assert all(result["status"] == "success" for result in results)
+        assert FakeHandler.created == 1
+        for result in results:
+            debug_info = result["data"]["debug_info"]
+            assert debug_info["layout"] == "caution_card"
+            assert debug_info["ocr_batch"]["cards"] == len(NAMES)
+            assert result["data"]["patient_info"]["name"].startswith("batch ")
+
+    def test_batches_span_cards(self, monkeypatch):
+        RecordingBatcher.batches = []
+        monkeypatch.setattr(process_card, "FieldBatcher", RecordingBatcher)
+        monkeypatch.setenv("OCR_CARDS_PER_BATCH", "2")
+        results = list(process_card.process_cards(self.paths, workers=0))
+        assert [result["data"]["debug_info"]["ocr_batch"]["cards"] for result in results] == [2, 2, 2, 2, 1]
+        # Fields of both cards of a batch are read together, and none with another batch's cards
+        assert {0, 1} in RecordingBatcher.batches
+        assert all(cards <= {0, 1} for cards in RecordingBatcher.batches)
+
+    def test_unreadable_cards_fail_on_their_own(self):
+        cv2.imwrite(str(self.tmp / "blank.png"), np.full((3300, 5100, 3), 255, np.uint8))
+        paths = [self.paths[0], str(self.tmp / "missing.png"), str(self.tmp / "blank.png"), self.paths[1]]
+        results = list(process_card.process_cards(paths, workers=0))
+        assert [result["image"] for result in results] == paths
+        assert [result["status"] for result in results] == ["success", "error", "error", "success"]
+        assert results[2]["error"]["code"] == "SCAN_REJECTED"
+
+    def test_every_page_is_a_card(self):
+        tiff = str(self.tmp / "stack.tif")
+        cv2.imwritemulti(tiff, [cv2.imread(path) for path in self.paths[:3]])
+        results = list(process_card.process_cards([tiff], workers=0))
+        assert [result["image"] for result in results] == [f"{tiff}#{number}" for number in (1, 2, 3)]
+        assert all(result["status"] == "success" for result in results)
+
+    def test_model_that_fails_to_load_fails_each_card(self, monkeypatch):
+        monkeypatch.setattr(process_card, "TrOCRHandler", UnloadableHandler)
+        monkeypatch.setenv("OCR_CARDS_PER_BATCH", "2")
+        UnloadableHandler.created = 0
+        paths = self.paths[:3] + [str(self.tmp / "missing.png")]
+        results = list(process_card.process_cards(paths, workers=0))
+        assert [result["image"] for result in results] == paths
+        assert [result["error"]["code"] for result in results] == ["OCR_PROCESSING_ERROR"] * 4
+        assert "model weights not found" in results[0]["error"]["message"]
+        assert "Could not read image" in results[3]["error"]["message"]
+        assert UnloadableHandler.created == 1
+
+    def test_failed_batch_fails_only_its_cards(self, monkeypatch):
+        monkeypatch.setattr(process_card, "TrOCRHandler", FailingFirstBatchHandler)
+        monkeypatch.setenv("OCR_CARDS_PER_BATCH", "2")
+        results = list(process_card.process_cards(self.paths, workers=0))
+        assert [result["status"] for result in results] == ["error", "error", "success", "success", "success"]
+        assert "out of memory" in results[0]["error"]["message"]
+
+    def test_missing_layouts_fail_each_card(self):
+        results = list(process_card.process_cards(self.paths[:2], workers=0, layouts=str(self.tmp / "none.json")))
+        assert [result["error"]["code"] for result in results] == ["OCR_PROCESSING_ERROR"] * 2
+        assert FakeHandler.created == 0
+
+    def test_pool_matches_in_process(self):
+        pooled = list(process_card.process_cards(self.paths, workers=2))
+        in_process = list(process_card.process_cards(self.paths, workers=0))
+        assert [result["image"] for result in pooled] == self.paths
+        for first, second in zip(pooled, in_process):
+            assert first["status"] == second["status"] == "success"
+            assert first["data"]["phenotype_data"] == second["data"]["phenotype_data"]
+            assert first["data"]["debug_info"]["stage_timings"].keys() >= {"decode", "align"}
+
+    def test_manifest_paths_are_relative_to_it(self):
+        (self.tmp / "cards").mkdir()
+        manifest = self.tmp / "cards" / "manifest.txt"
+        manifest.write_text(f"../Ann.png\n\n{self.paths[1]}\n")
+        assert process_card.read_card_manifest(str(manifest)) == [
+            str(self.tmp / "cards" / "../Ann.png"), self.paths[1]]
+        assert json.loads(json.dumps(next(process_card.process_cards(
+            process_card.read_card_manifest(str(manifest)), workers=0))))["status"] == "success"
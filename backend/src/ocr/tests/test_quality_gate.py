@@ -0,0 +1,178 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import card_registration
+import quality_gate
+from image_processor import ImageProcessor
+from metrics import metrics
+from ocr_processor import OCRProcessor
+from quality_gate import QualityThresholds, ScanRejectedError
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def card_scan():
+    """The alignment mask printed at scan scale, with a line of writing in it"""
+    mask = cv2.imread(str(RESOURCES / "masks/alignment_mask.png"), cv2.IMREAD_GRAYSCALE)
+    mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+    scan = cv2.resize(mask, None, fx=2.1, fy=2.1, interpolation=cv2.INTER_LINEAR)
+    cv2.putText(scan, "John Smith  O POS", (600, 900), cv2.FONT_HERSHEY_SIMPLEX, 5, 30, 10)
+    return cv2.cvtColor(scan, cv2.COLOR_GRAY2BGR)
+
+
+def blank_page():
+    noise = np.random.default_rng(0).integers(0, 8, (3300, 5100, 3), dtype=np.uint8)
+    return np.full((3300, 5100, 3), 240, np.uint8) + noise
+
+
+def codes(report):
+    return [reason['code'] for reason in report.reasons]
+
+
+class TestAssess:
+    def setup_method(self):
+        self.thresholds = QualityThresholds()
+        metrics.reset()
+
+    def test_clean_scan_is_accepted(self):
+        report = quality_gate.assess(card_scan(), self.thresholds)
+        assert report.accepted, report.reasons
+        assert report.measures['ink'] > 0.01
+        # The gate is meant to cost milliseconds next to seconds of alignment and OCR
+        assert report.seconds < 0.5
+
+    def test_sparse_page_is_accepted(self):
+        page = np.full((3300, 5100), 250, np.uint8)
+        cv2.putText(page, "Patient Name: John Smith", (300, 600), cv2.FONT_HERSHEY_SIMPLEX, 6, 40, 12)
+        assert quality_gate.assess(page, self.thresholds).accepted
+
+    def test_blurred_scan_is_rejected(self):
+        report = quality_gate.assess(cv2.GaussianBlur(card_scan(), (0, 0), 8), self.thresholds)
+        assert codes(report) == ["blurry"]
+        assert report.reasons[0]['value'] < report.reasons[0]['threshold']
+
+    @pytest.mark.parametrize("alpha,beta", [(0.25, 200), (0.3, 0)])
+    def test_washed_out_and_dark_scans_are_low_contrast(self, alpha, beta):
+        report = quality_gate.assess(cv2.convertScaleAbs(card_scan(), alpha=alpha, beta=beta), self.thresholds)
+        assert codes(report) == ["low_contrast"]
+
+    def test_blank_page_is_rejected(self):
+        report = quality_gate.assess(blank_page(), self.thresholds)
+        assert codes(report)[0] == "blank"
+        assert not report.accepted
+
+    def test_mostly_dark_page_is_rejected(self):
+        page = np.full((1200, 1800), 20, np.uint8)
+        page[:400, :600] = 250
+        assert "too_dark" in codes(quality_gate.assess(page, self.thresholds))
+
+    def test_alignment_inlier_ratio(self):
+        assert quality_gate.assess_alignment(0.9, self.thresholds).accepted
+        assert codes(quality_gate.assess_alignment(0.1, self.thresholds)) == ["misaligned"]
+        # A failed alignment has no inliers at all
+        assert codes(quality_gate.assess_alignment(None, self.thresholds)) == ["misaligned"]
+
+    def test_rejection_is_counted_once_under_first_reason(self):
+        with pytest.raises(ScanRejectedError) as error:
+            quality_gate.check_image(blank_page(), self.thresholds)
+        assert error.value.report.as_dict()['reasons'][0]['code'] == "blank"
+        assert "ink" in str(error.value)
+        counters = metrics.snapshot()["counters"]
+        assert counters["ocr_quality_rejections_total{reason=blank}"] == 1
+        assert sum(value for key, value in counters.items() if key.startswith("ocr_quality_rejections_total")) == 1
+
+    def test_thresholds_from_env(self, monkeypatch):
+        monkeypatch.setenv("OCR_QUALITY_MIN_CONTRAST", "0.1")
+        monkeypatch.setenv("OCR_QUALITY_MIN_INLIER_RATIO", "0.5")
+        thresholds = QualityThresholds.from_env()
+        assert thresholds.min_contrast == 0.1
+        assert thresholds.min_inlier_ratio == 0.5
+        assert thresholds.min_sharpness == QualityThresholds().min_sharpness
+        assert thresholds.enabled
+
+        monkeypatch.setenv("OCR_QUALITY_GATE", "0")
+        thresholds = QualityThresholds.from_env()
+        assert quality_gate.check_image(blank_page(), thresholds) is None
+        assert quality_gate.check_alignment(None, thresholds) is None
+
+
+class TestImageProcessorGate:
+    def setup_method(self):
+        self.processor = ImageProcessor(
+            str(RESOURCES / "templates/caution_card_template.png"),
+            str(RESOURCES / "masks/alignment_mask.png"),
+            str(RESOURCES / "masks/manualmask.png"),
+            str(RESOURCES / "coordinates/caution_card_coords.json"))
+        metrics.reset()
+
+    def test_unreadable_scan_is_rejected_before_alignment(self, tmp_path):
+        def align_image(image):
+            raise AssertionError("aligned a scan that failed the quality gate")
+        self.processor.align_image = align_image
+        cv2.imwrite(str(tmp_path / "blank.png"), blank_page())
+        with pytest.raises(ScanRejectedError):
+            self.processor.process_image(str(tmp_path / "blank.png"))
+        assert "quality" in metrics.snapshot()["stages"]
+
+    def test_failed_alignment_is_rejected(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(card_registration, "register", lambda *args: None)
+        self.processor._sift_homography = lambda gray: (None, None)
+        cv2.imwrite(str(tmp_path / "card.png"), card_scan())
+        with pytest.raises(ScanRejectedError) as error:
+            self.processor.process_image(str(tmp_path / "card.png"))
+        assert codes(error.value.report) == ["misaligned"]
+
+    def test_registered_card_passes_both_gates(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        cv2.imwrite(str(tmp_path / "card.png"), card_scan())
+        regions, _, inliers = self.processor.align_and_crop(self.processor.read_image(str(tmp_path / "card.png")))
+        assert regions
+        assert inliers > QualityThresholds().min_inlier_ratio
+
+
+class TestProcessCardGate:
+    def test_unreadable_scan_fails_before_loading_model(self, tmp_path, monkeypatch):
+        import process_card
+
+        def load_model():
+            raise AssertionError("loaded the OCR model for an unreadable scan")
+        monkeypatch.setattr(process_card, "TrOCRHandler", load_model)
+        monkeypatch.chdir(tmp_path)
+        cv2.imwrite(str(tmp_path / "blurred.png"), cv2.GaussianBlur(card_scan(), (0, 0), 8))
+        result = process_card.process_caution_card(str(tmp_path / "blurred.png"), str(RESOURCES / "masks/alignment_mask.png"),
+                                                   str(RESOURCES / "masks/manualmask.png"),
+                                                   str(RESOURCES / "coordinates/caution_card_coords.json"))
+        assert result["status"] == "error"
+        assert result["error"]["code"] == "SCAN_REJECTED"
+        assert result["error"]["details"]["stage"] == "quality"
+        assert result["error"]["details"]["quality"]["reasons"][0]["code"] == "blurry"
+
+
+class TestOCRProcessorGate:
+    def setup_method(self):
+        # Only the gate is exercised; loading the model would fail the test
+        self.processor = OCRProcessor.__new__(OCRProcessor)
+        self.processor.quality_thresholds = QualityThresholds()
+
+        def ensure_model_loaded():
+            raise AssertionError("loaded the model for an image that failed the quality gate")
+        self.processor.ensure_model_loaded = ensure_model_loaded
+
+    def test_rejected_before_model_loads(self, tmp_path):
+        cv2.imwrite(str(tmp_path / "blank.png"), blank_page())
+        with pytest.raises(ScanRejectedError):
+            self.processor.process_image(str(tmp_path / "blank.png"))
+
+    def test_batch_reports_rejections_as_errors(self, tmp_path):
+        cv2.imwrite(str(tmp_path / "blank.png"), blank_page())
+        batch = self.processor.process_images([str(tmp_path / "blank.png")])
+        assert batch['results'] == {}
+        assert batch['errors'][str(tmp_path / "blank.png")].startswith("Scan rejected")
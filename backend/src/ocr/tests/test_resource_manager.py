@@ -0,0 +1,108 @@
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from resource_manager import (ThreadProfile, autotune, candidate_profiles, default_profile, load_profile,
+                              run_pipeline, save_profile)
+from quality_gate import QualityReport, ScanRejectedError
+import resource_manager
+
+
+@pytest.fixture(autouse=True)
+def restore_thread_pools():
+    import torch
+    cv2_threads, torch_threads = cv2.getNumThreads(), torch.get_num_threads()
+    yield
+    cv2.setNumThreads(cv2_threads)
+    torch.set_num_threads(torch_threads)
+
+
+class TestProfiles:
+    @pytest.mark.parametrize("cores", [1, 2, 4, 8, 16])
+    @pytest.mark.parametrize("mode", ["latency", "throughput"])
+    def test_default_budgets_fit_the_machine(self, mode, cores):
+        profile = default_profile(mode, cores)
+        assert profile.torch_threads >= 1 and profile.cv2_threads >= 1
+        if cores > 1:
+            assert profile.preprocess_workers * profile.cv2_threads + profile.torch_threads <= cores
+
+    def test_throughput_runs_more_preprocess_workers(self):
+        assert default_profile("throughput", 16).preprocess_workers > default_profile("latency", 16).preprocess_workers
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            default_profile("fastest")
+
+    def test_saved_profile_round_trip(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(resource_manager, "cpu_count", lambda: 8)
+        path = tmp_path / "profiles.json"
+        tuned = ThreadProfile("throughput", 1, 5, 1, 3)
+        save_profile(tuned, path, benchmark={"cards_per_minute": 12.0})
+        save_profile(default_profile("latency", 8), path)
+
+        assert load_profile("throughput", path) == tuned
+        assert load_profile("latency", path) == default_profile("latency", 8)
+
+    def test_profile_from_other_machine_is_ignored(self, tmp_path, monkeypatch):
+        path = tmp_path / "profiles.json"
+        monkeypatch.setattr(resource_manager, "cpu_count", lambda: 32)
+        save_profile(ThreadProfile("latency", 8, 24, 1, 1), path)
+        monkeypatch.setattr(resource_manager, "cpu_count", lambda: 4)
+        assert load_profile("latency", path) == default_profile("latency", 4)
+
+    def test_candidates_are_unique(self):
+        candidates = candidate_profiles("throughput", 8)
+        assert len(candidates) == len(set(candidates))
+        assert all(c.mode == "throughput" for c in candidates)
+
+
+class TestAutotune:
+    def test_pipeline_applies_profile(self):
+        seen = []
+        run_pipeline(ThreadProfile("throughput", 2, 1, 1, 2), lambda item: item,
+                     lambda item: seen.append(cv2.getNumThreads()), items=3)
+        assert seen == [2, 2, 2]
+
+    def test_preprocess_errors_surface(self):
+        def preprocess(item):
+            raise ValueError("bad scan")
+
+        with pytest.raises(ValueError):
+            run_pipeline(ThreadProfile("latency", 1, 1, 1, 1), preprocess, lambda item: None, items=2)
+
+    def test_rejected_samples_are_reported(self):
+        candidates = [ThreadProfile("throughput", 1, 1, 1, 1), ThreadProfile("throughput", 1, 1, 1, 2)]
+        read = []
+
+        def preprocess(item):
+            if item % 2:
+                raise ScanRejectedError(QualityReport(False, [{"message": "too blurred"}], {}, 0.0))
+            return item
+
+        results = autotune(preprocess, read.append, mode="throughput", items=4, candidates=candidates,
+                           rejects=(ScanRejectedError,))
+        assert [result["rejected"] for result in results] == [2, 2]
+        assert sorted(read) == [0, 0, 2, 2]
+
+    def test_default_sample_is_a_card_scan(self):
+        assert resource_manager.DEFAULT_SAMPLE_PATH.exists()
+        assert "templates" not in resource_manager.DEFAULT_SAMPLE_PATH.parts
+
+    def test_picks_fastest_profile(self):
+        candidates = [ThreadProfile("throughput", 1, 1, 1, 1), ThreadProfile("throughput", 1, 1, 1, 3)]
+
+        def preprocess(item):
+            time.sleep(0.03)
+            return item
+
+        results = autotune(preprocess, lambda item: None, mode="throughput", items=6, candidates=candidates)
+
+        # Three preprocessing workers overlap the sleeps
+        assert results[0]["profile"].preprocess_workers == 3
+        assert results[0]["cards_per_minute"] > results[1]["cards_per_minute"]
@@ -0,0 +1,178 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import quality_gate
+import sheet_splitter
+from field_batching import FieldBatcher
+from image_processor import ImageProcessor
+from layout_registry import LayoutRegistry
+from metrics import metrics
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def processor():
+    return ImageProcessor(
+        str(RESOURCES / "templates/caution_card_template.png"),
+        str(RESOURCES / "masks/alignment_mask.png"),
+        str(RESOURCES / "masks/manualmask.png"),
+        str(RESOURCES / "coordinates/caution_card_coords.json"))
+
+
+def card(mask, name):
+    """A card: the alignment mask with a patient's name written in its name field"""
+    card = mask.copy()
+    cv2.putText(card, name, (120, 110), cv2.FONT_HERSHEY_SIMPLEX, 2.5, 30, 6)
+    return card
+
+
+def sheet_of(cards, positions, shape=(3600, 5400)):
+    sheet = np.full(shape, 245, np.uint8)
+    for image, (x, y) in zip(cards, positions):
+        sheet[y:y + image.shape[0], x:x + image.shape[1]] = image
+    return cv2.cvtColor(sheet, cv2.COLOR_GRAY2BGR)
+
+
+def contains(bounds, image, position):
+    x, y, width, height = bounds
+    return x <= position[0] and y <= position[1] and \
+        x + width >= position[0] + image.shape[1] and y + height >= position[1] + image.shape[0]
+
+
+class TestFindCards:
+    def setup_method(self):
+        self.processor = processor()
+        self.mask = self.processor.alignment_mask
+        self.shape = sheet_splitter.card_shape(self.processor.reference_layout, self.mask.shape)
+        self.cards = [card(self.mask, name) for name in ["Ann Lee", "Bo Diaz", "Cy Wu", "Di Ray"]]
+        self.positions = [(100, 150), (2750, 150), (100, 1950), (2750, 1950)]
+
+    def test_card_shape(self):
+        # The printed box leaves most of the card above it
+        assert self.shape.aspect == pytest.approx(2.31, abs=0.02)
+        assert self.shape.short_extent > 0.4 > self.shape.long_extent
+
+    def test_finds_every_card_in_reading_order(self):
+        sheet = sheet_of(self.cards, self.positions)
+        found = sheet_splitter.find_cards(cv2.cvtColor(sheet, cv2.COLOR_BGR2GRAY), [self.shape])
+        assert len(found) == 4
+        for sheet_card, image, position in zip(found, self.cards, self.positions):
+            assert contains(sheet_card.bounds, image, position)
+
+    def test_turned_cards_are_cut_out_whole(self):
+        turned = [self.cards[0], cv2.rotate(self.cards[1], cv2.ROTATE_180)]
+        sideways = cv2.rotate(self.cards[2], cv2.ROTATE_90_CLOCKWISE)
+        sheet = sheet_of(turned + [sideways], self.positions[:2] + [(1000, 1850)], shape=(4400, 5400))
+        found = sheet_splitter.find_cards(cv2.cvtColor(sheet, cv2.COLOR_BGR2GRAY), [self.shape])
+        assert len(found) == 3
+        assert contains(found[0].bounds, turned[0], self.positions[0])
+        assert contains(found[1].bounds, turned[1], self.positions[1])
+        assert contains(found[2].bounds, sideways, (1000, 1850))
+
+    def test_single_card_and_blank_sheet(self):
+        scan = sheet_of(self.cards[:1], [(300, 400)])
+        assert len(sheet_splitter.split_sheet(scan, [self.shape])) == 1
+        assert sheet_splitter.split_sheet(sheet_of([], []), [self.shape]) == []
+
+    def test_crops_are_views_of_the_sheet(self):
+        sheet = sheet_of(self.cards[:2], self.positions[:2])
+        (first, crop), _ = sheet_splitter.split_sheet(sheet, [self.shape])
+        x, y, width, height = first.bounds
+        assert crop.shape[:2] == (height, width)
+        assert np.shares_memory(crop, sheet)
+
+
+class FakeHandler:
+    def __init__(self):
+        self.batches = []
+
+    def generate_batch(self, images, max_length):
+        self.batches.append(len(images))
+        return [("text", 4)] * len(images)
+
+
+class TestProcessCardSheet:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        import process_card
+        self.process_card = process_card
+        self.handlers = []
+
+        def handler():
+            self.handlers.append(FakeHandler())
+            return self.handlers[-1]
+        monkeypatch.setattr(process_card, "TrOCRHandler", handler)
+
+        # The keys of the crops in every batch the sheet's fields are read in
+        self.batches = []
+        test = self
+
+        class RecordingBatcher(FieldBatcher):
+            def plan(self):
+                plan = super().plan()
+                test.batches = [[crop.key for crop in batch] for batches in plan.values() for batch in batches]
+                return plan
+        monkeypatch.setattr(process_card, "FieldBatcher", RecordingBatcher)
+        monkeypatch.chdir(tmp_path)
+        self.registry = LayoutRegistry({"caution_card": processor()})
+        mask = self.registry.processors["caution_card"].alignment_mask
+        self.cards = [card(mask, name) for name in ["Ann Lee", "Bo Diaz", "Cy Wu", "Di Ray"]]
+        self.positions = [(100, 150), (2750, 150), (100, 1950), (2750, 1950)]
+        self.path = str(tmp_path / "sheet.png")
+        cv2.imwrite(self.path, sheet_of(self.cards, self.positions))
+        metrics.reset()
+
+    def test_reads_every_card_with_one_batch(self):
+        result = self.process_card.process_card_sheet(self.path, self.registry)
+        assert result["status"] == "success", result
+        cards = result["data"]["cards"]
+        assert [card["status"] for card in cards] == ["success"] * 4
+        assert all(card["data"]["layout"] == "caution_card" for card in cards)
+        assert all(card["data"]["patient_info"]["name"] == "text" for card in cards)
+        assert cards[1]["bounds"]["x"] > cards[0]["bounds"]["x"]
+
+        sheet = result["data"]["debug_info"]["sheet"]
+        assert sheet["cards_found"] == sheet["cards_read"] == 4
+        assert sheet["cards_per_minute"] > 0
+        assert "split" in result["data"]["debug_info"]["stage_timings"]
+
+        # One model for the sheet, and its fields batched across cards rather than card by card
+        assert len(self.handlers) == 1
+        assert sum(self.handlers[0].batches) == result["data"]["debug_info"]["field_batching"]["crops"]
+        assert any(len({card for card, _ in batch}) > 1 for batch in self.batches)
+
+    def test_unreadable_card_is_reported_on_its_own(self, monkeypatch):
+        check_image = quality_gate.check_image
+        calls = []
+
+        def reject_second(image, thresholds):
+            calls.append(image)
+            if len(calls) == 2:
+                return quality_gate.enforce(quality_gate.assess(np.full((600, 900), 250, np.uint8), thresholds))
+            return check_image(image, thresholds)
+        monkeypatch.setattr(quality_gate, "check_image", reject_second)
+        result = self.process_card.process_card_sheet(self.path, self.registry)
+        cards = result["data"]["cards"]
+        assert [card["status"] for card in cards] == ["success", "error", "success", "success"]
+        assert cards[1]["error"]["code"] == "SCAN_REJECTED"
+        assert "bounds" in cards[1]
+        assert result["data"]["debug_info"]["sheet"]["cards_read"] == 3
+
+    def test_sheet_without_cards_never_loads_model(self, tmp_path):
+        cv2.imwrite(str(tmp_path / "blank.png"), sheet_of([], []))
+        result = self.process_card.process_card_sheet(str(tmp_path / "blank.png"), self.registry)
+        assert result["status"] == "success"
+        assert result["data"]["cards"] == []
+        assert self.handlers == []
+
+    def test_unreadable_sheet_is_an_error(self, tmp_path):
+        result = self.process_card.process_card_sheet(str(tmp_path / "missing.png"), self.registry)
+        assert result["status"] == "error"
+        assert result["error"]["code"] == "OCR_PROCESSING_ERROR"
@@ -0,0 +1,197 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+# The OCR modules use flat imports, so put the package directory on the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import card_registration
+import page_source
+import stage_cache
+from image_processor import ImageProcessor
+from layout_registry import LayoutRegistry
+from metrics import metrics
+from stage_cache import CachedRegions, StageCache
+
+RESOURCES = Path(__file__).parent.parent / "resources"
+
+
+def processor():
+    return ImageProcessor(
+        str(RESOURCES / "templates/caution_card_template.png"),
+        str(RESOURCES / "masks/alignment_mask.png"),
+        str(RESOURCES / "masks/manualmask.png"),
+        str(RESOURCES / "coordinates/caution_card_coords.json"))
+
+
+def card_scan(mask):
+    """An alignment mask printed at scan scale on a larger page, with a patient's name in its name field"""
+    scan = np.full((3300, 5100), 255, np.uint8)
+    card = mask.copy()
+    cv2.putText(card, "Ann Lee", (120, 110), cv2.FONT_HERSHEY_SIMPLEX, 2.5, 30, 6)
+    printed = cv2.resize(card, None, fx=1.9, fy=1.9, interpolation=cv2.INTER_LINEAR)
+    scan[260:260 + printed.shape[0], 140:140 + printed.shape[1]] = printed
+    return cv2.cvtColor(scan, cv2.COLOR_GRAY2BGR)
+
+
+def same_regions(first, second):
+    assert first.keys() == second.keys()
+    for name, region in first.items():
+        other = second[name]
+        if region is None or other is None:
+            assert region is other, name
+        elif isinstance(region, dict):
+            assert region["analysis"] == other["analysis"]
+            assert np.array_equal(region["image"], other["image"])
+        else:
+            assert np.array_equal(region, other), name
+    return True
+
+
+def never(*args, **kwargs):
+    raise AssertionError("ran a stage whose output was cached")
+
+
+class TestStageCache:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.processor = processor()
+        self.path = str(tmp_path / "card.png")
+        cv2.imwrite(self.path, card_scan(self.processor.alignment_mask))
+        self.cache_dir = tmp_path / "cache"
+        metrics.reset()
+
+    def registry(self):
+        """A fresh registry on the same layout and cache directory, as on a later run"""
+        self.processor.reset_session()
+        registry = LayoutRegistry({"caution_card": self.processor})
+        registry.stage_cache = StageCache(str(self.cache_dir))
+        return registry
+
+    def test_off_without_directory(self, monkeypatch):
+        monkeypatch.delenv("OCR_STAGE_CACHE", raising=False)
+        assert LayoutRegistry({"caution_card": self.processor}).stage_cache is None
+        monkeypatch.setenv("OCR_STAGE_CACHE", str(self.cache_dir))
+        assert LayoutRegistry({"caution_card": self.processor}).stage_cache.directory == self.cache_dir
+
+    def test_rerun_reads_cached_crops(self, monkeypatch):
+        registry = self.registry()
+        match, regions = registry.process_image(self.path)
+        assert registry.stage_cache.last.resumed_from == "decode"
+        assert any(region is not None for region in regions.values())
+
+        registry = self.registry()
+        monkeypatch.setattr(page_source, "read_page", never)
+        monkeypatch.setattr(card_registration, "layout", never)
+        cached_match, cached = registry.process_image(self.path)
+        assert cached_match.name == match.name
+        assert same_regions(regions, cached)
+        assert registry.stage_cache.last.resumed_from == "ocr"
+        assert registry.stage_cache.last.seconds_saved > 0
+        assert metrics.snapshot()["caches"]["stage_crop"]["hits"] == 1
+
+    def test_changed_denoising_reuses_homography(self, monkeypatch):
+        self.registry().process_image(self.path)
+        aligned = dict(self.processor.alignment_counts)
+
+        self.processor.denoising = "none" if self.processor.denoising != "none" else "bilateral"
+        registry = self.registry()
+        monkeypatch.setattr(card_registration, "layout", never)
+        monkeypatch.setattr(card_registration, "register", never)
+        registry.process_image(self.path)
+        assert registry.stage_cache.last.resumed_from == "mask"
+        assert self.processor.alignment_counts["cached"] == 1
+        assert self.processor.alignment_counts["contour"] == aligned["contour"]
+
+        # The crops made with the new setting are cached in their turn
+        registry = self.registry()
+        registry.process_image(self.path)
+        assert registry.stage_cache.last.resumed_from == "ocr"
+
+    def test_caches_the_scans_own_homography(self, monkeypatch):
+        registry = self.registry()
+        scan = cv2.imread(self.path)
+        moved = cv2.warpAffine(scan, np.float32([[1, 0, 60], [0, 1, 40]]), (scan.shape[1], scan.shape[0]),
+                               borderValue=(255, 255, 255))
+        align_and_crop = self.processor.align_and_crop
+        returned = []
+
+        def with_another_card(*args, **kwargs):
+            result = align_and_crop(*args, **kwargs)
+            returned.append(result[1])
+            # Another thread aligns a card on the shared processor before this one is cached
+            self.processor.align_image(moved)
+            return result
+        monkeypatch.setattr(self.processor, "align_and_crop", with_another_card)
+        registry.process_image(self.path)
+
+        key = registry.stage_cache.input_key(self.path)
+        cached = registry.stage_cache.load_alignment(key, stage_cache.alignment_config(registry.processors))
+        assert np.array_equal(cached.homography, returned[0])
+
+    def test_changed_registration_runs_everything(self):
+        self.registry().process_image(self.path)
+        self.processor.quality_thresholds = self.processor.quality_thresholds._replace(min_contrast=0.3)
+        registry = self.registry()
+        registry.process_image(self.path)
+        assert registry.stage_cache.last.resumed_from == "decode"
+
+    def test_key_covers_content_and_page(self, tmp_path):
+        cache = StageCache(str(self.cache_dir))
+        key = cache.input_key(self.path)
+        assert cache.input_key(self.path) == key
+        assert cache.input_key(f"{self.path}#2") not in (None, key)
+        cv2.imwrite(str(tmp_path / "other.png"), np.zeros((50, 50), np.uint8))
+        assert cache.input_key(str(tmp_path / "other.png")) != key
+        assert cache.input_key(str(tmp_path / "missing.png")) is None
+
+    def test_regions_round_trip(self):
+        cache = StageCache(str(self.cache_dir))
+        crop = np.random.default_rng(0).integers(0, 255, (40, 90, 3), dtype=np.uint8)
+        regions = {"patient_name": crop, "rh_D": {"image": crop[:, :30], "analysis": "+"}, "kell_K": None}
+        cache.store_regions("ab" * 32, "config", CachedRegions(regions, 1.5))
+        cached = cache.load_regions("ab" * 32, "config")
+        assert cached.seconds == 1.5
+        assert same_regions(regions, cached.regions)
+        assert cache.load_regions("ab" * 32, "other config") is None
+
+    def test_unreadable_entry_is_a_miss(self):
+        registry = self.registry()
+        registry.process_image(self.path)
+        for entry in self.cache_dir.rglob("crop-*.npz"):
+            entry.write_bytes(b"truncated")
+        registry = self.registry()
+        registry.process_image(self.path)
+        assert registry.stage_cache.last.resumed_from == "mask"
+        assert not list(self.cache_dir.rglob("*.tmp"))
+
+
+class FakeHandler:
+    def generate_batch(self, images, max_length):
+        return [("text", 4)] * len(images)
+
+
+class TestProcessCardCache:
+    def test_reports_time_saved(self, tmp_path, monkeypatch):
+        import process_card
+        monkeypatch.setattr(process_card, "TrOCRHandler", FakeHandler)
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("OCR_STAGE_CACHE", str(tmp_path / "cache"))
+        registry_processor = processor()
+        cv2.imwrite(str(tmp_path / "card.png"), card_scan(registry_processor.alignment_mask))
+
+        results = []
+        for _ in range(2):
+            registry_processor.reset_session()
+            registry = LayoutRegistry({"caution_card": registry_processor})
+            results.append(process_card.process_card_layouts(str(tmp_path / "card.png"), registry))
+        first, second = (result["data"] for result in results)
+        assert first["debug_info"]["stage_cache"]["resumed_from"] == "decode"
+        assert second["debug_info"]["stage_cache"]["resumed_from"] == "ocr"
+        assert second["debug_info"]["stage_cache"]["seconds_saved"] > 0
+        assert second["patient_info"] == first["patient_info"]
+        assert second["phenotype_data"] == first["phenotype_data"]
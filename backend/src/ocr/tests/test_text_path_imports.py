@@ -0,0 +1,48 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+OCR_DIR = Path(__file__).parent.parent
+
+# Modules the text-only path must not load: each costs seconds at startup
+HEAVY_MODULES = {"torch", "transformers", "cv2", "PIL", "tqdm", "numpy"}
+
+# Generous ceiling for importing ocr_processor itself; with torch and
+# transformers at module level it took several seconds
+IMPORT_BUDGET_US = 1_000_000
+
+
+def run_with_importtime(*args):
+    """Run Python with -X importtime in the OCR directory; returns (stdout, {module: cumulative µs})"""
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=OCR_DIR,
+                            capture_output=True, text=True, timeout=120)
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported[name.strip()] = int(cumulative)
+    return result, imported
+
+
+class TestTextPathImports:
+    def test_import_is_light(self):
+        result, imported = run_with_importtime("-c", "import ocr_processor")
+        assert result.returncode == 0, result.stderr
+        assert not HEAVY_MODULES & {name.split(".")[0] for name in imported}
+        assert imported["ocr_processor"] < IMPORT_BUDGET_US
+
+    def test_text_extract_cli_loads_no_model(self):
+        result, imported = run_with_importtime(
+            "ocr_processor.py", "--text", "Patient Name: John Smith Gender: M Blood Type: O POS", "--extract")
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.strip().splitlines()[-1]) == {
+            "data": {"name": "John Smith", "gender": "Male", "blood_type": "O POS"}
+        }
+        assert not HEAVY_MODULES & {name.split(".")[0] for name in imported}
+
+    def test_invalid_arguments(self):
+        result, _ = run_with_importtime("ocr_processor.py", "--text", "Name: A")
+        assert result.returncode == 1
+        assert "error" in json.loads(result.stdout.strip().splitlines()[-1])
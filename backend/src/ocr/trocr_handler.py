@@ -1,14 +1,15 @@
 import torch
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 import logging
 from PIL import Image
 import numpy as np
 import cv2
 import os
 import warnings
-from typing import Union
+from typing import List, Tuple, Union
 import gc
-# from accelerate import init_empty_weights # Reverted: Caused meta tensor error
+from metrics import metrics, SIZE_BUCKETS
+from model_registry import get_registry
+from field_batching import generated_lengths
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +24,7 @@ class TrOCRHandler:
         """
         # Use default path if none provided
         if model_name is None:
-            # Use the remote model name instead of relying on a downloaded version
+            # Resolved from the local model store first, downloaded only if missing
             model_name = "microsoft/trocr-large-handwritten"
             
         logger.info(f"Initializing TrOCR handler with model: {model_name}")
@@ -53,31 +54,22 @@ class TrOCRHandler:
             with warnings.catch_warnings():
                 warnings.filterwarnings("ignore", message="Some weights of VisionEncoderDecoderModel were not initialized")
                 
-                # Load processor from model name, allow downloading if needed
-                logger.info(f"Loading processor from {model_name}")
-                self.processor = TrOCRProcessor.from_pretrained(model_name)
-                logger.info("Processor loaded successfully")
-                
-                # Load model, allow downloading if needed
-                logger.info(f"Loading model from {model_name}")
-                # Reverted: Removed init_empty_weights context manager
-                self.model = VisionEncoderDecoderModel.from_pretrained(
+                # Share the weights with any other handler or processor using the same model
+                logger.info(f"Acquiring processor and model for {model_name}")
+                self._model_handle = get_registry().acquire(
                     model_name,
-                    ignore_mismatched_sizes=True,  # Handle any size mismatches
-                    local_files_only=False        # Allow downloading the model if not available locally
-                    # torch_dtype=torch.float16 if self.device == "cuda" else torch.float32 # Removed
+                    device=self.device,
+                    ignore_mismatched_sizes=True  # Handle any size mismatches
                 )
-                logger.info("Model loaded successfully")
-                
-                # Move model to GPU if available and set to eval mode
-                self.model = self.model.to(self.device)
-                self.model.eval()
-                logger.info(f"Model moved to device: {self.device}")
+                self.processor = self._model_handle.processor
+                self.model = self._model_handle.model
+                logger.info(f"Model ready on device: {self.device} "
+                            f"({'loaded' if self._model_handle.loaded else 'shared'})")
                 
                 # Verify model is on correct device
                 logger.info(f"Model device: {next(self.model.parameters()).device}")
             
-            # Default generation parameters
+            # Default generation parameters, kept per handler and passed on each call
             self.generation_params = {
                 "max_length": 64,
                 "num_beams": 5,
@@ -92,6 +84,12 @@ class TrOCRHandler:
             logger.error(f"Failed to initialize TrOCR handler: {str(e)}")
             raise
     
+    def close(self):
+        """Release this handler's reference to the shared model."""
+        handle = getattr(self, "_model_handle", None)
+        if handle is not None:
+            handle.release()
+    
     def set_generation_params(self, **kwargs):
         """Update the generation parameters.
         
@@ -112,25 +110,31 @@ class TrOCRHandler:
             str: Generated text
         """
         try:
-            # Prepare image
-            if isinstance(image, np.ndarray):
-                image = Image.fromarray(image)
-            
-            # Process image
-            pixel_values = self.processor(image, return_tensors="pt").pixel_values
-            
-            # Move input to the same device as the model
-            pixel_values = pixel_values.to(self.device)
+            with metrics.stage("preprocess"):
+                # Prepare image
+                if isinstance(image, np.ndarray):
+                    image = Image.fromarray(image)
+                
+                # Process image
+                pixel_values = self.processor(image, return_tensors="pt").pixel_values
+                
+                # Move input to the same device as the model
+                pixel_values = pixel_values.to(self.device)
+            metrics.observe("ocr_inference_batch_size", pixel_values.shape[0], buckets=SIZE_BUCKETS)
             
             # Generate text
             with torch.no_grad():  # Disable gradient computation
-                generated_ids = self.model.generate(
-                    pixel_values,
-                    **self.generation_params
-                )
+                with metrics.stage("encode"):
+                    encoder_outputs = self.model.encoder(pixel_values=pixel_values)
+                with metrics.stage("generate"):
+                    generated_ids = self.model.generate(
+                        encoder_outputs=encoder_outputs,
+                        **self.generation_params
+                    )
             
             # Decode the generated ids
-            generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+            with metrics.stage("postprocess"):
+                generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
             
             # Clear CUDA cache if using GPU
             if self.device == "cuda":
@@ -143,6 +147,56 @@ class TrOCRHandler:
             logger.error(f"Error generating text for field {field_name}: {str(e)}")
             return ""
     
+    def generate_batch(self, images: List[Union[np.ndarray, Image.Image]],
+                       max_new_tokens: int = None) -> List[Tuple[str, int]]:
+        """Generate text for several crops in one batch.
+        
+        Args:
+            images (List): Crops to read, as PIL images or arrays
+            max_new_tokens (int): Decode limit for the whole batch; overrides max_length
+            
+        Returns:
+            List[Tuple[str, int]]: (text, number of generated tokens) per crop
+        """
+        if not images:
+            return []
+        try:
+            with metrics.stage("preprocess"):
+                pil_images = [(Image.fromarray(image) if isinstance(image, np.ndarray) else image).convert("RGB")
+                              for image in images]
+                pixel_values = self.processor(pil_images, return_tensors="pt").pixel_values.to(self.device)
+            metrics.observe("ocr_inference_batch_size", pixel_values.shape[0], buckets=SIZE_BUCKETS)
+            
+            params = dict(self.generation_params)
+            if max_new_tokens is not None:
+                params.pop("max_length", None)
+                params["max_new_tokens"] = max_new_tokens
+            with torch.no_grad():
+                with metrics.stage("encode"):
+                    encoder_outputs = self.model.encoder(pixel_values=pixel_values)
+                with metrics.stage("generate"):
+                    generated_ids = self.model.generate(encoder_outputs=encoder_outputs, **params)
+            
+            with metrics.stage("postprocess"):
+                texts = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+                lengths = self._generated_lengths(generated_ids)
+            
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            return [(text.strip(), length) for text, length in zip(texts, lengths)]
+            
+        except Exception as e:
+            logger.error(f"Error generating text for a batch of {len(images)} crops: {str(e)}")
+            return [("", 0)] * len(images)
+    
+    def _generated_lengths(self, generated_ids: torch.Tensor) -> List[int]:
+        """Tokens each sequence produced before its end-of-sequence token"""
+        eos_token_id = self.model.generation_config.eos_token_id
+        if isinstance(eos_token_id, list):
+            eos_token_id = eos_token_id[0]
+        # Column 0 is the decoder start token
+        return generated_lengths(generated_ids[:, 1:].tolist(), eos_token_id)
+    
     def is_blank_field(self, image: Union[np.ndarray, Image.Image]) -> bool:
         """Check if a field is blank.
         
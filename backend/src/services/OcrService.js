@@ -22,7 +22,8 @@ const OCR_CONFIG = {
   },
   timeouts: {
     initialization: 60000, // 60 seconds
-    processing: 30000 // 30 seconds
+    processing: 30000, // 30 seconds
+    modelLoad: 300000 // 5 minutes
   }
 };
 
@@ -32,6 +33,8 @@ class OCRService {
     this.isReady = false;
     this.requestQueue = [];
     this.currentRequest = null;
+    // Control commands (model swaps) answered out of band, keyed by request_id
+    this.controlRequests = new Map();
     this.pythonScript = path.join(__dirname, '../ocr/ocr_server.py');
     this.pythonPath = path.join(__dirname, '../../venv/Scripts/python.exe');
     
@@ -142,6 +145,10 @@ class OCRService {
             this.currentRequest.reject(new Error('OCR service terminated unexpectedly'));
             this.currentRequest = null;
           }
+          for (const control of this.controlRequests.values()) {
+            control.reject(new Error('OCR service terminated unexpectedly'));
+          }
+          this.controlRequests.clear();
 
           // If we haven't resolved yet, this is an initialization failure
           if (!this.isReady) {
@@ -167,13 +174,24 @@ class OCRService {
                 clearTimeout(initializationTimeout);
                 this.isReady = true;
                 resolve();
-              } else if (response.status === 'error') {
-                logger.error('Python process error:', response.error);
-                reject(new Error(response.error));
+              } else if (response.request_id && this.controlRequests.has(response.request_id)) {
+                const control = this.controlRequests.get(response.request_id);
+                this.controlRequests.delete(response.request_id);
+                control.resolve(response);
+              } else if (
+                response.request_id &&
+                (!this.currentRequest || this.currentRequest.request.request_id !== response.request_id)
+              ) {
+                // Late answer for a request we already gave up on (timed out or cancelled)
+                logger.debug(`Ignoring stale OCR response for request ${response.request_id}`);
               } else if (this.currentRequest) {
+                // Errors (including fast SERVER_BUSY rejections) are answers too
                 this.currentRequest.resolve(response);
                 this.currentRequest = null;
                 this.processNextRequest();
+              } else if (response.status === 'error') {
+                logger.error('Python process error:', response.error);
+                reject(new Error(response.error));
               }
             } catch (err) {
               logger.error('Error parsing Python response:', err);
@@ -229,6 +247,13 @@ class OCRService {
       throw new OcrError('OCR service not ready or initialized');
     }
 
+    // Tag the request so the server can drop it once our deadline passes
+    request = {
+      ...request,
+      request_id: request.request_id || uuidv4(),
+      timeout_ms: request.timeout_ms || OCR_CONFIG.timeouts.processing
+    };
+
     return new Promise((resolve, reject) => {
       // Set a timeout for the individual request
       const requestTimeout = setTimeout(() => {
@@ -238,8 +263,9 @@ class OCRService {
         if (index > -1) {
           this.requestQueue.splice(index, 1);
         }
-        // If this was the current request, clear it
+        // If this was the current request, stop the server working on it and clear it
         if (this.currentRequest && this.currentRequest.request === request) {
+          this.cancelRequest(request.request_id);
           this.currentRequest = null;
           this.processNextRequest();
         }
@@ -261,6 +287,68 @@ class OCRService {
     });
   }
 
+  cancelRequest(requestId) {
+    if (!this.pythonProcess) {
+      return;
+    }
+    try {
+      this.pythonProcess.stdin.write(
+        JSON.stringify({ command: 'cancel', target_id: requestId, request_id: uuidv4() }) + '\n'
+      );
+    } catch (error) {
+      logger.warn(`Failed to send cancel for OCR request ${requestId}:`, error);
+    }
+  }
+
+  async sendControlRequest(request, timeout = OCR_CONFIG.timeouts.modelLoad) {
+    if (!this.isReady) {
+      throw new OcrError('OCR service not ready or initialized');
+    }
+
+    // Written straight to the server, which answers these without queueing,
+    // so a slow model load does not hold up OCR requests behind it
+    request = { ...request, request_id: uuidv4() };
+    return new Promise((resolve, reject) => {
+      const controlTimeout = setTimeout(() => {
+        this.controlRequests.delete(request.request_id);
+        reject(new OcrError(`OCR ${request.command} request timed out`));
+      }, timeout);
+
+      this.controlRequests.set(request.request_id, {
+        resolve: (result) => {
+          clearTimeout(controlTimeout);
+          resolve(result);
+        },
+        reject: (error) => {
+          clearTimeout(controlTimeout);
+          reject(error);
+        }
+      });
+      this.pythonProcess.stdin.write(JSON.stringify(request) + '\n');
+    });
+  }
+
+  async loadModel(modelName, { revision, version } = {}) {
+    const response = await this.sendControlRequest({
+      command: 'load_model',
+      model_name: modelName,
+      revision,
+      version
+    });
+    if (response.status !== 'success') {
+      throw new OcrError(`Failed to load OCR model ${modelName}: ${response.error}`);
+    }
+    return response;
+  }
+
+  async rollbackModel() {
+    const response = await this.sendControlRequest({ command: 'rollback' });
+    if (response.status !== 'success') {
+      throw new OcrError(`Failed to roll back OCR model: ${response.error}`);
+    }
+    return response;
+  }
+
   async processImage(imagePath) {
     await this.checkPath(imagePath, 'Image file for processing');
     return this.sendRequest({
@@ -269,14 +357,16 @@ class OCRService {
     });
   }
 
-  async processBatch(imagePaths, batchSize = 4) {
+  async processBatch(imagePaths, batchSize) {
     for (const p of imagePaths) {
       await this.checkPath(p, `Batch image file ${p}`);
     }
+    // Without an explicit batchSize the server tunes the batch size itself
     return this.sendRequest({
       command: 'process_batch',
       image_paths: imagePaths,
-      batch_size: batchSize
+      ...(batchSize ? { batch_size: batchSize } : {}),
+      priority: 'batch'
     });
   }
 
@@ -287,6 +377,14 @@ class OCRService {
     });
   }
 
+  // Extract fields from many OCR texts in one round trip; results come back in input order
+  async extractDataBatch(texts) {
+    return this.sendRequest({
+      command: 'extract_data_batch',
+      texts: texts
+    });
+  }
+
   async shutdown() {
     return new Promise((resolve) => {
       if (!this.pythonProcess) {